@@ -2,25 +2,38 @@
 # Professional Agricultural Voice Assistant with ChatGPT-like UI
 
 import streamlit as st
-import tempfile
 import os
 import base64
 import sounddevice as sd
 import numpy as np
 from scipy.io.wavfile import write
-import io
 from datetime import datetime
 import time
 import json
 import threading
-import wave
 from typing import Dict, List
 import html # For escaping user input to prevent HTML injection
 import re # To strip HTML tags from input
 
+from audio_processing import AudioRingBuffer, SilenceAutoStop, float_to_pcm16_inplace, pcm16_wav_bytes, trim_silence
+
+# Voice-activity detection for recordings (durations in ms; 0 disables the feature)
+VAD_TRIM_SILENCE = os.getenv("VAD_TRIM_SILENCE", "1") != "0"
+VAD_MAX_PAUSE_MS = int(os.getenv("VAD_MAX_PAUSE_MS", "700"))
+VAD_AUTO_STOP_MS = int(os.getenv("VAD_AUTO_STOP_MS", "2000"))
+
+# How often the page checks whether auto-stop ended a recording (seconds)
+AUTO_STOP_POLL_SECONDS = 0.5
+
+# Longest recording kept; beyond it only the most recent audio is retained
+RECORDING_MAX_SECONDS = float(os.getenv("RECORDING_MAX_SECONDS", "120"))
+
+# Region filter option that searches the whole knowledge base
+ALL_REGIONS = "All regions"
+
 # Import your existing agricultural assistant
 try:
-    from farm_bot import AgricultureAssistant  
+    from farm_bot import AgricultureAssistant, get_shared_backend
 except ImportError:
     st.error("❌ Could not import AgricultureAssistant. Make sure farm_bot.py is in the same directory.")
     st.stop()
@@ -405,12 +418,20 @@ def initialize_session_state():
         st.session_state.recorded_audio = None
     if 'recording_thread' not in st.session_state:
         st.session_state.recording_thread = None
+    if 'text_first' not in st.session_state:
+        st.session_state.text_first = os.getenv("RESPONSE_MODE", "audio") == "text"
+    if 'background_audio' not in st.session_state:
+        st.session_state.background_audio = True
+    if 'region_filter' not in st.session_state:
+        st.session_state.region_filter = ALL_REGIONS
 
 def load_assistant():
-    """Load the agricultural assistant"""
+    """Create this session's assistant on top of the process-wide backend"""
     try:
         with st.spinner("🌱 Initializing AgroAI Assistant..."):
-            assistant = AgricultureAssistant()
+            # Clients and the FAISS index are loaded once per process; each
+            # browser session only gets its own conversation state
+            assistant = AgricultureAssistant(backend=get_shared_backend())
             st.session_state.assistant = assistant
             st.session_state.assistant_ready = True
             return True
@@ -460,23 +481,38 @@ def load_assistant():
 class AudioRecorder:
     """Enhanced audio recorder with better error handling"""
     
-    def __init__(self, sample_rate=16000):
+    def __init__(self, sample_rate=16000, trim_silence=VAD_TRIM_SILENCE,
+                 max_pause_ms=VAD_MAX_PAUSE_MS, auto_stop_ms=VAD_AUTO_STOP_MS,
+                 max_seconds=RECORDING_MAX_SECONDS):
         self.sample_rate = sample_rate
         self.recording = False
-        self.audio_data = []
+        # Preallocated capture buffer: the callback copies each block in, no per-block arrays
+        self.audio_buffer = AudioRingBuffer(sample_rate, max_seconds=max_seconds)
         self.stream = None
+        # Silence handling: trim on stop, and stop capturing after a trailing pause
+        self.trim_silence = trim_silence
+        self.max_pause_ms = max_pause_ms or None
+        self.auto_stop_ms = auto_stop_ms
+        self.auto_stop = None
+        self.auto_stopped = False
     
     def start_recording(self):
         """Start recording audio"""
         try:
             self.recording = True
-            self.audio_data = []
+            self.audio_buffer.clear()
+            self.auto_stopped = False
+            self.auto_stop = SilenceAutoStop(self.sample_rate, silence_ms=self.auto_stop_ms) if self.auto_stop_ms else None
             
             def audio_callback(indata, frames, time, status):
                 if status:
                     st.warning(f"Audio status: {status}")
-                if self.recording:
-                    self.audio_data.append(indata.copy())
+                if self.recording and not self.auto_stopped:
+                    self.audio_buffer.append(indata[:, 0])
+                    # The farmer has finished speaking: stop capturing trailing silence
+                    if self.auto_stop is not None and self.auto_stop.update(indata[:, 0]):
+                        self.auto_stopped = True
+                        raise sd.CallbackStop
             
             self.stream = sd.InputStream(
                 channels=1,
@@ -499,38 +535,57 @@ class AudioRecorder:
                 self.stream.stop()
                 self.stream.close()
                 
-                if self.audio_data:
-                    # Convert to numpy array
-                    audio_array = np.concatenate(self.audio_data, axis=0)
-                    # Convert to int16 for WAV format
-                    audio_int16 = (audio_array * 32767).astype(np.int16)
-                    
-                    # Create WAV bytes
-                    wav_buffer = io.BytesIO()
-                    with wave.open(wav_buffer, 'wb') as wav_file:
-                        wav_file.setnchannels(1)
-                        wav_file.setsampwidth(2)  # 16-bit
-                        wav_file.setframerate(self.sample_rate)
-                        wav_file.writeframes(audio_int16.tobytes())
-                    
-                    wav_buffer.seek(0)
-                    return wav_buffer.getvalue()
+                if len(self.audio_buffer):
+                    # View of the captured samples, no copy
+                    audio_array = self.audio_buffer.view()
+                    if self.trim_silence:
+                        # Whisper time grows with silence, so cut it before uploading
+                        audio_array = trim_silence(audio_array, self.sample_rate, max_pause_ms=self.max_pause_ms)
+                        if not len(audio_array):
+                            return None
+                    # Convert to int16 for WAV format in place, then write header + samples in one copy
+                    audio_int16 = float_to_pcm16_inplace(audio_array)
+                    return pcm16_wav_bytes(audio_int16, self.sample_rate)
                     
         except Exception as e:
             st.error(f"❌ Error stopping recording: {str(e)}")
         
         return None
 
-def create_temp_audio_file(audio_bytes):
-    """Create a temporary audio file from bytes"""
+def finish_recording():
+    """Stop the active recording, transcribe it and answer the question; True when a question was processed"""
+    st.session_state.recording = False
+    recorder = st.session_state.pop("audio_recorder", None)
+    if recorder is None:
+        return False
+
+    audio_bytes = recorder.stop_recording()
+    if not audio_bytes:
+        st.error("❌ No audio recorded. Please try again.")
+        return False
     try:
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-        temp_file.write(audio_bytes)
-        temp_file.close()
-        return temp_file.name
+        # Transcribe the recorded WAV straight from memory
+        with st.spinner("🔄 Converting speech to text..."):
+            transcribed_text = st.session_state.assistant.speech_to_text(audio_bytes)
+
+        if transcribed_text and transcribed_text.strip():
+            # Process the transcribed question
+            return process_user_input(transcribed_text, is_audio=True)
+        st.error("❌ Could not transcribe audio. Please speak clearly and try again.")
     except Exception as e:
-        st.error(f"❌ Error creating temporary file: {str(e)}")
-        return None
+        st.error(f"❌ Error processing audio: {str(e)}")
+    return False
+
+
+@st.fragment(run_every=AUTO_STOP_POLL_SECONDS)
+def watch_auto_stop():
+    """Send the recording hands-free once the recorder has heard the farmer stop speaking"""
+    recorder = st.session_state.get("audio_recorder")
+    # The audio callback can't touch the page, so this fragment polls it and reruns the whole app
+    if st.session_state.recording and recorder is not None and recorder.auto_stopped:
+        st.session_state.auto_stop_pending = True
+        st.rerun()
+
 
 def display_audio_player(audio_bytes, key_suffix=""):
     """Display audio player with enhanced styling"""
@@ -579,6 +634,41 @@ def display_typing_indicator():
     </div>
     """, unsafe_allow_html=True)
 
+def display_bot_message(content, timestamp):
+    """Display a bot message bubble"""
+    # The bot message can contain newlines, so we replace them with <br> for HTML display
+    bot_content_html = content.replace('\n', '<br>')
+    st.markdown(f"""
+    <div class="bot-message">
+        <strong>🌾 AgroAI</strong><br>
+        {bot_content_html}
+        <div class="message-time">{timestamp}</div>
+    </div>
+    """, unsafe_allow_html=True)
+
+def stream_response(question):
+    """Render the answer progressively as it streams in and return the final response"""
+    typing_placeholder = st.empty()
+    with typing_placeholder.container():
+        display_typing_indicator()
+
+    response_mode = "text" if st.session_state.text_first else "audio"
+    region = None if st.session_state.region_filter == ALL_REGIONS else st.session_state.region_filter
+
+    response = None
+    answer_so_far = ""
+    for event in st.session_state.assistant.process_question_stream(question, response_mode=response_mode,
+                                                                    region=region):
+        if event["type"] == "transcript":
+            answer_so_far += event["text"]
+            with typing_placeholder.container():
+                display_bot_message(answer_so_far + " ▌", datetime.now().strftime("%H:%M"))
+        elif event["type"] == "response":
+            response = event["response"]
+
+    typing_placeholder.empty()
+    return response
+
 def display_chat_history():
     """Display chat history with enhanced UI"""
     if not st.session_state.chat_history:
@@ -622,38 +712,40 @@ def display_chat_history():
             
         else:
             # Bot message
-            # The bot message can contain newlines, so we replace them with <br> for HTML display
-            bot_content_html = message["content"].replace('\n', '<br>')
-            st.markdown(f"""
-            <div class="bot-message">
-                <strong>🌾 AgroAI</strong><br>
-                {bot_content_html}
-                <div class="message-time">{message["timestamp"]}</div>
-            </div>
-            """, unsafe_allow_html=True)
+            display_bot_message(message["content"], message["timestamp"])
             
-            # Display audio response
+            # Display audio response, or synthesize it on demand for text-first answers
             if message.get("audio_bytes"):
                 display_audio_player(message["audio_bytes"], f"response_{i}")
+            elif st.button("🔊 Listen", key=f"listen_{i}"):
+                with st.spinner("🔊 Preparing audio..."):
+                    message["audio_bytes"] = st.session_state.assistant.backend.synthesize_speech(message["content"])
+                if message["audio_bytes"]:
+                    st.rerun()
+                st.error("❌ Could not generate audio. Please try again.")
             
             # Display sources
             if message.get("sources") and len(message["sources"]) > 0:
                 with st.expander("📚 Knowledge Sources", expanded=False):
                     for j, source in enumerate(message["sources"][:3], 1):
-                        source_text = str(source)
+                        # Older conversations stored the bare Q&A text
+                        source_text = str(source["content"]) if isinstance(source, dict) else str(source)
                         preview = source_text[:200] + "..." if len(source_text) > 200 else source_text
+                        score = source.get("score") if isinstance(source, dict) else None
+                        score_label = f"<span>· relevance {score:.2f}</span>" if score is not None else ""
                         
                         st.markdown(f"""
                         <div class="source-card">
                             <div class="source-header">
                                 <span>📖</span>
                                 <span>Source {j}</span>
+                                {score_label}
                             </div>
                             <div class="source-content">{html.escape(preview)}</div>
                         </div>
                         """, unsafe_allow_html=True)
 
-def process_user_input(user_input, is_audio=False, audio_file_path=None):
+def process_user_input(user_input, is_audio=False):
     """Process user input with enhanced error handling"""
     # Clean user input to remove any accidental HTML tags
     cleaned_input = re.sub('<[^<]+?>', '', user_input)
@@ -666,22 +758,14 @@ def process_user_input(user_input, is_audio=False, audio_file_path=None):
         # Add the cleaned user message to chat
         add_message_to_chat("user", cleaned_input, is_audio=is_audio)
         
-        # Show typing indicator
-        typing_placeholder = st.empty()
-        with typing_placeholder.container():
-            display_typing_indicator()
-        
-        # Process the question
-        if is_audio and audio_file_path:
-            response = st.session_state.assistant.process_audio_question(audio_file_path)
-        else:
-            # Use the cleaned input for processing
-            response = st.session_state.assistant.process_question(cleaned_input)
-        
-        # Clear typing indicator
-        typing_placeholder.empty()
+        # Stream the answer; voice questions arrive here already transcribed
+        response = stream_response(cleaned_input)
         
         if response and "answer" in response:
+            # Text-first answers: start speech now so "Listen" is instant later
+            if not response.get("audio_bytes") and st.session_state.background_audio:
+                st.session_state.assistant.backend.synthesize_speech_in_background(response["answer"])
+
             # Add bot response to chat
             add_message_to_chat(
                 "bot", 
@@ -699,14 +783,6 @@ def process_user_input(user_input, is_audio=False, audio_file_path=None):
         st.error(f"❌ Error processing your question: {str(e)}")
         st.info("💡 Please check your connection and try again.")
         return False
-    
-    finally:
-        # Clean up temporary file if it exists
-        if audio_file_path and os.path.exists(audio_file_path):
-            try:
-                os.unlink(audio_file_path)
-            except:
-                pass
 
 def main():
     """Main application with ChatGPT-like interface"""
@@ -724,8 +800,6 @@ def main():
     if not st.session_state.assistant_ready:
         st.info("⚙️ Initializing AgroAI Assistant...")
         if load_assistant():
-            st.success("✅ AgroAI is ready to help you!")
-            time.sleep(1)
             st.rerun()
         else:
             st.stop()
@@ -744,13 +818,21 @@ def main():
         # ChatGPT-like input area
         input_container = st.container()
         with input_container:
+            # A recording auto-stopped at the end of speech is sent without a click
+            if st.session_state.pop("auto_stop_pending", False) and st.session_state.recording:
+                if finish_recording():
+                    st.rerun()
+
             # Recording status
             if st.session_state.recording:
                 st.markdown("""
                 <div class="recording-status">
-                    🔴 Recording... Click the microphone again to stop
+                    🔴 Recording... Your question is sent when you stop speaking, or click the microphone to send now
                 </div>
                 """, unsafe_allow_html=True)
+                recorder = st.session_state.get("audio_recorder")
+                if recorder is not None and recorder.auto_stop is not None:
+                    watch_auto_stop()
             
             # Input form
             with st.form("chat_form", clear_on_submit=True):
@@ -777,39 +859,9 @@ def main():
                 # Handle voice recording
                 if voice_clicked:
                     if st.session_state.recording:
-                        # Stop recording
-                        st.session_state.recording = False
-                        
-                        # Create recorder and get audio
-                        recorder = AudioRecorder()
-                        if hasattr(st.session_state, 'audio_recorder'):
-                            audio_bytes = st.session_state.audio_recorder.stop_recording()
-                            
-                            if audio_bytes:
-                                # Create temporary file
-                                temp_path = create_temp_audio_file(audio_bytes)
-                                
-                                if temp_path:
-                                    try:
-                                        # Transcribe audio
-                                        with st.spinner("🔄 Converting speech to text..."):
-                                            transcribed_text = st.session_state.assistant.speech_to_text(temp_path)
-                                        
-                                        if transcribed_text and transcribed_text.strip():
-                                            # Process the transcribed question
-                                            if process_user_input(transcribed_text, is_audio=True, audio_file_path=temp_path):
-                                                st.rerun()
-                                        else:
-                                            st.error("❌ Could not transcribe audio. Please speak clearly and try again.")
-                                    
-                                    except Exception as e:
-                                        st.error(f"❌ Error processing audio: {str(e)}")
-                            else:
-                                st.error("❌ No audio recorded. Please try again.")
-                        
-                        # Clean up
-                        if hasattr(st.session_state, 'audio_recorder'):
-                            del st.session_state.audio_recorder
+                        # Stop recording and send it
+                        if finish_recording():
+                            st.rerun()
                     
                     else:
                         # Start recording
@@ -849,10 +901,61 @@ def main():
                 <div class="stat-label">{label}</div>
             </div>
             """, unsafe_allow_html=True)
-        
+
+        # Live latency per pipeline stage, across every session of this process
+        if st.session_state.assistant:
+            stage_latency = st.session_state.assistant.backend.metrics.stage_percentiles()
+            request_latency = st.session_state.assistant.backend.metrics.request_percentiles()
+            if stage_latency:
+                rows = ["| Stage | p50 ms | p95 ms |", "|---|---:|---:|"]
+                for operation, latency in request_latency.items():
+                    rows.append(f"| **{operation}** | {latency['p50_ms']:.0f} | {latency['p95_ms']:.0f} |")
+                for stage, latency in stage_latency.items():
+                    rows.append(f"| {stage} | {latency['p50_ms']:.0f} | {latency['p95_ms']:.0f} |")
+                st.markdown("#### ⏱️ Latency")
+                st.markdown("\n".join(rows))
+            batching = st.session_state.assistant.backend.embedding_batcher_stats()
+            if batching and batching["batches"]:
+                st.caption(
+                    f"🧮 Embedding batches: {batching['mean_batch_size']} questions per call on average, "
+                    f"{batching['mean_queue_wait_ms']} ms queue wait, {batching['requests_per_second']} req/s over the last minute"
+                )
+
         # Controls
         st.markdown("### ⚙️ Controls")
-        
+
+        st.toggle(
+            "⚡ Text-first replies",
+            key="text_first",
+            help="Show the answer as text right away and generate the voice reply only when needed"
+        )
+        if st.session_state.text_first:
+            st.checkbox(
+                "Prepare audio in background",
+                key="background_audio",
+                help="Generate the voice reply after the text is shown, so Listen plays instantly"
+            )
+
+        partitions = st.session_state.assistant.backend.partitions if st.session_state.assistant else None
+        if partitions is not None:
+            st.selectbox(
+                "📍 Region",
+                [ALL_REGIONS] + partitions.labels("region"),
+                key="region_filter",
+                help="Only use advice for this region"
+            )
+
+        if st.session_state.assistant and st.button("📚 Reload Knowledge Base", use_container_width=True,
+                                                    help="Switch to the latest published index without a restart"):
+            backend = st.session_state.assistant.backend
+            try:
+                if backend.reload_vector_store():
+                    st.success(f"✅ Now using index version {backend.index_version}")
+                else:
+                    st.info("Knowledge base is already up to date")
+            except Exception as e:
+                st.error(f"❌ Could not load the new index: {e}")
+
         if st.button("🗑️ Clear Chat", use_container_width=True):
             st.session_state.chat_history = []
             if hasattr(st.session_state.assistant, 'clear_session_memory'):
@@ -0,0 +1,47 @@
+# array_store.py
+# Directories of .npy arrays that are memory-mapped read-only when loaded
+
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+META_FILE = "meta.json"
+
+
+def save_arrays(path: str, arrays: Dict[str, np.ndarray], meta: Optional[Dict] = None):
+    """
+    Write arrays as <path>/<name>.npy plus a meta.json
+
+    Args:
+        path: Directory to create (must not exist yet)
+        arrays: Arrays to store, by name (string arrays are stored as fixed-width unicode)
+        meta: Small JSON-serializable values stored next to the arrays
+    """
+    os.makedirs(path)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.asarray(array), allow_pickle=False)
+    with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as file:
+        json.dump(meta or {}, file)
+
+
+def load_arrays(path: str, mmap: bool = True) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    Read a directory written by save_arrays
+
+    Numeric arrays are memory-mapped read-only, so their pages are shared
+    between processes through the page cache and only read when touched.
+
+    Returns:
+        (arrays by name, meta)
+    """
+    with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as file:
+        meta = json.load(file)
+    arrays = {}
+    for name in os.listdir(path):
+        if name.endswith(".npy"):
+            arrays[name[:-4]] = np.load(
+                os.path.join(path, name), mmap_mode="r" if mmap else None, allow_pickle=False
+            )
+    return arrays, meta
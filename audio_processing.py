@@ -0,0 +1,425 @@
+# audio_processing.py
+# Audio helpers for voice questions: capture buffering, decoding, normalization,
+# silence trimming and upload encoding
+
+import io
+import struct
+import wave
+from math import gcd
+from typing import Optional, Tuple
+
+import numpy as np
+
+# soundfile (libsndfile) provides the FLAC and Opus encoders; without it uploads stay WAV
+try:
+    import soundfile as sf
+except (ImportError, OSError):
+    sf = None
+
+# Codecs accepted by encode_for_upload, with the file extension Groq uses to detect them
+UPLOAD_CODECS = {
+    "wav": ".wav",    # 16-bit PCM, no compression
+    "flac": ".flac",  # lossless
+    "opus": ".ogg",   # lossy, speech-optimized, low bitrate
+}
+
+# Default libsndfile compression level per codec (for Opus 0.95 is roughly 18 kbps speech)
+DEFAULT_COMPRESSION_LEVELS = {
+    "flac": 0.8,
+    "opus": 0.95,
+}
+
+# Sample rates the Opus encoder accepts
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# Voice-activity detection defaults
+VAD_FRAME_MS = 30           # analysis frame length
+VAD_MARGIN_DB = 12.0        # speech must be this far above the estimated noise floor
+VAD_MIN_SPEECH_DB = -50.0   # ...and above this absolute level (dBFS)
+VAD_PADDING_MS = 200        # silence kept around speech so word edges are not clipped
+
+# Whisper resamples everything to 16 kHz mono, so more than that is wasted upload
+DEFAULT_UPLOAD_SAMPLE_RATE = 16000
+
+
+def is_wav(data) -> bool:
+    """Check whether a bytes-like object starts with a RIFF/WAVE header"""
+    return len(data) >= 12 and bytes(data[:4]) == b"RIFF" and bytes(data[8:12]) == b"WAVE"
+
+
+def read_wav(wav_bytes) -> Tuple[np.ndarray, int]:
+    """
+    Decode 16-bit PCM WAV bytes
+
+    Args:
+        wav_bytes: WAV file contents
+
+    Returns:
+        (samples, sample_rate) with int16 samples shaped (frames, channels)
+    """
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wav_file:
+        if wav_file.getsampwidth() != 2:
+            raise ValueError(f"Only 16-bit PCM WAV is supported, got {8 * wav_file.getsampwidth()}-bit")
+        channels = wav_file.getnchannels()
+        sample_rate = wav_file.getframerate()
+        # Streaming writers leave nframes at 0xFFFFFFFF; readframes stops at the end of the data
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    samples = np.frombuffer(frames, dtype="<i2")
+    samples = samples[: len(samples) - len(samples) % channels]
+    return samples.reshape(-1, channels), sample_rate
+
+
+def write_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    """Encode mono float32 samples in [-1, 1] as 16-bit PCM WAV bytes"""
+    pcm = np.clip(samples, -1.0, 1.0)
+    pcm = (pcm * 32767).astype("<i2")
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)  # 16-bit
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm.tobytes())
+    return wav_buffer.getvalue()
+
+
+def float_to_pcm16_inplace(audio: np.ndarray) -> np.ndarray:
+    """
+    Convert float32 samples in [-1, 1] to 16-bit PCM inside their own memory
+
+    The int16 result occupies the first half of the float buffer, so no second
+    buffer of the recording's size is allocated. The input is destroyed.
+
+    Args:
+        audio: Writeable, C-contiguous mono float32 samples
+
+    Returns:
+        int16 view over the same memory
+    """
+    if audio.dtype != np.float32 or not audio.flags.c_contiguous or not audio.flags.writeable:
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+    np.multiply(audio, 32767.0, out=audio)
+    np.clip(audio, -32768.0, 32767.0, out=audio)
+
+    pcm = audio.view(np.int16)[:len(audio)]
+    # Sample i is written to bytes [2i, 2i+2) after float sample i was read from [4i, 4i+4).
+    # Going chunk by chunk, a chunk's output never overlaps input that is still unread
+    # (only the first chunk overlaps itself, which numpy resolves with a chunk-sized temp).
+    chunk = 65536
+    for start in range(0, len(audio), chunk):
+        np.copyto(pcm[start:start + chunk], audio[start:start + chunk], casting="unsafe")
+    return pcm
+
+
+def pcm16_wav_bytes(pcm: np.ndarray, sample_rate: int) -> bytes:
+    """Wrap mono int16 samples in a WAV header with a single copy"""
+    data_size = pcm.nbytes
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", data_size
+    )
+    return b"".join((header, pcm.astype("<i2", copy=False).data))
+
+
+class AudioRingBuffer:
+    """
+    Preallocated float32 capture buffer for the recorder callback.
+
+    Blocks are copied into one contiguous array instead of being kept as many
+    small arrays. The buffer doubles when full until it reaches max_seconds;
+    after that it wraps around and keeps the most recent max_seconds of audio.
+    """
+
+    def __init__(self, sample_rate: int, initial_seconds: float = 15, max_seconds: float = 120):
+        """
+        Args:
+            sample_rate: Sample rate of the incoming audio
+            initial_seconds: Capacity allocated up front
+            max_seconds: Hard cap on the buffered duration
+        """
+        self.sample_rate = sample_rate
+        self.max_capacity = max(1, int(sample_rate * max_seconds))
+        self._buffer = np.empty(min(self.max_capacity, max(1, int(sample_rate * initial_seconds))), dtype=np.float32)
+        self._write = 0
+        self._size = 0
+        self.dropped_samples = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def duration(self) -> float:
+        """Buffered audio in seconds"""
+        return self._size / self.sample_rate
+
+    def append(self, block: np.ndarray):
+        """Copy a block of mono samples into the buffer"""
+        block = block.reshape(-1)
+        n = len(block)
+        capacity = len(self._buffer)
+
+        # Grow while the data is still contiguous (i.e. before the first wrap)
+        if self._size + n > capacity and capacity < self.max_capacity:
+            new_capacity = capacity
+            while new_capacity < self._size + n and new_capacity < self.max_capacity:
+                new_capacity *= 2
+            grown = np.empty(min(new_capacity, self.max_capacity), dtype=np.float32)
+            grown[:self._size] = self._buffer[:self._size]
+            self._buffer = grown
+            capacity = len(grown)
+
+        if n >= capacity:
+            self.dropped_samples += self._size + n - capacity
+            self._buffer[:] = block[n - capacity:]
+            self._write, self._size = 0, capacity
+            return
+
+        first = min(n, capacity - self._write)
+        self._buffer[self._write:self._write + first] = block[:first]
+        self._buffer[:n - first] = block[first:]
+        overflow = max(0, self._size + n - capacity)
+        self.dropped_samples += overflow
+        self._write = (self._write + n) % capacity
+        self._size = min(self._size + n, capacity)
+
+    def view(self) -> np.ndarray:
+        """
+        Get the buffered samples in order, as a view into the buffer
+
+        Only after a wrap-around is the buffer rotated (once) to make it contiguous.
+        """
+        if self._size == len(self._buffer) and self._write:
+            self._buffer = np.roll(self._buffer, -self._write)
+            self._write = 0
+        return self._buffer[:self._size]
+
+    def clear(self):
+        """Forget the buffered audio, keeping the allocation"""
+        self._write = 0
+        self._size = 0
+        self.dropped_samples = 0
+
+
+def resample(audio: np.ndarray, sample_rate: int, target_rate: int) -> np.ndarray:
+    """Resample mono float32 audio with a polyphase filter"""
+    if sample_rate == target_rate:
+        return audio
+    from scipy.signal import resample_poly
+
+    divisor = gcd(sample_rate, target_rate)
+    return resample_poly(audio, target_rate // divisor, sample_rate // divisor).astype(np.float32)
+
+
+def normalize_audio(samples: np.ndarray, sample_rate: int,
+                    target_rate: int = DEFAULT_UPLOAD_SAMPLE_RATE) -> Tuple[np.ndarray, int]:
+    """
+    Downmix to mono float32 and resample to target_rate
+
+    Args:
+        samples: int16 or float samples, shaped (frames,) or (frames, channels)
+        sample_rate: Rate of the input samples
+        target_rate: Desired output rate (audio is never upsampled)
+
+    Returns:
+        (mono float32 samples in [-1, 1], output sample rate)
+    """
+    if samples.dtype == np.int16:
+        audio = samples.astype(np.float32) / 32768.0
+    else:
+        audio = samples.astype(np.float32, copy=False)
+
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+
+    if target_rate and sample_rate > target_rate:
+        audio = resample(audio, sample_rate, target_rate)
+        sample_rate = target_rate
+
+    return audio, sample_rate
+
+
+def encode_for_upload(wav_bytes, codec: str = "flac", target_rate: int = DEFAULT_UPLOAD_SAMPLE_RATE,
+                      compression_level: Optional[float] = None) -> Tuple[bytes, str]:
+    """
+    Re-encode a recorded WAV for a smaller transcription upload
+
+    The audio is downmixed to mono and downsampled to target_rate before encoding.
+
+    Args:
+        wav_bytes: 16-bit PCM WAV contents
+        codec: One of UPLOAD_CODECS ("wav", "flac" or "opus")
+        target_rate: Output sample rate (never upsampled)
+        compression_level: 0..1; for Opus higher means lower bitrate, for FLAC more effort
+            (defaults to DEFAULT_COMPRESSION_LEVELS)
+
+    Returns:
+        (encoded bytes, file extension for the upload name)
+    """
+    if codec not in UPLOAD_CODECS:
+        raise ValueError(f"codec must be one of {tuple(UPLOAD_CODECS)}, got {codec!r}")
+    if codec != "wav" and sf is None:
+        print(f"⚠️ soundfile is not installed, uploading WAV instead of {codec}")
+        codec = "wav"
+
+    samples, sample_rate = read_wav(wav_bytes)
+    audio, sample_rate = normalize_audio(samples, sample_rate, target_rate)
+
+    if codec == "wav":
+        return write_wav(audio, sample_rate), UPLOAD_CODECS["wav"]
+
+    if compression_level is None:
+        compression_level = DEFAULT_COMPRESSION_LEVELS[codec]
+
+    buffer = io.BytesIO()
+    if codec == "flac":
+        sf.write(buffer, audio, sample_rate, format="FLAC", subtype="PCM_16",
+                 compression_level=compression_level)
+    else:
+        if sample_rate not in OPUS_SAMPLE_RATES:
+            opus_rate = min((rate for rate in OPUS_SAMPLE_RATES if rate >= sample_rate), default=48000)
+            audio = resample(audio, sample_rate, opus_rate)
+            sample_rate = opus_rate
+        sf.write(buffer, audio, sample_rate, format="OGG", subtype="OPUS",
+                 compression_level=compression_level)
+    return buffer.getvalue(), UPLOAD_CODECS[codec]
+
+
+def frame_energy_db(audio: np.ndarray, sample_rate: int, frame_ms: int = VAD_FRAME_MS) -> Tuple[np.ndarray, int]:
+    """
+    RMS energy per frame in dBFS
+
+    Args:
+        audio: Mono float32 samples in [-1, 1]
+        sample_rate: Sample rate of audio
+        frame_ms: Frame length
+
+    Returns:
+        (energy per complete frame, frame length in samples)
+    """
+    frame_length = max(1, int(sample_rate * frame_ms / 1000))
+    frame_count = len(audio) // frame_length
+    frames = audio[: frame_count * frame_length].reshape(frame_count, frame_length)
+    power = np.einsum("ij,ij->i", frames, frames) / frame_length
+    return 10.0 * np.log10(power + 1e-12), frame_length
+
+
+def speech_frames(energy_db: np.ndarray, margin_db: float = VAD_MARGIN_DB,
+                  min_speech_db: float = VAD_MIN_SPEECH_DB) -> np.ndarray:
+    """Mark frames whose energy clears both the adaptive and the absolute threshold"""
+    if not len(energy_db):
+        return np.zeros(0, dtype=bool)
+    noise_floor = np.percentile(energy_db, 10)
+    return energy_db > max(noise_floor + margin_db, min_speech_db)
+
+
+def trim_silence(audio: np.ndarray, sample_rate: int, max_pause_ms: Optional[int] = None,
+                 padding_ms: int = VAD_PADDING_MS, frame_ms: int = VAD_FRAME_MS,
+                 margin_db: float = VAD_MARGIN_DB, min_speech_db: float = VAD_MIN_SPEECH_DB) -> np.ndarray:
+    """
+    Remove leading/trailing silence and optionally shorten long pauses
+
+    Args:
+        audio: Mono float32 samples in [-1, 1]
+        sample_rate: Sample rate of audio
+        max_pause_ms: Longest pause kept inside the speech (None keeps pauses as they are)
+        padding_ms: Silence kept before and after each stretch of speech
+        frame_ms: Analysis frame length
+        margin_db: Required distance above the estimated noise floor
+        min_speech_db: Absolute level speech must exceed
+
+    Returns:
+        Trimmed audio (a view of the input when only the ends are cut); empty if no speech was found
+    """
+    energy, frame_length = frame_energy_db(audio, sample_rate, frame_ms)
+    speech = speech_frames(energy, margin_db, min_speech_db)
+    if not speech.any():
+        return audio[:0]
+
+    # Widen speech by the padding so onsets and word endings survive
+    pad = int(round(padding_ms / frame_ms))
+    if pad:
+        speech = np.convolve(speech, np.ones(2 * pad + 1, dtype=np.int32), mode="same") > 0
+
+    voiced = np.flatnonzero(speech)
+    first, last = voiced[0], voiced[-1]
+    end = len(audio) if last == len(speech) - 1 else (last + 1) * frame_length
+
+    if max_pause_ms is None:
+        return audio[first * frame_length:end]
+
+    # Run-length encode the frame mask, then keep at most max_pause frames of each silent run
+    max_pause = max(1, int(round(max_pause_ms / frame_ms)))
+    keep = speech[first:last + 1].copy()
+    boundaries = np.flatnonzero(np.diff(keep.astype(np.int8))) + 1
+    starts = np.concatenate(([0], boundaries))
+    lengths = np.diff(np.concatenate((starts, [len(keep)])))
+    for start, length in zip(starts[~keep[starts]], lengths[~keep[starts]]):
+        if length > max_pause:
+            # Keep both ends of the pause so the speech either side stays intact
+            head = max_pause // 2
+            keep[start:start + head] = True
+            keep[start + length - (max_pause - head):start + length] = True
+        else:
+            keep[start:start + length] = True
+
+    frames = audio[first * frame_length:(last + 1) * frame_length].reshape(-1, frame_length)
+    trimmed = frames[keep].reshape(-1)
+    if end > (last + 1) * frame_length:
+        trimmed = np.concatenate((trimmed, audio[(last + 1) * frame_length:end]))
+    return trimmed
+
+
+class SilenceAutoStop:
+    """
+    Streaming end-of-speech detector for the recorder callback.
+
+    Fed one block of samples at a time, it reports True once speech has been heard
+    and has then been followed by silence_ms of continuous silence.
+    """
+
+    def __init__(self, sample_rate: int, silence_ms: int = 1500, min_speech_ms: int = 300,
+                 margin_db: float = VAD_MARGIN_DB, min_speech_db: float = VAD_MIN_SPEECH_DB):
+        """
+        Args:
+            sample_rate: Sample rate of the incoming blocks
+            silence_ms: Trailing silence that ends the recording
+            min_speech_ms: Speech needed before auto-stop can trigger
+            margin_db: Required distance above the running noise floor
+            min_speech_db: Absolute level speech must exceed
+        """
+        self.sample_rate = sample_rate
+        self.silence_ms = silence_ms
+        self.min_speech_ms = min_speech_ms
+        self.margin_db = margin_db
+        self.min_speech_db = min_speech_db
+        self.noise_db = None
+        self.speech_ms = 0.0
+        self.trailing_silence_ms = 0.0
+
+    def update(self, block: np.ndarray) -> bool:
+        """
+        Feed the next block of mono float32 samples
+
+        Returns:
+            True when the recording should stop
+        """
+        if not len(block):
+            return False
+        block = block.reshape(-1)
+        energy = 10.0 * np.log10(float(np.dot(block, block)) / len(block) + 1e-12)
+        duration_ms = 1000.0 * len(block) / self.sample_rate
+
+        if self.noise_db is None:
+            self.noise_db = energy
+
+        if energy > max(self.noise_db + self.margin_db, self.min_speech_db):
+            self.speech_ms += duration_ms
+            self.trailing_silence_ms = 0.0
+        else:
+            # Track the noise floor only on silent blocks, so speech doesn't raise it
+            self.noise_db = 0.95 * self.noise_db + 0.05 * energy
+            self.trailing_silence_ms += duration_ms
+
+        return self.speech_ms >= self.min_speech_ms and self.trailing_silence_ms >= self.silence_ms
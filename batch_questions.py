@@ -0,0 +1,72 @@
+"""
+Run a batch of questions through the assistant, e.g. regression sets, FAQ sweeps and answer audits
+
+Questions are answered independently (no conversation history) with
+AgricultureAssistant.process_questions. Results are appended to a JSON Lines
+file as they complete; re-running the same command after an interruption
+skips the questions already answered and retries the failed ones.
+
+Input: .jsonl (one {"question": ..., "id"?, "region"?, "topic"?} per line),
+a .json list of the same (or of strings), or a text file with one question per line.
+
+Usage:
+    python batch_questions.py questions.jsonl --output answers.jsonl [--mode text|audio]
+                              [--k 3] [--retrieval hybrid|vector|keyword] [--workers 8] [--chunk-size 64]
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Dict, Iterator, Union
+
+from farm_bot import RETRIEVAL_MODES, RESPONSE_MODES, AgricultureAssistant
+
+
+def iter_questions(path: str) -> Iterator[Union[str, Dict]]:
+    """Read questions from a JSON Lines, JSON list or plain text file"""
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith(".json"):
+            yield from json.load(file)
+            return
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            yield json.loads(line) if path.endswith((".jsonl", ".ndjson")) else line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a batch of questions into a resumable JSONL file")
+    parser.add_argument("questions", help="questions file (.jsonl, .json or one question per line)")
+    parser.add_argument("--output", required=True, help="JSON Lines file results are appended to")
+    parser.add_argument("--vector-db", default="faiss_index", help="vector database directory")
+    parser.add_argument("--mode", choices=RESPONSE_MODES, default="text", help="text answers, or transcript + speech")
+    parser.add_argument("--k", type=int, default=3, help="knowledge base entries per question")
+    parser.add_argument("--retrieval", choices=RETRIEVAL_MODES, help="retrieval mode (default: RETRIEVAL_MODE)")
+    parser.add_argument("--workers", type=int, help="answers generated in parallel (default: BATCH_WORKERS)")
+    parser.add_argument("--chunk-size", type=int, help="questions retrieved together (default: BATCH_CHUNK_SIZE)")
+    args = parser.parse_args()
+
+    assistant = AgricultureAssistant(args.vector_db)
+    started = time.perf_counter()
+    answered = failed = 0
+    for result in assistant.process_questions(
+        iter_questions(args.questions), response_mode=args.mode, k=args.k, retrieval_mode=args.retrieval,
+        max_workers=args.workers, chunk_size=args.chunk_size, output_path=args.output
+    ):
+        if result["error"]:
+            failed += 1
+            print(f"❌ {result['id']}: {result['error']}")
+        else:
+            answered += 1
+        if (answered + failed) % 50 == 0:
+            elapsed = time.perf_counter() - started
+            print(f"{answered + failed} done ({(answered + failed) / elapsed:.1f} questions/sec)")
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {answered} answered, {failed} failed in {elapsed:.1f}s; results in {args.output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
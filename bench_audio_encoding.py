@@ -0,0 +1,67 @@
+"""
+Benchmark the voice-question upload encodings on a sample recording.
+
+Reports the bytes each option would send to the transcription API and how long
+encoding takes. Run with: python bench_audio_encoding.py [--audio msft.wav]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from audio_processing import DEFAULT_UPLOAD_SAMPLE_RATE, UPLOAD_CODECS, encode_for_upload, read_wav
+
+
+def benchmark(wav_bytes: bytes, sample_rate: int, repeats: int):
+    """Encode the recording with every codec and collect size and timing results"""
+    samples, source_rate = read_wav(wav_bytes)
+    duration = len(samples) / source_rate
+
+    results = [{
+        "codec": "original",
+        "bytes": len(wav_bytes),
+        "kbps": round(len(wav_bytes) * 8 / duration / 1000, 1),
+        "ratio": 1.0,
+        "encode_ms": 0.0
+    }]
+    for codec in UPLOAD_CODECS:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            encoded, _ = encode_for_upload(wav_bytes, codec=codec, target_rate=sample_rate)
+            timings.append((time.perf_counter() - start) * 1000)
+        results.append({
+            "codec": codec,
+            "bytes": len(encoded),
+            "kbps": round(len(encoded) * 8 / duration / 1000, 1),
+            "ratio": round(len(wav_bytes) / len(encoded), 1),
+            "encode_ms": round(statistics.median(timings), 1)
+        })
+    return duration, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audio", default="msft.wav", help="16-bit PCM WAV recording to encode")
+    parser.add_argument("--sample-rate", type=int, default=DEFAULT_UPLOAD_SAMPLE_RATE, help="upload sample rate")
+    parser.add_argument("--repeats", type=int, default=5, help="encodes per codec (median is reported)")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.audio, "rb") as file:
+        wav_bytes = file.read()
+
+    duration, results = benchmark(wav_bytes, args.sample_rate, args.repeats)
+
+    print(f"🎧 {args.audio}: {duration:.1f} s, uploading at {args.sample_rate} Hz mono")
+    print(f"{'codec':<10}{'bytes':>12}{'kbps':>9}{'smaller':>10}{'encode ms':>12}")
+    for row in results:
+        print(f"{row['codec']:<10}{row['bytes']:>12,}{row['kbps']:>9}{row['ratio']:>9}x{row['encode_ms']:>12}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"audio": args.audio, "duration_s": round(duration, 2), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
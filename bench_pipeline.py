@@ -0,0 +1,487 @@
+"""
+End-to-end latency benchmark of the question pipeline against local stub services
+
+Starts a stand-in HTTP server for Azure OpenAI (embeddings, chat and audio
+completions) and Groq (Whisper transcription) with configurable latency and
+payload sizes. It builds a vector database from data.json through that server,
+then drives process_question, process_question_stream and process_audio_question
+(with msft.wav) from concurrent sessions. Stage timings come from each request's
+metrics trace; the streamed phase also reports time to the first answer chunk
+(first_chunk). Reports p50/p95/p99 per stage, throughput and peak RSS, and
+writes everything to a JSON file so runs can be compared.
+
+Every endpoint, key and base URL is pointed at the stub, and the embedding
+clients skip tiktoken's context-length check, so no API call leaves the
+machine. The conversation history still tries to load tiktoken's o200k_base
+encoding (downloaded once, then cached); offline it falls back to estimated
+token counts. Every request asks a distinct question (and the stub transcribes
+every recording differently) so the answer cache never short-cuts a stage,
+unless --warm-caches is given to measure repeated questions.
+
+Usage:
+    python bench_pipeline.py [--requests 40] [--concurrency 4] [--response-mode audio|text]
+                             [--embed-ms 40] [--chat-ms 600] [--audio-ms 1500] [--stt-ms 300] [--first-chunk-ms 250]
+                             [--answer-words 60] [--audio-seconds 8] [--dim 1536]
+                             [--output bench_pipeline.json] [--compare previous.json]
+"""
+import argparse
+import base64
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import PIPELINE_STAGES
+
+# Stages reported per request, in pipeline order; "total" is the end-to-end time seen by the caller
+STAGES = PIPELINE_STAGES + ("total",)
+
+# Sample rate of the raw pcm16 audio in streamed audio completions
+STREAM_SAMPLE_RATE = 24000
+
+
+# ---------------------------------------------------------------------------
+# Stub services
+# ---------------------------------------------------------------------------
+
+def stub_embedding(text, dim: int) -> np.ndarray:
+    """Deterministic unit vector for a text (or token list), so repeated texts embed identically"""
+    seed = int.from_bytes(hashlib.sha256(repr(text).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def silent_wav(seconds: float, sample_rate: int = 24000) -> bytes:
+    """A WAV file of silence, standing in for synthesized speech of the given length"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers Azure OpenAI and Groq API calls with canned payloads after a configured delay"""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, keep-alive clients
+    # would wait for a delayed ACK (~40 ms) on every call
+    disable_nagle_algorithm = True
+    config: Dict = {}
+    speech: bytes = b""
+    transcripts = itertools.count()
+
+    def log_message(self, format, *args):
+        pass
+
+    def latency(self, name: str) -> float:
+        """Configured latency of an endpoint in seconds, with jitter"""
+        jitter = self.config["jitter"]
+        return max(0.0, self.config[f"{name}_ms"] / 1000 * random.uniform(1 - jitter, 1 + jitter))
+
+    def delay(self, name: str):
+        time.sleep(self.latency(name))
+
+    def send_json(self, payload: Dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?", 1)[0]
+        if path.endswith("/embeddings"):
+            self.embeddings(json.loads(body))
+        elif path.endswith("/chat/completions"):
+            self.chat_completion(json.loads(body))
+        elif path.endswith("/audio/transcriptions"):
+            self.transcription()
+        else:
+            self.send_error(404, f"No stub for {path}")
+
+    def embeddings(self, request: Dict):
+        self.delay("embed")
+        inputs = request["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = []
+        for i, text in enumerate(inputs):
+            vector = stub_embedding(text, self.config["dim"])
+            # The OpenAI SDK asks for base64 unless told otherwise
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        self.send_json({
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "stub-embedding"),
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}
+        })
+
+    def send_event(self, payload):
+        """Write one server-sent event as an HTTP chunk"""
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        event = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+
+    def stream_completion(self, request: Dict, words: List[str], audio: bool):
+        """
+        Stream the answer a word at a time, as chat.completion.chunk events
+
+        The first chunk arrives after first_chunk_ms; the rest of the chat (or audio)
+        latency is spread evenly over the remaining chunks. Audio answers stream
+        transcript deltas together with raw pcm16 audio deltas.
+        """
+        total = self.latency("audio" if audio else "chat")
+        first = min(total, self.config["first_chunk_ms"] / 1000)
+        step = (total - first) / max(1, len(words) - 1)
+        pcm = b"\x00\x00" * int(self.config["audio_seconds"] * STREAM_SAMPLE_RATE)
+        piece = -(-len(pcm) // len(words)) if pcm else 0
+        # Whole samples only
+        piece += piece % 2
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": request.get("model", "stub-chat")}
+        for i, word in enumerate(words):
+            time.sleep(first if i == 0 else step)
+            text = word if i == len(words) - 1 else word + " "
+            if audio:
+                delta = {"audio": {"id": "audio_stub", "transcript": text}}
+                data = pcm[i * piece:(i + 1) * piece]
+                if data:
+                    delta["audio"]["data"] = base64.b64encode(data).decode("ascii")
+            else:
+                delta = {"content": text}
+            if i == 0:
+                delta["role"] = "assistant"
+            self.send_event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        self.send_event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self.send_event({**chunk, "choices": [],
+                             "usage": {"prompt_tokens": 1, "completion_tokens": len(words), "total_tokens": len(words) + 1}})
+        self.send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def chat_completion(self, request: Dict):
+        answer = " ".join(["Apply"] + ["fertilizer"] * (self.config["answer_words"] - 1)) + "."
+        if request.get("stream"):
+            self.stream_completion(request, answer.split(" "), "audio" in (request.get("modalities") or []))
+            return
+        message = {"role": "assistant", "content": answer}
+        if "audio" in (request.get("modalities") or []):
+            self.delay("audio")
+            message = {
+                "role": "assistant",
+                "content": None,
+                "audio": {
+                    "id": "audio_stub",
+                    "data": base64.b64encode(self.speech).decode("ascii"),
+                    "expires_at": int(time.time()) + 3600,
+                    "transcript": answer
+                }
+            }
+        else:
+            self.delay("chat")
+        self.send_json({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub-chat"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        })
+
+    def transcription(self):
+        self.delay("stt")
+        transcript = self.config["transcript"]
+        if self.config["unique_questions"]:
+            transcript += f" (recording {next(self.transcripts)})"
+        body = transcript.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_stub(port: int, config: Dict):
+    """Run the stub server (in its own process, so its memory isn't counted)"""
+    StubHandler.config = config
+    StubHandler.speech = silent_wav(config["audio_seconds"])
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer(("127.0.0.1", port), StubHandler).serve_forever()
+
+
+def start_stub(config: Dict) -> Tuple[multiprocessing.Process, str]:
+    """Start the stub server on a free port and wait until it accepts connections"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = multiprocessing.Process(target=serve_stub, args=(port, config), daemon=True)
+    process.start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError("Stub server did not start")
+
+
+def stub_environment(base_url: str) -> Dict[str, str]:
+    """Environment pointing every client at the stub (set before farm_bot is imported)"""
+    return {
+        "ENDPOINT_URL": base_url,
+        "AZURE_ENDPOINT_VB": base_url,
+        "AZURE_OPENAI_ENDPOINT": base_url,
+        "AZURE_OPENAI_API_KEY": "stub",
+        "AZURE_OPENAI_API_KEY_VB": "stub",
+        "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "stub-embedding",
+        "OPENAI_API_VERSION": "2024-12-01-preview",
+        "GROQ_API_KEY": "stub",
+        "GROQ_BASE_URL": base_url,
+        "INDEX_RELOAD_INTERVAL": "0",
+        "EMBEDDING_CACHE_PATH": "",
+        # Otherwise LangChain downloads tiktoken's cl100k_base encoding to split long texts
+        "EMBEDDING_CHECK_CTX_LENGTH": "false",
+        # Stub embeddings are random, so every match would fall below the score cutoffs
+        "RETRIEVAL_MIN_SCORE": "0",
+        "RETRIEVAL_RELATIVE_CUTOFF": "0",
+        "RETRIEVAL_MAX_SCORE_GAP": "0",
+    }
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def request_stages(response: Dict, total_ms: float) -> Dict[str, float]:
+    """
+    Stage timings (ms) of one request, read from the metrics trace attached to its response
+
+    Each stage is timed where it happens in the pipeline, so nested work such as
+    upload encoding before transcription is never counted twice.
+    """
+    stages = dict((response.get("metrics") or {}).get("stages_ms", {}))
+    stages["total"] = total_ms
+    return stages
+
+
+def percentiles(values: List[float]) -> Dict:
+    """p50/p95/p99/mean/max of a list of millisecond timings"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 1)
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 1),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 1)
+    }
+
+
+def consume_stream(events) -> Optional[Dict]:
+    """Read a streamed answer to the end and return its final response dict"""
+    response = None
+    for event in events:
+        if event["type"] == "response":
+            response = event["response"]
+    return response
+
+
+def run_phase(name: str, backend, request, count: int, concurrency: int) -> Dict:
+    """Send `count` requests through fresh sessions on `concurrency` threads and summarize the timings"""
+    from farm_bot import AgricultureAssistant
+
+    def one(i: int) -> Optional[Dict[str, float]]:
+        assistant = AgricultureAssistant(backend=backend)
+        started = time.perf_counter()
+        try:
+            response = request(assistant, i)
+        except Exception as e:
+            print(f"❌ {name} request {i} failed: {e}")
+            return None
+        if not response or response.get("error"):
+            return None
+        return request_stages(response, (time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(count)))
+    elapsed = time.perf_counter() - started
+
+    completed = [stages for stages in results if stages is not None]
+    return {
+        "requests": count,
+        "errors": count - len(completed),
+        "wall_seconds": round(elapsed, 2),
+        "throughput_rps": round(len(completed) / elapsed, 2) if elapsed else 0.0,
+        "stages_ms": {
+            stage: percentiles([stages[stage] for stages in completed if stage in stages])
+            for stage in STAGES
+            if any(stage in stages for stages in completed)
+        }
+    }
+
+
+def print_phase(name: str, phase: Dict, previous: Optional[Dict] = None):
+    print(f"\n{name}: {phase['requests']} requests, {phase['errors']} errors, "
+          f"{phase['throughput_rps']} req/s")
+    print(f"  {'stage':<14} {'p50':>9} {'p95':>9} {'p99':>9}" + (f" {'Δp50':>9}" if previous else ""))
+    for stage, stats in phase["stages_ms"].items():
+        line = f"  {stage:<14} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['p99']:>9.1f}"
+        before = (previous or {}).get("stages_ms", {}).get(stage)
+        if before:
+            line += f" {stats['p50'] - before['p50']:>+9.1f}"
+        print(line)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the question pipeline against local stub services")
+    parser.add_argument("--requests", type=int, default=40, help="requests per phase")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent sessions")
+    parser.add_argument("--response-mode", choices=("audio", "text"), default="audio")
+    parser.add_argument("--phases", default="question,question_stream,audio_question",
+                        help="comma-separated: question (process_question), question_stream "
+                             "(process_question_stream), audio_question (process_audio_question)")
+    parser.add_argument("--data", default="data.json", help="knowledge base to index and draw questions from")
+    parser.add_argument("--audio", default="msft.wav", help="recorded question for the audio phase")
+    parser.add_argument("--vector-db", help="existing vector database built with --dim embeddings (default: build one)")
+    parser.add_argument("--embed-ms", type=float, default=40, help="stub embedding latency")
+    parser.add_argument("--chat-ms", type=float, default=600, help="stub chat completion latency")
+    parser.add_argument("--audio-ms", type=float, default=1500, help="stub audio completion latency")
+    parser.add_argument("--stt-ms", type=float, default=300, help="stub transcription latency")
+    parser.add_argument("--first-chunk-ms", type=float, default=250,
+                        help="stub time to the first streamed chunk (the rest of the chat/audio latency follows)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="latency jitter, as a fraction")
+    parser.add_argument("--answer-words", type=int, default=60, help="words per generated answer")
+    parser.add_argument("--audio-seconds", type=float, default=8, help="length of the generated speech")
+    parser.add_argument("--dim", type=int, default=1536, help="embedding dimension")
+    parser.add_argument("--warm-caches", action="store_true",
+                        help="repeat the same questions, so the answer cache serves most of them")
+    parser.add_argument("--output", default="bench_pipeline.json", help="machine-readable results file")
+    parser.add_argument("--compare", help="earlier results file to show p50 differences against")
+    args = parser.parse_args()
+
+    config = {
+        "embed_ms": args.embed_ms, "chat_ms": args.chat_ms, "audio_ms": args.audio_ms, "stt_ms": args.stt_ms,
+        "first_chunk_ms": args.first_chunk_ms, "jitter": args.jitter, "answer_words": args.answer_words, "audio_seconds": args.audio_seconds,
+        "dim": args.dim, "transcript": "What is the recommended seed treatment for bajra before sowing?",
+        "unique_questions": not args.warm_caches
+    }
+    stub, base_url = start_stub(config)
+    print(f"Stub services on {base_url}")
+    os.environ.update(stub_environment(base_url))
+
+    with tempfile.TemporaryDirectory(prefix="bench-index-") as scratch:
+        vector_db = args.vector_db
+        if not vector_db:
+            vector_db = os.path.join(scratch, "faiss_index")
+            print("Building a vector database through the stub embeddings...")
+            subprocess.run([sys.executable, "vector_db_creation.py", "--data", args.data, "--output", vector_db],
+                           check=True, env=dict(os.environ), stdout=subprocess.DEVNULL)
+
+        from farm_bot import AgricultureAssistant, AssistantBackend
+
+        started = time.perf_counter()
+        backend = AssistantBackend(vector_db)
+        startup_ms = (time.perf_counter() - started) * 1000
+
+        with open(args.data, "r", encoding="utf-8") as file:
+            questions = [record["question"] for record in json.load(file)]
+        with open(args.audio, "rb") as file:
+            audio = file.read()
+
+        # Numbered across phases, so one phase never answers from another's cache
+        numbers = itertools.count()
+
+        def question(i: int) -> str:
+            text = questions[i % len(questions)]
+            return text if args.warm_caches else f"{text} (request {next(numbers)})"
+
+        requests = {
+            "question": lambda assistant, i: assistant.process_question(
+                question(i), response_mode=args.response_mode
+            ),
+            "question_stream": lambda assistant, i: consume_stream(assistant.process_question_stream(
+                question(i), response_mode=args.response_mode
+            )),
+            "audio_question": lambda assistant, i: assistant.process_audio_question(
+                audio, response_mode=args.response_mode
+            ),
+        }
+        previous = None
+        if args.compare:
+            with open(args.compare, "r", encoding="utf-8") as file:
+                previous = json.load(file)
+
+        report = {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "backend_startup_ms": round(startup_ms, 1),
+            "phases": {}
+        }
+        for name in [phase.strip() for phase in args.phases.split(",") if phase.strip()]:
+            if name not in requests:
+                parser.error(f"unknown phase {name!r}")
+            requests[name](AgricultureAssistant(backend=backend), -1)  # warm up
+            report["phases"][name] = run_phase(name, backend, requests[name], args.requests, args.concurrency)
+            print_phase(name, report["phases"][name], (previous or {}).get("phases", {}).get(name))
+
+        # ru_maxrss is in KiB on Linux (bytes on macOS); the stub runs in its own process
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report["peak_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+        print(f"\nBackend startup {report['backend_startup_ms']} ms, peak RSS {report['peak_rss_mb']} MB")
+
+    stub.terminate()
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Microbenchmark of knowledge base search paths
+
+Compares, per query:
+  - langchain:   FAISS.similarity_search_by_vector (Document objects from the docstore)
+  - faiss:       raw index.search plus one docstore lookup per result
+  - numpy:       ExactSearchEngine, one query per call
+  - numpy-batch: ExactSearchEngine, --batch queries per call
+  - faiss-batch: raw index.search, --batch queries per call, plus docstore lookups
+
+and checks that every path returns the same documents as the LangChain one.
+Runs on a synthetic corpus by default, or on a saved index with --index (no
+API calls: queries are perturbed copies of stored vectors).
+
+Usage:
+    python bench_search.py [--synthetic 20000] [--dim 1536] [--queries 500] [--k 3] [--batch 64]
+    python bench_search.py --index faiss_index [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import faiss
+import numpy as np
+from langchain.vectorstores import FAISS
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+
+from exact_search import ExactSearchEngine
+from index_versions import current_path
+from sqlite_docstore import DOCSTORE_FILE, SQLiteDocstore
+
+
+def synthetic_store(size: int, dim: int, seed: int = 0):
+    """LangChain FAISS store over random unit vectors with advisory-sized texts"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((size, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    filler = "Apply irrigation at critical growth stages and monitor soil moisture. " * 12
+    doc_ids = [str(i) for i in range(size)]
+    docstore = InMemoryDocstore({
+        doc_id: Document(id=doc_id, page_content=f"Advisory {doc_id}: {filler}", metadata={"id": doc_id})
+        for doc_id in doc_ids
+    })
+    vector_store = FAISS(None, index, docstore, dict(enumerate(doc_ids)))
+    engine = ExactSearchEngine.build(vectors, ((doc_id, docstore.search(doc_id).page_content) for doc_id in doc_ids))
+    return vector_store, engine, vectors
+
+
+def saved_store(path: str):
+    """LangChain FAISS store and engine over a saved (pickle-free) vector database"""
+    path = current_path(path)
+    index = faiss.read_index(os.path.join(path, "index.faiss"))
+    docstore = SQLiteDocstore(os.path.join(path, DOCSTORE_FILE))
+    vector_store = FAISS(None, index, docstore, docstore.position_map())
+    vectors = index.reconstruct_n(0, index.ntotal)
+    engine = ExactSearchEngine.build(vectors, docstore.iter_contents(), metric=index.metric_type)
+    return vector_store, engine, vectors
+
+
+def time_per_query(run: Callable[[np.ndarray], List[List[str]]], queries: np.ndarray,
+                   batch: int = 1) -> Dict:
+    """Run queries in calls of `batch`, returning per-query latency stats and the results"""
+    results, latencies = [], []
+    for start in range(0, len(queries), batch):
+        chunk = queries[start:start + batch]
+        started = time.perf_counter()
+        results.extend(run(chunk))
+        elapsed = time.perf_counter() - started
+        latencies.extend([elapsed / len(chunk)] * len(chunk))
+    latencies_us = sorted(latency * 1e6 for latency in latencies)
+    return {
+        "results": results,
+        "mean_us": statistics.fmean(latencies_us),
+        "p50_us": latencies_us[len(latencies_us) // 2],
+        "p95_us": latencies_us[min(int(len(latencies_us) * 0.95), len(latencies_us) - 1)],
+        "qps": len(queries) / sum(latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare LangChain, FAISS and NumPy search paths")
+    parser.add_argument("--index", help="saved vector database to search (default: synthetic corpus)")
+    parser.add_argument("--synthetic", type=int, default=20000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=1536, help="synthetic embedding dimension")
+    parser.add_argument("--queries", type=int, default=500, help="number of queries")
+    parser.add_argument("--k", type=int, default=3, help="results per query")
+    parser.add_argument("--batch", type=int, default=64, help="queries per call for the batched paths")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.index:
+        vector_store, engine, vectors = saved_store(args.index)
+    else:
+        vector_store, engine, vectors = synthetic_store(args.synthetic, args.dim)
+    index, docstore, index_to_docstore_id = vector_store.index, vector_store.docstore, vector_store.index_to_docstore_id
+    print(f"Corpus: {index.ntotal} vectors, dimension {index.d}; {args.queries} queries, k={args.k}")
+
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(0, len(vectors), args.queries)] + 0.05 * rng.standard_normal(
+        (args.queries, vectors.shape[1]), dtype=np.float32
+    )
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    def langchain_path(chunk):
+        return [
+            [doc.page_content for doc in vector_store.similarity_search_by_vector(query.tolist(), k=args.k)]
+            for query in chunk
+        ]
+
+    def faiss_path(chunk):
+        _, positions = index.search(chunk, args.k)
+        return [
+            [docstore.search(index_to_docstore_id[int(i)]).page_content for i in row if i != -1]
+            for row in positions
+        ]
+
+    def numpy_path(chunk):
+        _, positions = engine.search(chunk, args.k)
+        return [[engine.content(int(i)) for i in row if i != -1] for row in positions]
+
+    paths = [
+        ("langchain", langchain_path, 1),
+        ("faiss", faiss_path, 1),
+        ("numpy", numpy_path, 1),
+        ("numpy-batch", numpy_path, args.batch),
+        ("faiss-batch", faiss_path, args.batch),
+    ]
+    report = {"corpus": index.ntotal, "dimension": index.d, "queries": args.queries, "k": args.k,
+              "batch": args.batch, "paths": {}}
+    baseline = None
+    print(f"{'path':<12} {'mean µs':>10} {'p50 µs':>10} {'p95 µs':>10} {'qps':>10}  same results")
+    for name, run, batch in paths:
+        run(queries[:min(batch, len(queries))])  # warm up
+        stats = time_per_query(run, queries, batch=batch)
+        results = stats.pop("results")
+        if baseline is None:
+            baseline = results
+        mismatches = sum(result != expected for result, expected in zip(results, baseline))
+        stats["mismatches"] = mismatches
+        report["paths"][name] = stats
+        print(f"{name:<12} {stats['mean_us']:>10.1f} {stats['p50_us']:>10.1f} {stats['p95_us']:>10.1f} "
+              f"{stats['qps']:>10.0f}  {'yes' if not mismatches else f'{mismatches} differ'}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+# caching.py
+# Caches shared by all assistant sessions to skip repeated remote calls
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Normalize query text so trivially different spellings share a cache entry"""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings.
+
+    Tier 1 is a bounded in-memory LRU. Tier 2 is an optional SQLite file that keeps
+    vectors across restarts and can be shared by several worker processes.
+    """
+
+    def __init__(self, max_entries: int = 2048, persist_path: Optional[str] = None):
+        """
+        Args:
+            max_entries: Maximum number of vectors kept in memory (0 disables tier 1)
+            persist_path: SQLite file for the persistent tier, or None to keep it off
+        """
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(text: str, deployment: str) -> str:
+        """Build the cache key from the normalized query and the embedding deployment name"""
+        raw = f"{deployment or ''}\n{normalize_query(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """Return the cached vector for key, or None on a miss"""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector.tolist()
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    vector = array("f")
+                    vector.frombytes(row[0])
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector.tolist()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: List[float]):
+        """Store a vector in both tiers"""
+        packed = array("f", vector)
+        with self._lock:
+            self._remember(key, packed)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    (key, packed.tobytes())
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, vector: array):
+        """Insert into the in-memory LRU, evicting the oldest entries (lock must be held)"""
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Drop the in-memory tier (the persistent tier is left untouched)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Get hit/miss counters and size settings"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0
+            }
+
+
+class SemanticAnswerCache:
+    """
+    Cache of generated answers (transcript + WAV bytes) keyed on the query embedding.
+
+    A lookup returns the stored answer of the most similar cached question when the
+    cosine similarity clears the threshold. Entries expire after a TTL and the cache
+    is bounded both by entry count and by the total size of the stored audio.
+    Answers only match lookups with the same scope (e.g. the same region filter) and,
+    when given, the same keywords: short questions that differ only in the crop or
+    pest ("fertilizer for wheat" / "fertilizer for rice") can embed above any useful
+    threshold, so similarity alone is not trusted to tell them apart.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.97, ttl_seconds: float = 3600,
+                 max_entries: int = 256, max_audio_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            similarity_threshold: Minimum cosine similarity for a hit
+            ttl_seconds: Age after which an entry is no longer served
+            max_entries: Maximum number of cached answers
+            max_audio_bytes: Maximum total size of cached audio
+        """
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_audio_bytes = max_audio_bytes
+        self._entries = OrderedDict()
+        self._matrix = None  # stacked unit vectors, rebuilt lazily after changes
+        self._keys = []
+        self._scopes = None
+        self._keywords = []
+        self._lock = threading.Lock()
+        self._next_key = 0
+        self.audio_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def lookup(self, vector: List[float], scope: str = "", keywords: Optional[Iterable[str]] = None) -> Optional[Dict]:
+        """
+        Find a cached answer for a query embedding
+
+        Args:
+            vector: Query embedding
+            scope: Only answers stored with the same scope can match
+            keywords: Topic words of the question; only answers stored with the same set can match
+
+        Returns:
+            Dict with question, answer, audio_bytes, sources and similarity, or None
+        """
+        if self.max_entries <= 0:
+            return None
+        query = self._unit(vector)
+        keywords = frozenset(keywords) if keywords is not None else None
+        with self._lock:
+            self._expire()
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._matrix = np.stack([self._entries[k]["vector"] for k in self._keys])
+                self._scopes = np.array([self._entries[k]["scope"] for k in self._keys], dtype=object)
+                self._keywords = [self._entries[k]["keywords"] for k in self._keys]
+
+            similarities = self._matrix @ query
+            similarities[self._scopes != scope] = -np.inf
+            similarities[np.array([stored != keywords for stored in self._keywords])] = -np.inf
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            key = self._keys[best]
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return {
+                "question": entry["question"],
+                "answer": entry["answer"],
+                "audio_bytes": entry["audio_bytes"],
+                "sources": entry["sources"],
+                "similarity": round(similarity, 4)
+            }
+
+    def store(self, vector: List[float], question: str, answer: str,
+              audio_bytes: Optional[bytes], sources: List, scope: str = "",
+              keywords: Optional[Iterable[str]] = None):
+        """Add an answer to the cache, evicting least recently used entries to stay in bounds"""
+        if self.max_entries <= 0:
+            return
+        size = len(audio_bytes) if audio_bytes else 0
+        if size > self.max_audio_bytes:
+            return
+
+        with self._lock:
+            self._entries[self._next_key] = {
+                "vector": self._unit(vector),
+                "question": question,
+                "answer": answer,
+                "audio_bytes": audio_bytes,
+                "sources": sources,
+                "scope": scope,
+                "keywords": frozenset(keywords) if keywords is not None else None,
+                "created_at": time.monotonic()
+            }
+            self._next_key += 1
+            self.audio_bytes += size
+            self._matrix = None
+
+            while len(self._entries) > self.max_entries or self.audio_bytes > self.max_audio_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        """Remove one entry (lock must be held)"""
+        entry = self._entries.pop(key)
+        if entry["audio_bytes"]:
+            self.audio_bytes -= len(entry["audio_bytes"])
+        self._matrix = None
+
+    def _expire(self):
+        """Remove entries older than the TTL (lock must be held)"""
+        if self.ttl_seconds <= 0:
+            return
+        cutoff = time.monotonic() - self.ttl_seconds
+        stale = [key for key, entry in self._entries.items() if entry["created_at"] < cutoff]
+        for key in stale:
+            self._drop(key)
+            self.expirations += 1
+
+    def clear(self):
+        """Remove every cached answer"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self.audio_bytes = 0
+
+    def stats(self) -> Dict:
+        """Get hit/miss counters, size and eviction settings"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "audio_bytes": self.audio_bytes,
+                "max_audio_bytes": self.max_audio_bytes,
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+class SpeechCache:
+    """
+    LRU cache of synthesized speech (WAV bytes) keyed on the spoken text,
+    bounded by the total size of the stored audio.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: Maximum total size of cached audio
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        """Build the cache key from the exact text to be spoken"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached audio for key, or None on a miss"""
+        with self._lock:
+            audio_bytes = self._entries.get(key)
+            if audio_bytes is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return audio_bytes
+
+    def put(self, key: str, audio_bytes: bytes):
+        """Store audio, evicting least recently used entries to stay under max_bytes"""
+        if len(audio_bytes) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = audio_bytes
+            self.total_bytes += len(audio_bytes)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        """Get hit/miss counters and size settings"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,199 @@
+# conversation_memory.py
+# Token-budgeted conversation history: recent turns verbatim, older turns folded into a running summary
+
+import threading
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # optional: without it token counts are estimated from the text length
+    tiktoken = None
+
+# Tokenizer of the gpt-4o model family
+TOKEN_ENCODING = "o200k_base"
+
+# Tokens a chat message costs beyond its content (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                if tiktoken is not None:
+                    try:
+                        _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+                    except Exception as e:
+                        # e.g. the encoding file can't be downloaded on an offline machine
+                        print(f"⚠️ tiktoken unavailable, estimating token counts: {e}")
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in a text: exact with tiktoken, otherwise about four characters per token"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text down to at most max_tokens tokens"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def fallback_summary(summary: str, turns: List[Tuple[str, str]], max_tokens: int) -> str:
+    """Summary without a model call: the earlier questions, newest kept when space runs out"""
+    lines = ([summary] if summary else []) + [f"The farmer asked: {question.strip()}" for question, _ in turns]
+    kept: List[str] = []
+    used = 0
+    for line in reversed(lines):
+        tokens = count_tokens(line)
+        if kept and used + tokens > max_tokens:
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(reversed(kept))
+
+
+class ConversationMemory:
+    """
+    Conversation history that fits a token budget.
+
+    Token counts are computed once per turn as it is added. When the history
+    exceeds the budget, the oldest turns are moved out of the verbatim window
+    and folded into a running summary by a background summarizer, so the
+    prompt stays small and answering never waits for the summary. Until the
+    fold finishes, the moved turns are simply left out of the prompt.
+    """
+
+    def __init__(self, token_budget: int = 800, summary_tokens: int = 200, min_recent_turns: int = 1,
+                 summarize: Optional[Callable[[str, List[Tuple[str, str]], int], str]] = None,
+                 executor: Optional[Executor] = None):
+        """
+        Args:
+            token_budget: Most tokens of history (summary plus verbatim turns) sent with a question
+            summary_tokens: Target size of the running summary
+            min_recent_turns: Latest turns always kept verbatim, even over budget
+            summarize: (summary, [(question, answer), ...], max_tokens) -> new summary;
+                None folds turns with fallback_summary instead of a model
+            executor: Where summaries are computed; None computes them inline
+        """
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.min_recent_turns = max(0, min_recent_turns)
+        self.summarize = summarize
+        self.executor = executor
+
+        self.summary = ""
+        self._summary_token_count = 0
+        self._turns: List[Dict] = []
+        self._pending: List[Tuple[str, str]] = []
+        self._summarizing: Optional[Future] = None
+        # Bumped by clear() so a summary of the old conversation is discarded when it arrives
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self) -> int:
+        """Tokens of history that messages() currently returns"""
+        with self._lock:
+            return self._summary_token_count + sum(turn["tokens"] for turn in self._turns)
+
+    @property
+    def is_empty(self) -> bool:
+        """True before the first turn (and after clear)"""
+        with self._lock:
+            return not self._turns and not self._pending and not self.summary
+
+    def add_turn(self, question: str, answer: str):
+        """Add a question/answer pair, folding the oldest turns into the summary when over budget"""
+        tokens = count_tokens(question) + count_tokens(answer) + 2 * MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self._turns.append({"question": question, "answer": answer, "tokens": tokens})
+            job = self._evict()
+        if job is not None:
+            self._run_fold(*job)
+
+    def _evict(self):
+        """Move the oldest turns over budget out for summarization (lock held); returns the inline job, if any"""
+        total = self._summary_token_count + sum(turn["tokens"] for turn in self._turns)
+        while len(self._turns) > self.min_recent_turns and total > self.token_budget:
+            turn = self._turns.pop(0)
+            total -= turn["tokens"]
+            self._pending.append((turn["question"], turn["answer"]))
+        return self._start_fold()
+
+    def _start_fold(self):
+        """Take the pending turns for summarization (lock held); returns the inline job, if any"""
+        if not self._pending or self._summarizing is not None:
+            return None
+        turns, self._pending = self._pending, []
+        job = (self.summary, turns, self._generation)
+        if self.executor is None:
+            return job
+        self._summarizing = self.executor.submit(self._run_fold, *job)
+        return None
+
+    def _run_fold(self, summary: str, turns: List[Tuple[str, str]], generation: int):
+        new_summary = None
+        if self.summarize is not None:
+            try:
+                new_summary = self.summarize(summary, turns, self.summary_tokens)
+            except Exception as e:
+                print(f"⚠️ Could not summarize conversation, keeping earlier questions only: {e}")
+        if not new_summary:
+            new_summary = fallback_summary(summary, turns, self.summary_tokens)
+        # Models don't always respect the length asked for
+        new_summary = truncate_to_tokens(new_summary.strip(), self.summary_tokens)
+
+        with self._lock:
+            self._summarizing = None
+            # A summary of a cleared conversation is dropped, but turns the new one evicted meanwhile still need folding
+            if generation == self._generation:
+                self.summary = new_summary
+                self._summary_token_count = count_tokens(new_summary) + MESSAGE_OVERHEAD_TOKENS
+            # Turns evicted while this summary was being written go into the next one
+            job = self._evict()
+        if job is not None:
+            self._run_fold(*job)
+
+    def messages(self) -> List[Dict]:
+        """Chat messages for the history: the running summary (if any), then the recent turns"""
+        with self._lock:
+            messages = []
+            if self.summary:
+                messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+            for turn in self._turns:
+                messages.append({"role": "user", "content": turn["question"]})
+                messages.append({"role": "assistant", "content": turn["answer"]})
+            return messages
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until summaries being computed in the background are in place"""
+        while True:
+            with self._lock:
+                pending = self._summarizing
+            if pending is None:
+                return
+            pending.result(timeout=timeout)
+
+    def clear(self):
+        """Forget the whole conversation"""
+        with self._lock:
+            self._generation += 1
+            self.summary = ""
+            self._summary_token_count = 0
+            self._turns = []
+            self._pending = []
@@ -0,0 +1,209 @@
+# embedding_batcher.py
+# Collects concurrent query-embedding requests into batched API calls shared by all sessions
+
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Requests per second in stats() are measured over this recent window
+RATE_WINDOW_SECONDS = 60
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batching front end for an embedding model.
+
+    Callers submit single texts from any thread or event loop. A request that
+    arrives while nothing else is queued or in flight is sent at once, so an
+    idle server adds no delay. Otherwise a dispatcher thread waits up to
+    max_wait_ms after the first pending request for others to arrive, sends
+    them as one batched call (duplicates embedded once) and resolves each
+    caller's future with its own vector. Up to max_in_flight batches run at
+    once; while they do, new requests queue up and form the next, larger
+    batch, so batching grows with load.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]],
+                 max_batch_size: int = 64, max_wait_ms: float = 5.0, max_in_flight: int = 4):
+        """
+        Args:
+            embed_batch: Embeds a list of texts, returning one vector per text in order
+            max_batch_size: Most texts sent in one call
+            max_wait_ms: Longest a request waits for others to share its call
+            max_in_flight: Batched calls running at the same time
+        """
+        self.embed_batch = embed_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self.max_in_flight = max(1, max_in_flight)
+
+        self._queue: "queue.Queue[Optional[Tuple[str, Future, float]]]" = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embed-batch")
+        self._lock = threading.Lock()
+        self._closed = False
+        self._in_flight = 0
+
+        # Metrics
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.texts_sent = 0
+        self.largest_batch = 0
+        self.errors = 0
+        self.total_queue_wait = 0.0
+        self.total_batch_latency = 0.0
+        # [second, requests] for the last RATE_WINDOW_SECONDS
+        self._recent_requests: deque = deque()
+
+        self._dispatcher = threading.Thread(target=self._dispatch, name="embed-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for embedding; the future resolves to its vector"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("EmbeddingBatcher is closed")
+            self.requests += 1
+            now = time.monotonic()
+            second = int(now)
+            if self._recent_requests and self._recent_requests[-1][0] == second:
+                self._recent_requests[-1][1] += 1
+            else:
+                self._recent_requests.append([second, 1])
+            self._drop_old_requests(now)
+        self._queue.put((text, future, now))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        """Embed one text, sharing the API call with concurrent requests"""
+        return self.submit(text).result()
+
+    async def embed_async(self, text: str) -> List[float]:
+        """Async version of embed; the event loop is not blocked while the batch runs"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _drop_old_requests(self, now: float):
+        """Forget request counts older than the rate window (lock held)"""
+        while self._recent_requests and self._recent_requests[0][0] <= now - RATE_WINDOW_SECONDS:
+            self._recent_requests.popleft()
+
+    def _dispatch(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            with self._lock:
+                idle = self._in_flight == 0
+            # Nobody to wait for: an uncontended request goes out immediately
+            wait_ms = 0.0 if idle and self._queue.empty() else self.max_wait_ms
+            deadline = time.monotonic() + wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Closing: flush what was collected, then stop
+                    self._start_batch(batch)
+                    return
+                batch.append(item)
+
+            self._start_batch(batch)
+
+    def _start_batch(self, batch: List[Tuple[str, Future, float]]):
+        # Blocks while max_in_flight batches are running; requests keep queuing meanwhile
+        self._slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+        self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[Tuple[str, Future, float]]):
+        try:
+            # Callers that gave up (e.g. a cancelled async task) are dropped
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                return
+            started = time.monotonic()
+            # Concurrent farmers often ask the very same question
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = self.embed_batch(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"Embedding call returned {len(vectors)} vectors for {len(texts)} texts")
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                return
+
+            finished = time.monotonic()
+            by_text = dict(zip(texts, vectors))
+            with self._lock:
+                self.batches += 1
+                self.batched_requests += len(batch)
+                self.texts_sent += len(texts)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                self.total_queue_wait += sum(started - queued_at for _, _, queued_at in batch)
+                self.total_batch_latency += finished - started
+            for text, future, _ in batch:
+                future.set_result(by_text[text])
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def close(self):
+        """Send the requests already queued, then stop the dispatcher"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def collect_metrics(self) -> Dict[str, float]:
+        """Cumulative counters for the metrics registry (see metrics.MetricsRegistry.register_collector)"""
+        with self._lock:
+            return {
+                "embedding_requests_total": self.requests,
+                "embedding_batches_total": self.batches,
+                "embedding_batched_requests_total": self.batched_requests,
+                "embedding_texts_sent_total": self.texts_sent,
+                "embedding_batch_errors_total": self.errors,
+                "embedding_queue_wait_seconds_total": self.total_queue_wait,
+                "embedding_batch_seconds_total": self.total_batch_latency
+            }
+
+    def stats(self) -> Dict:
+        """Get batching settings, throughput counters and the request rate over the last RATE_WINDOW_SECONDS"""
+        with self._lock:
+            served = self.batched_requests
+            now = time.monotonic()
+            self._drop_old_requests(now)
+            window = min(RATE_WINDOW_SECONDS, now - self.started_at)
+            recent = sum(requests for _, requests in self._recent_requests)
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "max_in_flight": self.max_in_flight,
+                "requests": self.requests,
+                "batches": self.batches,
+                "texts_sent": self.texts_sent,
+                "errors": self.errors,
+                "mean_batch_size": round(served / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "mean_queue_wait_ms": round(self.total_queue_wait / served * 1000, 2) if served else 0.0,
+                "mean_batch_latency_ms": round(self.total_batch_latency / self.batches * 1000, 2) if self.batches else 0.0,
+                "requests_per_second": round(recent / window, 2) if window > 0 else 0.0
+            }
@@ -0,0 +1,126 @@
+# exact_search.py
+# In-process exact nearest-neighbour search over contiguous NumPy arrays, bypassing LangChain
+
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+# Rows of the query x corpus score matrix computed at once, to bound memory for large batches
+SCORE_BLOCK_ELEMENTS = 16 * 1024 * 1024
+
+
+class ExactSearchEngine:
+    """
+    Brute-force search with the same ranking as a flat FAISS index.
+
+    The embedding matrix, its squared norms and the page contents (one UTF-8
+    buffer plus offsets) are kept in contiguous arrays, so a search is one
+    matrix product and a partial sort, and the results need no docstore lookup
+    or Document objects. Meant for small and medium corpora that fit in memory.
+    """
+
+    def __init__(self, vectors: np.ndarray, doc_ids: Sequence[str], contents: np.ndarray,
+                 content_offsets: np.ndarray, metric: int = faiss.METRIC_L2):
+        """
+        Args:
+            vectors: Embedding matrix in FAISS position order (float32, may be memory-mapped)
+            doc_ids: Docstore id of each position
+            contents: UTF-8 bytes of every page content, back to back
+            content_offsets: Start of each position's content in `contents` (length len(vectors) + 1)
+            metric: faiss.METRIC_L2 or faiss.METRIC_INNER_PRODUCT, matching the FAISS index
+        """
+        if metric not in (faiss.METRIC_L2, faiss.METRIC_INNER_PRODUCT):
+            raise ValueError(f"Unsupported metric {metric}")
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.metric = metric
+        # ||x||^2 turns a dot product into an L2 distance up to the per-query constant ||q||^2
+        self.square_norms = np.einsum("ij,ij->i", self.vectors, self.vectors) if metric == faiss.METRIC_L2 else None
+        self.doc_ids = list(doc_ids)
+        self.positions = {doc_id: position for position, doc_id in enumerate(self.doc_ids)}
+        self.contents = contents
+        self.content_offsets = content_offsets
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, documents: Iterable[Tuple[str, str]],
+              metric: int = faiss.METRIC_L2) -> "ExactSearchEngine":
+        """
+        Build the engine from vectors and (docstore id, page content) pairs, both in FAISS position order
+        """
+        doc_ids, encoded = [], []
+        for doc_id, page_content in documents:
+            doc_ids.append(doc_id)
+            encoded.append(page_content.encode("utf-8"))
+        if len(doc_ids) != len(vectors):
+            raise ValueError(f"{len(doc_ids)} documents for {len(vectors)} vectors")
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(content) for content in encoded], out=offsets[1:])
+        contents = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(vectors, doc_ids, contents, offsets, metric=metric)
+
+    def search(self, queries: np.ndarray, k: int,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest documents for each query
+
+        Args:
+            queries: One query vector, or a (batch, dimension) matrix of them
+            k: Results per query
+            allowed: Sorted document positions to restrict the search to, or None for all
+
+        Returns:
+            (distances, positions), each (batch, k), best first, laid out like
+            faiss.Index.search: L2 distances or inner products, padded with -1
+            positions when fewer than k documents are searched
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        vectors, square_norms = self.vectors, self.square_norms
+        if allowed is not None:
+            vectors = vectors[allowed]
+            square_norms = square_norms[allowed] if square_norms is not None else None
+
+        batch, count = len(queries), len(vectors)
+        distances = np.full((batch, k), np.inf if self.metric == faiss.METRIC_L2 else -np.inf, dtype=np.float32)
+        positions = np.full((batch, k), -1, dtype=np.int64)
+        n = min(k, count)
+        if n <= 0:
+            return distances, positions
+
+        block = max(1, SCORE_BLOCK_ELEMENTS // max(count, 1))
+        for start in range(0, batch, block):
+            chunk = queries[start:start + block]
+            scores = chunk @ vectors.T
+            if self.metric == faiss.METRIC_L2:
+                # Ranked on ||x||^2 - 2 q.x; ||q||^2 is added back only for the returned distances
+                scores = square_norms - 2 * scores
+            else:
+                scores = -scores
+            if n < count:
+                top = np.argpartition(scores, n - 1, axis=1)[:, :n]
+            else:
+                top = np.broadcast_to(np.arange(count), (len(chunk), count))
+            # Ties go to the lower position, as in FAISS
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.lexsort((top, top_scores), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            if self.metric == faiss.METRIC_L2:
+                top_scores = top_scores + np.einsum("ij,ij->i", chunk, chunk)[:, None]
+            else:
+                top_scores = -top_scores
+            distances[start:start + len(chunk), :n] = top_scores
+            positions[start:start + len(chunk), :n] = allowed[top] if allowed is not None else top
+        return distances, positions
+
+    def content(self, position: int) -> str:
+        """Page content of the document at a position"""
+        start, end = self.content_offsets[position], self.content_offsets[position + 1]
+        return self.contents[start:end].tobytes().decode("utf-8")
+
+    def contents_for(self, doc_ids: Iterable[str]) -> List[str]:
+        """Page contents of documents by docstore id, skipping unknown ids"""
+        return [self.content(self.positions[doc_id]) for doc_id in doc_ids if doc_id in self.positions]
@@ -2,36 +2,488 @@
 # Core agricultural assistant module with RAG functionality and conversational memory
 
 import os
+import asyncio
 import base64
-from typing import List, Dict, Optional
+import io
+import itertools
+import json
+import time
+import wave
+import threading
+import weakref
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import List, Dict, Iterable, Iterator, Optional, Set, Tuple, Union
 from datetime import datetime
+import faiss
+import httpx
+import numpy as np
 from dotenv import load_dotenv
-from groq import Groq
+from groq import Groq, AsyncGroq
 # LangChain imports
 from langchain.vectorstores import FAISS
 from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
 
 # Azure OpenAI client for audio
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
+
+from audio_processing import UPLOAD_CODECS, encode_for_upload, is_wav
+from caching import EmbeddingCache, SemanticAnswerCache, SpeechCache
+from conversation_memory import ConversationMemory
+from embedding_batcher import EmbeddingBatcher
+from exact_search import ExactSearchEngine
+from index_versions import current_version, version_path
+from keyword_index import KEYWORD_INDEX_DIR, BM25Index, reciprocal_rank_fusion
+from metadata_index import PARTITIONS_DIR, MetadataPartitions, id_order_digest, normalize_value
+from query_router import CHIT_CHAT, FOLLOW_UP, NEW, SKIPPED_STAGES, QueryRouter, content_words, label_terms
+from metrics import REGISTRY, annotate, configure_json_log, count, current_trace, mark, span, start_http_server, timed_iter, traced
+from sqlite_docstore import DOCSTORE_FILE, PositionMap, SQLiteDocstore
+
+# Fallback answer when retrieval finds nothing relevant
+NO_CONTEXT_ANSWER = ("I couldn't find specific information for your question in our agricultural database. "
+                     "Please try rephrasing your question or ask about topics like crop cultivation, "
+                     "pest management, fertilizers, or farming techniques.")
+
+# Response modes: "audio" generates transcript and speech together, "text" returns
+# text first and leaves speech to synthesize_speech()
+RESPONSE_MODES = ("audio", "text")
+
+# Retrieval modes: "hybrid" fuses FAISS and BM25 rankings, "vector" is FAISS only and
+# "keyword" is BM25 only (no embedding call at all)
+RETRIEVAL_MODES = ("hybrid", "vector", "keyword")
+
+# Streamed audio arrives as raw 16-bit mono PCM at this rate
+STREAM_AUDIO_SAMPLE_RATE = 24000
 
 # Load environment variables
 load_dotenv()
-class AgricultureAssistant:
+
+
+def pcm16_to_wav(pcm: bytes, sample_rate: int = STREAM_AUDIO_SAMPLE_RATE) -> bytes:
+    """Wrap raw 16-bit mono PCM in a WAV container"""
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)  # 16-bit
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return wav_buffer.getvalue()
+
+
+def audio_upload(audio, filename: str = "audio.wav"):
+    """
+    Turn an audio input into a (filename, content) pair for the transcription upload
+
+    Args:
+        audio: File path, bytes/bytearray/memoryview, or a binary file-like object
+        filename: Name sent for in-memory audio (its extension tells the API the format)
+
+    Returns:
+        (filename, content) tuple with bytes content; file-like objects are passed through unread
+    """
+    if isinstance(audio, (str, os.PathLike)):
+        with open(audio, "rb") as file:
+            return os.path.basename(audio), file.read()
+    if isinstance(audio, memoryview):
+        # Reuse the underlying bytes object when the view covers all of it
+        if isinstance(audio.obj, bytes) and audio.contiguous and audio.nbytes == len(audio.obj):
+            return filename, audio.obj
+        return filename, audio.tobytes()
+    if isinstance(audio, bytes):
+        return filename, audio
+    if isinstance(audio, bytearray):
+        # The Groq SDK only accepts bytes or file objects as upload content
+        return filename, bytes(audio)
+    if hasattr(audio, "read"):
+        name = getattr(audio, "name", None)
+        return (os.path.basename(name) if isinstance(name, str) else filename), audio
+    raise TypeError(f"Unsupported audio input type: {type(audio).__name__}")
+
+
+def audio_completion_params(messages: List[Dict], audio_format: str = "wav") -> Dict:
+    """Request parameters for a spoken answer from the audio model"""
+    return {
+        "model": "gpt-4o-audio-preview",
+        "modalities": ["text", "audio"],
+        "audio": {
+            "voice": "alloy",
+            "format": audio_format
+        },
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1000,
+        "top_p": 1,
+        "frequency_penalty": 0,
+        "presence_penalty": 0,
+    }
+
+
+def faiss_search_params(index, selector=None, nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None):
+    """
+    Build per-call FAISS search parameters
+
+    Setting index.nprobe / efSearch on the shared index would retune it for every
+    session at once, so the knobs travel with each search instead.
+
+    Args:
+        index: The FAISS index to be searched
+        selector: faiss.IDSelector restricting the search, or None
+        nprobe: IVF lists to visit (IVF indexes only)
+        ef_search: HNSW candidate list size (HNSW indexes only)
+
+    Returns:
+        SearchParameters for index.search, or None when nothing needs setting
+    """
+    if selector is None and not nprobe and not ef_search:
+        return None
+    if isinstance(index, faiss.IndexPreTransform):
+        # e.g. "OPQ16,IVF1024,PQ16": the knobs belong to the wrapped index
+        inner = faiss_search_params(faiss.downcast_index(index.index), selector, nprobe, ef_search)
+        return faiss.SearchParametersPreTransform(index_params=inner) if inner is not None else None
+
+    params = {"sel": selector} if selector is not None else {}
+    if isinstance(index, faiss.IndexIVF):
+        if nprobe:
+            params["nprobe"] = nprobe
+        return faiss.SearchParametersIVF(**params)
+    if isinstance(index, faiss.IndexHNSW):
+        if ef_search:
+            params["efSearch"] = ef_search
+        return faiss.SearchParametersHNSW(**params)
+    return faiss.SearchParameters(**params) if params else None
+
+
+def doc_ids_at(index_to_docstore_id, positions: Iterable[int]) -> Dict[int, str]:
+    """
+    Docstore ids of several index positions
+
+    Args:
+        index_to_docstore_id: Position -> id mapping (a dict, a list, or the SQLite docstore's PositionMap)
+        positions: Index positions
+
+    Returns:
+        {position: docstore id}; with the SQLite docstore, looked up in a single query
+    """
+    if isinstance(index_to_docstore_id, PositionMap):
+        return index_to_docstore_id.get_many(positions)
+    return {position: index_to_docstore_id[position] for position in positions}
+
+
+def similarity_scores(distances: np.ndarray, metric: int) -> np.ndarray:
+    """
+    Cosine similarities from FAISS search distances (embeddings are unit length)
+
+    Args:
+        distances: Distances returned by the search, squared L2 or inner product
+        metric: faiss.METRIC_L2 or faiss.METRIC_INNER_PRODUCT
+
+    Returns:
+        Similarities, 1.0 for an identical vector
+    """
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        return distances
+    return 1.0 - distances / 2.0
+
+
+def adaptive_depth(scores: List[float], k: int, min_score: float = 0.0,
+                   relative_cutoff: float = 0.0, max_gap: float = 0.0) -> int:
+    """
+    How many of the top results are worth keeping, judged by their scores
+
+    Results are kept in order, up to k, while each one scores at least min_score,
+    at least relative_cutoff times the best score, and no more than max_gap below
+    the result before it. A cutoff of 0 is disabled.
+
+    Args:
+        scores: Result scores, best first
+        k: Most results to keep
+        min_score: Absolute score floor
+        relative_cutoff: Fraction of the best score a result must reach
+        max_gap: Largest drop allowed between consecutive results
+
+    Returns:
+        Number of leading results to keep (0 when even the best is below min_score)
+    """
+    depth = 0
+    for i, score in enumerate(scores[:k]):
+        if min_score and score < min_score:
+            break
+        if i and relative_cutoff and score < scores[0] * relative_cutoff:
+            break
+        if i and max_gap and scores[i - 1] - score > max_gap:
+            break
+        depth += 1
+    return depth
+
+
+def record_token_usage(usage):
+    """Add token usage (OpenAI usage object or LangChain usage_metadata dict) to the current request"""
+    if not usage:
+        return
+    if isinstance(usage, dict):
+        count("prompt_tokens", usage.get("input_tokens") or 0)
+        count("completion_tokens", usage.get("output_tokens") or 0)
+    else:
+        count("prompt_tokens", getattr(usage, "prompt_tokens", None) or 0)
+        count("completion_tokens", getattr(usage, "completion_tokens", None) or 0)
+
+
+def speech_synthesis_params(text: str) -> Dict:
+    """Request parameters for reading an existing answer aloud with the audio model"""
+    return {
+        "model": "gpt-4o-audio-preview",
+        "modalities": ["text", "audio"],
+        "audio": {
+            "voice": "alloy",
+            "format": "wav"
+        },
+        "messages": [
+            {"role": "system", "content": "Read the user's text aloud exactly as written. Do not add, drop or change any words."},
+            {"role": "user", "content": text}
+        ],
+        "temperature": 0.6,
+    }
+
+
+class AsyncClients:
+    """
+    Async API clients bound to one event loop.
+
+    All of them share a single pooled httpx.AsyncClient, so connections are kept
+    alive and reused across every request served from that loop.
+    """
+
+    def __init__(self, limits: httpx.Limits, timeout: httpx.Timeout):
+        self.http_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        self.audio = AsyncAzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version="2024-12-01-preview",
+            azure_endpoint=os.getenv("ENDPOINT_URL"),
+            http_client=self.http_client
+        )
+        self.embeddings = AsyncAzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY_VB"),
+            api_version="2024-12-01-preview",
+            azure_endpoint=os.getenv("AZURE_ENDPOINT_VB"),
+            http_client=self.http_client
+        )
+        self.chat = AsyncAzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version="2024-12-01-preview",
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            http_client=self.http_client
+        )
+        groq_api_key = os.getenv("GROQ_API_KEY")
+        self.groq = AsyncGroq(api_key=groq_api_key, http_client=self.http_client) if groq_api_key else None
+
+    async def aclose(self):
+        """Close the pooled connections"""
+        await self.http_client.aclose()
+
+
+def batch_item(position: int, entry: Union[str, Dict]) -> Dict:
+    """
+    Normalize one process_questions input (a question string or dict) to id/question/region/topic
+
+    An entry without a question gets an "error" message instead of raising, so it
+    becomes an error result and the rest of the batch carries on.
+    """
+    if isinstance(entry, str):
+        entry = {"question": entry}
+    if not isinstance(entry, dict):
+        entry = {}
+    return {
+        # Defaulting to the input position keeps ids stable when the same batch is re-run
+        "id": str(entry.get("id", position)),
+        "question": entry.get("question"),
+        "region": entry.get("region"),
+        "topic": entry.get("topic"),
+        "error": None if entry.get("question") else f"ValueError: Batch item {position} has no question"
+    }
+
+
+def batch_result_record(result: Dict) -> Dict:
+    """JSON-serializable form of a process_questions result (audio as base64 WAV)"""
+    record = {key: value for key, value in result.items() if key != "audio_bytes"}
+    if result.get("audio_bytes"):
+        record["audio_base64"] = base64.b64encode(result["audio_bytes"]).decode("ascii")
+    return record
+
+
+def write_batch_result(output, result: Dict):
+    """Append a process_questions result to its JSON Lines output, if any"""
+    if output is not None:
+        output.write(json.dumps(batch_result_record(result), ensure_ascii=False) + "\n")
+        output.flush()
+
+
+def open_batch_output(path: str):
+    """Open a process_questions output file for appending, after any line an interrupted run cut off"""
+    output = open(path, "a+b")
+    if output.tell() > 0:
+        output.seek(-1, os.SEEK_END)
+        if output.read(1) != b"\n":
+            output.write(b"\n")
+    output.close()
+    return open(path, "a", encoding="utf-8")
+
+
+def read_completed_ids(path: str) -> Set[str]:
+    """Ids with a successful result in a process_questions JSON Lines output file"""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut off by an interrupted run
+                continue
+            if record.get("error") is None and "id" in record:
+                completed.add(str(record["id"]))
+    return completed
+
+
+class IndexSnapshot:
+    """
+    One loaded version of the vector database: the FAISS store plus its keyword
+    index and region/topic partitions.
+
+    A search takes the backend's current snapshot once and uses only that, so a
+    reload swapping in a new version never mixes two versions in one search. The
+    old snapshot is freed when the last search holding it finishes.
+    """
+
+    def __init__(self, version: Optional[str], path: str, vector_store, digest: Optional[str]):
+        self.version = version
+        self.path = path
+        self.vector_store = vector_store
+        self.digest = digest
+        self.keyword_index = None
+        self.partitions = None
+        # Built on the first batched search (see AssistantBackend.exact_engine_for)
+        self.exact_engine: Optional[ExactSearchEngine] = None
+        self.exact_engine_checked = False
+        self.exact_engine_lock = threading.Lock()
+        # Crops, regions and topics of the knowledge base; naming a new one means a new search
+        self.subject_terms: Set[str] = set()
+
+
+class AssistantBackend:
+    """
+    Process-wide resources shared by every conversation: the Azure/Groq clients,
+    the embeddings model and the loaded vector store.
+
+    Building one is expensive (client setup plus a full FAISS load), so a process
+    should create it once and hand it to every AgricultureAssistant session.
+    """
+
     def __init__(self, vector_db_path: str = "faiss_index"):
         """
-        Initialize the Agriclutural Assistant
+        Initialize the shared backend
 
-        Args: 
+        Args:
         vector_db_path: path to the saved vector database
         """
         self.vector_db_path = vector_db_path
-        self.vector_store = None
-        self.session_memory = []
-        self.conversation_history = [] # For conversational context
+        self.snapshot: Optional[IndexSnapshot] = None
+        self.response_mode = os.getenv("RESPONSE_MODE", "audio")
+        if self.response_mode not in RESPONSE_MODES:
+            raise ValueError(f"RESPONSE_MODE must be one of {RESPONSE_MODES}, got {self.response_mode!r}")
+
+        # How the knowledge base is searched
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "hybrid")
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"RETRIEVAL_MODE must be one of {RETRIEVAL_MODES}, got {self.retrieval_mode!r}")
+        self.retrieval_candidates = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+        # Score cutoffs on the vector results (cosine similarity; 0 disables): below the floor a question
+        # gets the no-context answer without a model call, and fewer than k sources are used when scores drop off
+        self.retrieval_min_score = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.3"))
+        self.retrieval_relative_cutoff = float(os.getenv("RETRIEVAL_RELATIVE_CUTOFF", "0.8"))
+        self.retrieval_max_score_gap = float(os.getenv("RETRIEVAL_MAX_SCORE_GAP", "0.1"))
+        # Local routing: follow-ups reuse the previous context, small talk skips retrieval and generation
+        self.query_router = QueryRouter(max_new_terms=int(os.getenv("ROUTER_MAX_NEW_TERMS", "2")))
+        self.rrf_k = int(os.getenv("RRF_K", "60"))
+        # Default search-time knobs for approximate indexes (0 keeps the value saved in the index)
+        self.nprobe = int(os.getenv("FAISS_NPROBE", "0")) or None
+        self.ef_search = int(os.getenv("FAISS_EF_SEARCH", "0")) or None
+        # Memory-map the FAISS index instead of reading it into private memory
+        self.mmap_index = os.getenv("FAISS_MMAP", "true").lower() not in ("0", "false", "no")
+        # Flat indexes up to this size are searched by the in-process NumPy engine once a batched search
+        # has built it; it copies every document into memory, so it is off by default (0 always uses FAISS)
+        self.exact_search_max_vectors = int(os.getenv("EXACT_SEARCH_MAX_VECTORS", "0"))
+        # Batch question API: parallel generation calls, and questions retrieved together
+        self.batch_workers = int(os.getenv("BATCH_WORKERS", "8"))
+        self.batch_chunk_size = int(os.getenv("BATCH_CHUNK_SIZE", "64"))
+        # Seconds between checks for a newly published index version (0 disables hot reload)
+        self.index_reload_interval = float(os.getenv("INDEX_RELOAD_INTERVAL", "30"))
+        self.reload_lock = threading.Lock()
+        self.index_watcher = None
+        self.index_watcher_stop = threading.Event()
+
+        # How recorded WAV questions are re-encoded before the transcription upload
+        self.upload_codec = os.getenv("UPLOAD_AUDIO_CODEC", "flac")
+        if self.upload_codec not in UPLOAD_CODECS:
+            raise ValueError(f"UPLOAD_AUDIO_CODEC must be one of {tuple(UPLOAD_CODECS)}, got {self.upload_codec!r}")
+        self.upload_sample_rate = int(os.getenv("UPLOAD_SAMPLE_RATE", "16000"))
+        upload_compression_level = os.getenv("UPLOAD_COMPRESSION_LEVEL")
+        self.upload_compression_level = float(upload_compression_level) if upload_compression_level else None
+
+        # Background speech synthesis for text-first responses
+        self.speech_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("SPEECH_WORKERS", "2")),
+            thread_name_prefix="speech"
+        )
+        self.pending_speech = {}
+        self.pending_speech_lock = threading.Lock()
+
+        # Conversation history sent with each question: token budget, running summary size,
+        # and the workers that summarize older turns off the answering path
+        self.history_token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", "800"))
+        self.history_summary_tokens = int(os.getenv("HISTORY_SUMMARY_TOKENS", "200"))
+        self.summary_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("SUMMARY_WORKERS", "2")),
+            thread_name_prefix="summarize"
+        )
 
         # initialize all components
+        self.setup_metrics()
+        self.setup_http_pools()
         self.setup_azure_clients()
+        self.setup_embedding_batcher()
+        self.setup_caches()
         self.load_vector_store()
+        if self.index_reload_interval > 0:
+            self.start_index_watcher(self.index_reload_interval)
+
+    def setup_metrics(self):
+        """Setup per-stage request metrics and their export (Prometheus endpoint, JSON log)"""
+        # Shared by every backend of the process, like a Prometheus client's default registry
+        self.metrics = REGISTRY
+        metrics_log = os.getenv("METRICS_LOG", "")
+        if metrics_log:
+            configure_json_log(metrics_log, self.metrics)
+        metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        if metrics_port:
+            start_http_server(metrics_port, registry=self.metrics)
+            print(f"📈 Metrics served at http://localhost:{metrics_port}/metrics")
+
+    def setup_http_pools(self):
+        """Setup the keep-alive connection pools shared by every client and session"""
+        self.http_limits = httpx.Limits(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+        )
+        self.http_timeout = httpx.Timeout(
+            float(os.getenv("HTTP_TIMEOUT", "60")),
+            connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+        )
+        # Sync clients share one pool; async clients get one pool per event loop
+        self.http_client = httpx.Client(limits=self.http_limits, timeout=self.http_timeout)
+        self.async_clients_by_loop = weakref.WeakKeyDictionary()
+        self.async_clients_lock = threading.Lock()
 
     def setup_azure_clients(self):
         """Setup Azure OpenAI clients and models"""
@@ -40,128 +492,1022 @@ class AgricultureAssistant:
             self.audio_client = AzureOpenAI(
                 api_key=os.getenv("AZURE_OPENAI_API_KEY"),
                 api_version="2024-12-01-preview",
-                azure_endpoint=os.getenv("ENDPOINT_URL")
+                azure_endpoint=os.getenv("ENDPOINT_URL"),
+                http_client=self.http_client
             )
             # Embeddings for vector search (must match the ones used to create vector DB)
+            self.embedding_deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
             self.embeddings = AzureOpenAIEmbeddings(
-                azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
+                azure_deployment=self.embedding_deployment,
                 openai_api_version="2024-12-01-preview",
                 azure_endpoint=os.getenv("AZURE_ENDPOINT_VB"),
                 openai_api_key=os.getenv("AZURE_OPENAI_API_KEY_VB"),
-                chunk_size=1000
+                chunk_size=1000,
+                http_client=self.http_client,
+                # Token-length check with tiktoken, whose encoding files are downloaded on first use
+                check_embedding_ctx_length=os.getenv("EMBEDDING_CHECK_CTX_LENGTH", "true").lower() not in ("0", "false", "no")
             )
             
             # Chat model for generating responses
+            self.chat_deployment = os.getenv("CHAT_DEPLOYMENT", "gpt-4o-mini")
             self.chat_model = AzureChatOpenAI(
-                azure_deployment=os.getenv("CHAT_DEPLOYMENT", "gpt-4o-mini"),
+                azure_deployment=self.chat_deployment,
                 openai_api_version="2024-12-01-preview",
                 azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
                 openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
                 temperature=0.3,
-                max_tokens=600
+                max_tokens=600,
+                http_client=self.http_client
             )
 
+            # Groq client for speech-to-text (optional: only voice questions need it)
+            groq_api_key = os.getenv("GROQ_API_KEY")
+            self.groq_client = Groq(api_key=groq_api_key, http_client=self.http_client) if groq_api_key else None
+
             print("✅ Azure OpenAI clients initialized successfully")
     
         except Exception as e:
             print(f"❌ Error initializing Azure clients: {e}")
             raise
 
+    def setup_embedding_batcher(self):
+        """Setup the dispatcher that merges concurrent query embeddings into batched calls"""
+        max_batch_size = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+        # A batch size of 1 turns batching off: each query makes its own call as before
+        self.embedding_batcher = EmbeddingBatcher(
+            self.embeddings.embed_documents,
+            max_batch_size=max_batch_size,
+            max_wait_ms=float(os.getenv("EMBED_BATCH_WAIT_MS", "5")),
+            max_in_flight=int(os.getenv("EMBED_BATCH_IN_FLIGHT", "4"))
+        ) if max_batch_size > 1 else None
+        if self.embedding_batcher is not None:
+            self.metrics.register_collector(self.embedding_batcher)
+
+    def embedding_batcher_stats(self) -> Optional[Dict]:
+        """Batching settings and throughput of the query embedding batcher (None when batching is off)"""
+        return self.embedding_batcher.stats() if self.embedding_batcher is not None else None
+
+    def setup_caches(self):
+        """Setup the caches shared by all sessions"""
+        # Query embeddings: in-memory LRU, optionally backed by a SQLite file
+        self.embedding_cache = EmbeddingCache(
+            max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "2048")),
+            persist_path=os.getenv("EMBEDDING_CACHE_PATH") or None
+        )
+        # Generated answers (transcript + audio) keyed on the query embedding; a hit also needs
+        # the same topic words, filters and retrieval mode (see lookup_cached_answer)
+        self.answer_cache = SemanticAnswerCache(
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.97")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256")),
+            max_audio_bytes=int(float(os.getenv("ANSWER_CACHE_MAX_AUDIO_MB", "64")) * 1024 * 1024)
+        )
+        # Speech synthesized on demand for text-first answers, keyed on the text
+        self.speech_cache = SpeechCache(
+            max_bytes=int(float(os.getenv("SPEECH_CACHE_MAX_MB", "32")) * 1024 * 1024)
+        )
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query, serving repeated questions from the embedding cache
+
+        Args:
+            text: Query text
+
+        Returns:
+            Embedding vector
+        """
+        key = self.embedding_cache.make_key(text, self.embedding_deployment)
+        vector = self.embedding_cache.get(key)
+        if vector is None:
+            with span("embed"):
+                if self.embedding_batcher is not None:
+                    vector = self.embedding_batcher.embed(text)
+                else:
+                    vector = self.embeddings.embed_query(text)
+            self.embedding_cache.put(key, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed many queries with one API call for everything not already cached
+
+        Args:
+            texts: Query texts
+
+        Returns:
+            One embedding vector per text, in order
+        """
+        keys = [self.embedding_cache.make_key(text, self.embedding_deployment) for text in texts]
+        vectors = [self.embedding_cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            # embed_documents splits very long lists into chunk_size requests itself
+            with span("embed"):
+                embedded = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            for i, (text, key) in enumerate(zip(texts, keys)):
+                if vectors[i] is None:
+                    vectors[i] = embedded[text]
+                    self.embedding_cache.put(key, vectors[i])
+        return vectors
+
+    def async_clients(self) -> AsyncClients:
+        """Get the async clients for the running event loop, creating them on first use"""
+        loop = asyncio.get_running_loop()
+        with self.async_clients_lock:
+            clients = self.async_clients_by_loop.get(loop)
+            if clients is None:
+                clients = AsyncClients(self.http_limits, self.http_timeout)
+                self.async_clients_by_loop[loop] = clients
+            return clients
+
+    async def aclose(self):
+        """Close the async connection pool of the running event loop"""
+        with self.async_clients_lock:
+            clients = self.async_clients_by_loop.pop(asyncio.get_running_loop(), None)
+        if clients is not None:
+            await clients.aclose()
+
+    async def embed_query_async(self, text: str) -> List[float]:
+        """Async version of embed_query"""
+        key = self.embedding_cache.make_key(text, self.embedding_deployment)
+        vector = self.embedding_cache.get(key)
+        if vector is None:
+            with span("embed"):
+                if self.embedding_batcher is not None:
+                    # Shares batches with sync callers; the loop is free while the call runs
+                    vector = await self.embedding_batcher.embed_async(text)
+                else:
+                    result = await self.async_clients().embeddings.embeddings.create(
+                        model=self.embedding_deployment,
+                        input=[text]
+                    )
+                    vector = result.data[0].embedding
+            self.embedding_cache.put(key, vector)
+        return vector
+
+    @traced("summarize")
+    def summarize_conversation(self, summary: str, turns: List[Tuple[str, str]], max_tokens: int) -> str:
+        """
+        Fold conversation turns into the running summary with the chat model
+
+        Args:
+            summary: Current running summary ("" for none)
+            turns: (question, answer) pairs to add, oldest first
+            max_tokens: Target summary size
+
+        Returns:
+            The updated summary
+        """
+        exchanges = "\n".join(f"Farmer: {question}\nAdvisor: {answer}" for question, answer in turns)
+        messages = [
+            {"role": "system", "content": (
+                "You keep a running summary of a conversation between a farmer and an agricultural advisor. "
+                "Merge the new exchanges into the summary. Keep crops, regions, problems, schemes and the advice "
+                f"already given; drop greetings and repetition. Reply with the summary only, under {max_tokens} tokens."
+            )},
+            {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew exchanges:\n{exchanges}"}
+        ]
+        with span("summarize"):
+            message = self.chat_model.invoke(messages, max_tokens=max_tokens)
+        record_token_usage(getattr(message, "usage_metadata", None))
+        return message.content
+
+    def synthesize_speech(self, text: str) -> Optional[bytes]:
+        """
+        Turn an answer into spoken audio, reusing earlier synthesis of the same text
+
+        Args:
+            text: Answer text to read aloud
+
+        Returns:
+            WAV bytes, or None if synthesis failed
+        """
+        key = self.speech_cache.make_key(text)
+        audio_bytes = self.speech_cache.get(key)
+        if audio_bytes is not None:
+            return audio_bytes
+
+        # Join a background synthesis of the same text instead of starting another
+        with self.pending_speech_lock:
+            pending = self.pending_speech.get(key)
+        if pending is not None:
+            return pending.result()
+
+        return self._synthesize_and_cache(text)
+
+    @traced("speech_synthesis")
+    def _synthesize_and_cache(self, text: str) -> Optional[bytes]:
+        """Call the audio model to read text aloud and cache the result"""
+        key = self.speech_cache.make_key(text)
+        try:
+            with span("tts"):
+                completion = self.audio_client.chat.completions.create(**speech_synthesis_params(text))
+            record_token_usage(completion.usage)
+            with span("decode"):
+                audio_bytes = base64.b64decode(completion.choices[0].message.audio.data)
+            count("audio_response_bytes", len(audio_bytes))
+        except Exception as e:
+            print(f"❌ Error synthesizing speech: {e}")
+            return None
+
+        self.speech_cache.put(key, audio_bytes)
+        return audio_bytes
+
+    async def synthesize_speech_async(self, text: str) -> Optional[bytes]:
+        """Async version of synthesize_speech"""
+        key = self.speech_cache.make_key(text)
+        audio_bytes = self.speech_cache.get(key)
+        if audio_bytes is not None:
+            return audio_bytes
+
+        try:
+            with span("tts"):
+                completion = await self.async_clients().audio.chat.completions.create(**speech_synthesis_params(text))
+            record_token_usage(completion.usage)
+            with span("decode"):
+                audio_bytes = base64.b64decode(completion.choices[0].message.audio.data)
+            count("audio_response_bytes", len(audio_bytes))
+        except Exception as e:
+            print(f"❌ Error synthesizing speech: {e}")
+            return None
+
+        self.speech_cache.put(key, audio_bytes)
+        return audio_bytes
+
+    def synthesize_speech_in_background(self, text: str) -> Future:
+        """
+        Start synthesizing speech for an answer without blocking the caller
+
+        Args:
+            text: Answer text to read aloud
+
+        Returns:
+            Future resolving to the WAV bytes (or None on failure)
+        """
+        key = self.speech_cache.make_key(text)
+        with self.pending_speech_lock:
+            pending = self.pending_speech.get(key)
+            if pending is None:
+                pending = self.speech_executor.submit(self._synthesize_and_cache, text)
+                self.pending_speech[key] = pending
+                pending.add_done_callback(lambda _: self._forget_pending_speech(key))
+        return pending
+
+    def _forget_pending_speech(self, key: str):
+        with self.pending_speech_lock:
+            self.pending_speech.pop(key, None)
+
+    @property
+    def vector_store(self):
+        return self.snapshot.vector_store if self.snapshot else None
+
+    @property
+    def keyword_index(self) -> Optional[BM25Index]:
+        return self.snapshot.keyword_index if self.snapshot else None
+
+    @property
+    def partitions(self) -> Optional[MetadataPartitions]:
+        return self.snapshot.partitions if self.snapshot else None
+
+    @property
+    def index_version(self) -> Optional[str]:
+        return self.snapshot.version if self.snapshot else None
+
     def load_vector_store(self):
         """Load the pre-created vector datavase"""
+        self.snapshot = self.load_snapshot()
+
+    def load_snapshot(self) -> IndexSnapshot:
+        """Load the published version of the vector database, without touching the live one"""
 
         try:
             if not os.path.exists(self.vector_db_path):
                 raise FileNotFoundError(f"Vector database not found at {self.vector_db_path}")
-            
-            self.vector_store = FAISS.load_local(
-                self.vector_db_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
 
-            print(f"Vector database loaded")
+            version = current_version(self.vector_db_path)
+            path = version_path(self.vector_db_path, version)
+            docstore_path = os.path.join(path, DOCSTORE_FILE)
+            if os.path.exists(docstore_path):
+                index = self.read_index(os.path.join(path, "index.faiss"))
+                docstore = SQLiteDocstore(docstore_path)
+                if docstore.count != index.ntotal:
+                    raise ValueError(f"Docstore has {docstore.count} documents but the index has {index.ntotal} vectors")
+                # Documents are looked up lazily, so nothing but the index header is read here
+                vector_store = FAISS(self.embeddings, index, docstore, docstore.position_map())
+                snapshot = IndexSnapshot(version, path, vector_store, docstore.digest)
+            else:
+                print("⚠️ Loading a pickled vector database (re-run vector_db_creation.py for faster startup)")
+                vector_store = FAISS.load_local(
+                    path,
+                    self.embeddings,
+                    allow_dangerous_deserialization=True
+                )
+                snapshot = IndexSnapshot(version, path, vector_store, id_order_digest(self.indexed_doc_ids(vector_store)))
+
+            print(f"Vector database loaded ({type(vector_store.index).__name__}, "
+                  f"{vector_store.index.ntotal} vectors, version {version or 'unversioned'})")
 
         except Exception as e:
             print(f" Error loading vector database: {e}")
             raise
 
+        self.load_keyword_index(snapshot)
+        self.load_partitions(snapshot)
+        if snapshot.partitions is not None:
+            snapshot.subject_terms = label_terms(
+                snapshot.partitions.labels("region") + snapshot.partitions.labels("topic")
+            )
+        return snapshot
+
+    def reload_vector_store(self, force: bool = False) -> bool:
+        """
+        Swap in the published index version if it changed since it was loaded
+
+        The new version is loaded while searches keep running on the old one; the
+        swap itself is a single reference assignment. Searches already in flight
+        finish on the old version, which is freed once the last of them is done.
+
+        Args:
+            force: Reload even if the published version is the loaded one
+
+        Returns:
+            True if a new version was swapped in
+        """
+        with self.reload_lock:
+            version = current_version(self.vector_db_path)
+            if not force and self.snapshot is not None and version == self.snapshot.version:
+                return False
+
+            snapshot = self.load_snapshot()
+            previous, self.snapshot = self.snapshot, snapshot
+            # Cached answers were generated from the previous knowledge base
+            self.answer_cache.clear()
+
+        if previous is not None:
+            print(f"🔄 Switched to index version {snapshot.version} (was {previous.version or 'unversioned'})")
+            weakref.finalize(previous, print, f"Released index version {previous.version or 'unversioned'}")
+        return True
+
+    def start_index_watcher(self, interval: float):
+        """Check for a newly published index version every `interval` seconds in a background thread"""
+        if self.index_watcher is not None:
+            return
+        self.index_watcher_stop.clear()
+        self.index_watcher = threading.Thread(
+            target=self._watch_index, args=(interval,), name="index-watcher", daemon=True
+        )
+        self.index_watcher.start()
+
+    def stop_index_watcher(self):
+        """Stop the background index watcher"""
+        self.index_watcher_stop.set()
+        if self.index_watcher is not None:
+            self.index_watcher.join()
+            self.index_watcher = None
+
+    def _watch_index(self, interval: float):
+        while not self.index_watcher_stop.wait(interval):
+            try:
+                self.reload_vector_store()
+            except Exception as e:
+                # Keep serving the loaded version; the next check tries again
+                print(f"⚠️ Could not load the new index version, still serving {self.index_version}: {e}")
+
+    def read_index(self, path: str):
+        """Read a FAISS index, memory-mapped read-only when FAISS supports it"""
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) or getattr(faiss, "IO_FLAG_MMAP", 0)
+        if self.mmap_index and mmap_flag:
+            try:
+                # Vectors stay in the page cache, shared by every process serving this index
+                return faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                print(f"⚠️ Could not memory-map the FAISS index ({e}), reading it into memory")
+        return faiss.read_index(path)
+
+    @staticmethod
+    def indexed_doc_ids(vector_store) -> List[str]:
+        """Docstore ids of a loaded index, in index order"""
+        return [vector_store.index_to_docstore_id[i] for i in range(vector_store.index.ntotal)]
+
+    def indexed_documents(self, vector_store) -> Iterator:
+        """Stored documents of a loaded index, in index order"""
+        docstore = vector_store.docstore
+        if isinstance(docstore, SQLiteDocstore):
+            return (doc for _, doc in docstore.iter_documents())
+        return (docstore.search(doc_id) for doc_id in self.indexed_doc_ids(vector_store))
+
+    def load_keyword_index(self, snapshot: IndexSnapshot):
+        """Load the BM25 index saved with the vector database, building it from the docstore if missing"""
+        path = os.path.join(snapshot.path, KEYWORD_INDEX_DIR)
+        try:
+            if os.path.isdir(path):
+                keyword_index = BM25Index.load(path)
+                # Positions must line up with the FAISS index
+                if keyword_index.digest == snapshot.digest:
+                    snapshot.keyword_index = keyword_index
+                    print("Keyword index loaded")
+                    return
+                print("⚠️ Keyword index is out of date with the vector database, rebuilding it in memory")
+
+            # Indexes built before keyword search existed: index the stored search_text now
+            texts = []
+            for doc in self.indexed_documents(snapshot.vector_store):
+                metadata = getattr(doc, "metadata", {})
+                texts.append(metadata.get("search_text") or getattr(doc, "page_content", ""))
+            snapshot.keyword_index = BM25Index.build(texts, digest=snapshot.digest)
+            print("Keyword index built from the vector database (re-run vector_db_creation.py to save it)")
+        except Exception as e:
+            # Vector search still works without it
+            print(f"⚠️ Keyword search unavailable: {e}")
+            snapshot.keyword_index = None
+
+    def exact_engine_for(self, snapshot: IndexSnapshot) -> Optional[ExactSearchEngine]:
+        """The snapshot's NumPy search engine, built on first use (None when not enabled or not applicable)"""
+        if not snapshot.exact_engine_checked:
+            with snapshot.exact_engine_lock:
+                if not snapshot.exact_engine_checked:
+                    self.load_exact_engine(snapshot)
+                    snapshot.exact_engine_checked = True
+        return snapshot.exact_engine
+
+    def load_exact_engine(self, snapshot: IndexSnapshot):
+        """Set up the NumPy search engine for a flat index small enough to keep its contents in memory"""
+        index = snapshot.vector_store.index
+        # Approximate indexes would rank differently, so only flat ones get the fast path
+        if not isinstance(index, faiss.IndexFlat) or not 0 < index.ntotal <= self.exact_search_max_vectors:
+            return
+        try:
+            vectors_path = os.path.join(snapshot.path, "embeddings.npy")
+            vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+            if vectors is None or vectors.shape != (index.ntotal, index.d):
+                vectors = index.reconstruct_n(0, index.ntotal)
+
+            docstore = snapshot.vector_store.docstore
+            if isinstance(docstore, SQLiteDocstore):
+                documents = docstore.iter_contents()
+            else:
+                documents = (
+                    (doc_id, getattr(docstore.search(doc_id), "page_content", ""))
+                    for doc_id in self.indexed_doc_ids(snapshot.vector_store)
+                )
+            snapshot.exact_engine = ExactSearchEngine.build(vectors, documents, metric=index.metric_type)
+            print(f"Exact search engine ready ({index.ntotal} vectors)")
+        except Exception as e:
+            # Searches fall back to FAISS and the docstore
+            print(f"⚠️ Exact search engine unavailable: {e}")
+            snapshot.exact_engine = None
+
+    def load_partitions(self, snapshot: IndexSnapshot):
+        """Load the region/topic partitions saved with the vector database, building them if missing"""
+        path = os.path.join(snapshot.path, PARTITIONS_DIR)
+        try:
+            if os.path.isdir(path):
+                partitions = MetadataPartitions.load(path)
+                if partitions.digest == snapshot.digest:
+                    snapshot.partitions = partitions
+                    print("Region/topic partitions loaded")
+                    return
+                print("⚠️ Partitions are out of date with the vector database, rebuilding them in memory")
+
+            metadatas = (getattr(doc, "metadata", {}) for doc in self.indexed_documents(snapshot.vector_store))
+            snapshot.partitions = MetadataPartitions.build(metadatas, digest=snapshot.digest)
+            print("Region/topic partitions built from the vector database (re-run vector_db_creation.py to save them)")
+        except Exception as e:
+            print(f"⚠️ Region/topic filters unavailable: {e}")
+            snapshot.partitions = None
+
+
+# One backend per vector database path, shared by all sessions in this process
+_shared_backends: Dict[str, AssistantBackend] = {}
+_shared_backends_lock = threading.Lock()
+
+
+def get_shared_backend(vector_db_path: str = "faiss_index") -> AssistantBackend:
+    """
+    Return the process-wide backend for a vector database, creating it on first use
+
+    Args:
+        vector_db_path: path to the saved vector database
+
+    Returns:
+        The shared AssistantBackend instance
+    """
+    key = os.path.abspath(vector_db_path)
+    with _shared_backends_lock:
+        # Held while building so concurrent first sessions don't each load the index
+        if key not in _shared_backends:
+            _shared_backends[key] = AssistantBackend(vector_db_path)
+        return _shared_backends[key]
+
+
+class AgricultureAssistant:
+    def __init__(self, vector_db_path: str = "faiss_index", backend: Optional[AssistantBackend] = None,
+                 nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """
+        Initialize the Agriclutural Assistant for one conversation
+
+        Only the conversation state lives here; clients, embeddings and the
+        vector store come from the shared backend.
+
+        Args: 
+        vector_db_path: path to the saved vector database
+        backend: shared backend to use (defaults to the process-wide one for vector_db_path)
+        nprobe: IVF lists visited per search (higher = better recall, slower); defaults to FAISS_NPROBE
+        ef_search: HNSW search breadth (higher = better recall, slower); defaults to FAISS_EF_SEARCH
+        """
+        self.backend = backend or get_shared_backend(vector_db_path)
+        self.vector_db_path = self.backend.vector_db_path
+        self.nprobe = nprobe if nprobe is not None else self.backend.nprobe
+        self.ef_search = ef_search if ef_search is not None else self.backend.ef_search
+        self.session_memory = []
+        # Conversational context: recent turns verbatim, older ones summarized in the background
+        self.memory = ConversationMemory(
+            token_budget=self.backend.history_token_budget,
+            summary_tokens=self.backend.history_summary_tokens,
+            summarize=self.backend.summarize_conversation,
+            executor=self.backend.summary_executor
+        )
+        # Last turn answered from the knowledge base, for routing follow-ups
+        self.last_turn: Optional[Dict] = None
+
+    @property
+    def audio_client(self):
+        return self.backend.audio_client
+
+    @property
+    def embeddings(self):
+        return self.backend.embeddings
+
+    @property
+    def chat_model(self):
+        return self.backend.chat_model
 
-    def speech_to_text(self, audio_file) -> str:
+    @property
+    def vector_store(self):
+        return self.backend.vector_store
+
+    @property
+    def conversation_history(self) -> List[Dict]:
+        """History messages sent with the next question (running summary, then recent turns)"""
+        return self.memory.messages()
+
+    def classify_question(self, question: str, scope: str = "") -> Tuple[str, str]:
+        """
+        Route a question without reporting it
+
+        Args:
+            question: The farmer's question
+            scope: Region/topic filter of the question, from filter_scope
+
+        Returns:
+            (route, reason): "new", "follow_up" or "chit_chat" (see QueryRouter.route)
+        """
+        last = self.last_turn
+        snapshot = self.backend.snapshot
+        route, reason = self.backend.query_router.route(
+            question,
+            previous_question=last["question"] if last else None,
+            previous_answer=last["answer"] if last else None,
+            subject_terms=snapshot.subject_terms if snapshot is not None else None
+        )
+        if route == FOLLOW_UP and not last["sources"]:
+            return NEW, "no previous context to reuse"
+        if route == FOLLOW_UP and last.get("scope", "") != scope:
+            return NEW, "region/topic filter changed"
+        return route, reason
+
+    def route_question(self, question: str, scope: str = "") -> str:
+        """Route a question, reporting the decision and the latency it saves in the request metrics"""
+        route, reason = self.classify_question(question, scope)
+        saved_ms = 0.0
+        if SKIPPED_STAGES[route]:
+            # Estimated from the recent median of the stages this route skips
+            stage_latency = self.backend.metrics.stage_percentiles()
+            saved_ms = sum(stage_latency.get(stage, {}).get("p50_ms", 0.0) for stage in SKIPPED_STAGES[route])
+            self.backend.metrics.inc("route_saved_seconds_total", saved_ms / 1000, route=route)
+        self.backend.metrics.inc("routed_questions_total", route=route)
+        annotate(route=route, route_reason=reason, route_saved_ms=round(saved_ms, 1))
+        return route
+
+    def is_follow_up(self, question: str, scope: str = "") -> bool:
+        """Check whether a question depends on the ongoing conversation"""
+        return self.classify_question(question, scope)[0] == FOLLOW_UP
+
+    def should_use_answer_cache(self, question: str, route: Optional[str] = None) -> bool:
+        """Check whether the semantic answer cache applies to a question"""
+        # Follow-ups depend on the conversation, so a cached answer would be wrong, and
+        # small talk is answered locally. Cache lookups need an embedding, which
+        # keyword-only retrieval avoids.
+        route = route or self.classify_question(question)[0]
+        return self.backend.retrieval_mode != "keyword" and route == NEW
+
+    def retrieve_context(self, question: str, route: str, k: int = 3,
+                         region: Optional[str] = None, topic: Optional[str] = None) -> List:
+        """Knowledge base context for a routed question: a new search only for new questions"""
+        if route == CHIT_CHAT:
+            return []
+        if route == FOLLOW_UP:
+            return self.last_turn["sources"]
+        return self.search_knowledge_base(question, k=k, region=region, topic=topic)
+
+    def answer_cache_scope(self, scope: str = "") -> str:
+        """Answer cache scope: the filter scope plus the retrieval mode the answer was built with"""
+        snapshot = self.backend.snapshot
+        mode = self.resolve_retrieval_mode(None, snapshot) if snapshot is not None else self.backend.retrieval_mode
+        return f"retrieval={mode}|{scope}"
+
+    def lookup_cached_answer(self, question: str, scope: str = "",
+                             query_vector: Optional[List[float]] = None) -> Optional[Dict]:
+        """
+        Look up a previously generated answer for a semantically equivalent question
+
+        A hit needs ANSWER_CACHE_THRESHOLD similarity, the same filters and retrieval
+        mode, and the same topic words (so "for wheat" never gets the answer "for rice").
+
+        Args:
+            question: The farmer's question
+            scope: Filter scope of the search (see filter_scope)
+            query_vector: The question's embedding, if already computed
+
+        Returns:
+            Cached answer dict, or None on a miss
+        """
+        try:
+            if query_vector is None:
+                query_vector = self.backend.embed_query(question)
+            return self.backend.answer_cache.lookup(query_vector, scope=self.answer_cache_scope(scope),
+                                                    keywords=content_words(question))
+        except Exception as e:
+            print(f"Error looking up answer cache: {e}")
+            return None
+
+    def store_cached_answer(self, question: str, answer: str, audio_bytes: Optional[bytes],
+                            relevant_context: List, query_vector: Optional[List[float]] = None,
+                            scope: str = ""):
+        """Store a freshly generated answer in the shared semantic answer cache"""
+        # Fallback answers (nothing retrieved) are cheap and not worth caching
+        if not relevant_context:
+            return
+        try:
+            if query_vector is None:
+                query_vector = self.backend.embed_query(question)
+            self.backend.answer_cache.store(query_vector, question, answer, audio_bytes, relevant_context,
+                                            scope=self.answer_cache_scope(scope), keywords=content_words(question))
+        except Exception as e:
+            print(f"Error storing answer in cache: {e}")
+
+    def prepare_audio_upload(self, audio_file, filename: str = "audio.wav"):
+        """
+        Build the transcription upload, re-encoding WAV audio with the configured codec
+
+        WAV input is downmixed to mono, downsampled and compressed (FLAC by default);
+        anything else is uploaded unchanged.
+
+        Returns:
+            (filename, content) tuple for the Groq upload
+        """
+        name, content = audio_upload(audio_file, filename)
+        if isinstance(content, bytes):
+            count("audio_input_bytes", len(content))
+        if not isinstance(content, bytes) or not is_wav(content):
+            return name, content
+        try:
+            with span("upload_encode"):
+                encoded, extension = encode_for_upload(
+                    content,
+                    codec=self.backend.upload_codec,
+                    target_rate=self.backend.upload_sample_rate,
+                    compression_level=self.backend.upload_compression_level
+                )
+        except Exception as e:
+            print(f"⚠️ Could not re-encode audio, uploading original: {e}")
+            return name, content
+        return os.path.splitext(name)[0] + extension, encoded
+
+    @traced("transcription")
+    def speech_to_text(self, audio_file, filename: str = "audio.wav") -> str:
         """
         Convert speech to text using GROQ whisper
          
         Args: 
-            audio_file: Audio file path
+            audio_file: Audio file path, raw audio bytes/memoryview, or a binary file-like object
+            filename: Upload name for in-memory audio (the extension tells Groq the format)
              
         Returns:
             Transcribed text
         """
         try:
-            client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-            with open(audio_file, "rb") as file:
-                # Fixed: Using correct API method for transcription
+            client = self.backend.groq_client
+            if client is None:
+                raise ValueError("GROQ_API_KEY is not set")
+            # In-memory audio is uploaded as-is, without a round trip through a temp file
+            upload = self.prepare_audio_upload(audio_file, filename)
+            if isinstance(upload[1], bytes):
+                count("audio_upload_bytes", len(upload[1]))
+            with span("stt"):
                 transcription = client.audio.transcriptions.create(
-                    file=(os.path.basename(audio_file), file.read()),
+                    file=upload,
                     model="whisper-large-v3-turbo",
                     response_format="text"
                 )
-                # Return the actual text from the transcription object
-                return str(transcription) if transcription else ""
+            # Return the actual text from the transcription object
+            return str(transcription) if transcription else ""
         except Exception as e:
             print(f"❌ Error in speech-to-text: {e}")
             return ""
 
-    def search_knowledge_base(self, query: str, k: int = 2) -> List[Dict]:
+    def resolve_retrieval_mode(self, retrieval_mode: Optional[str], snapshot: Optional[IndexSnapshot] = None) -> str:
+        """Pick the retrieval mode for a search, defaulting to the backend setting"""
+        snapshot = snapshot or self.backend.snapshot
+        mode = retrieval_mode or self.backend.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"retrieval_mode must be one of {RETRIEVAL_MODES}, got {mode!r}")
+        if mode != "vector" and snapshot.keyword_index is None:
+            return "vector"
+        return mode
+
+    def filter_subset(self, region: Optional[str] = None, topic: Optional[str] = None,
+                      snapshot: Optional[IndexSnapshot] = None):
+        """
+        Resolve region/topic filters to the matching part of the index
+
+        Returns:
+            (positions, FAISS ID selector) as from MetadataPartitions.select, or None when unfiltered
+        """
+        if not region and not topic:
+            return None
+        snapshot = snapshot or self.backend.snapshot
+        if snapshot.partitions is None:
+            raise ValueError("Region/topic filters are unavailable for this vector database")
+        return snapshot.partitions.select(region=region, topic=topic)
+
+    @staticmethod
+    def filter_scope(region: Optional[str] = None, topic: Optional[str] = None) -> str:
+        """Answer cache scope for a filtered search, so filtered and unfiltered answers don't mix"""
+        if not region and not topic:
+            return ""
+        return f"region={normalize_value(region or '')}|topic={normalize_value(topic or '')}"
+
+    def search_knowledge_base(self, query: str, k: int = 2, retrieval_mode: Optional[str] = None,
+                              region: Optional[str] = None, topic: Optional[str] = None) -> List[Dict]:
         """
-        Search for the agricultural knowledge base using vector similarity
+        Search for the agricultural knowledge base using vector similarity and/or BM25 keywords
 
         Args: 
             query: User's question
             k: Number of similar documents to retrieve
+            retrieval_mode: "hybrid", "vector" or "keyword"; defaults to RETRIEVAL_MODE
+            region: Only search documents for this region
+            topic: Only search documents on this topic (or topic part, e.g. "Irrigation")
 
         Returns: 
-            List of relevant Q&A pairs with metadata
+            Relevant Q&A pairs as {"id", "content", "score"}, best first; fewer than k (or none)
+            when the scores fall below the RETRIEVAL_* cutoffs
         """
-        if not self.vector_store:
-            print("11111")
+        # Pinned for the whole search, so a concurrent index reload can't mix versions
+        snapshot = self.backend.snapshot
+        if snapshot is None:
             return []
         
         try:
-            docs = self.vector_store.similarity_search(query, k = k)
-
-            results = []
-            for doc in docs:
-                results.append(doc.page_content)
+            mode = self.resolve_retrieval_mode(retrieval_mode, snapshot)
+            with span("search"):
+                subset = self.filter_subset(region, topic, snapshot)
+                keyword_hits = self.keyword_candidates(query, k, subset, snapshot) if mode != "vector" else []
+                if mode == "keyword":
+                    return self.select_sources(k, keyword_hits=keyword_hits, snapshot=snapshot)
 
-            return results
+            try:
+                query_vector = self.backend.embed_query(query)
+            except Exception as e:
+                if not keyword_hits:
+                    raise
+                print(f"⚠️ Embedding failed, answering from keyword search: {e}")
+                return self.select_sources(k, keyword_hits=keyword_hits, snapshot=snapshot)
+            with span("search"):
+                return self.search_by_vector(query_vector, k=k, keyword_hits=keyword_hits, subset=subset, snapshot=snapshot)
         except Exception as e:
             print(f"Error searching knowledge base: {e}")
             return []
-        
 
-    def generate_answer(self, user_question: str, retrieved_context: List[Dict]):
+    def search_by_vector(self, query_vector: List[float], k: int = 2,
+                         keyword_hits: Optional[List[Tuple[str, float]]] = None, subset=None,
+                         snapshot: Optional[IndexSnapshot] = None) -> List[Dict]:
         """
-        Generate a grouded answer using retrieved context and conversation history
+        Search the knowledge base with an already computed query embedding
 
         Args:
-            user_question: The farmer's question
-            retrieved_context: Relevant Q&A pairs from knowledge base
+            query_vector: Query embedding
+            k: Most documents to retrieve
+            keyword_hits: BM25 (id, score) ranking of the same query to fuse with the vector ranking
+            subset: Part of the index to search, from filter_subset (None searches everything)
+            snapshot: Index version to search (defaults to the live one)
 
         Returns:
-            Generated answer based on context
+            Relevant Q&A pairs as {"id", "content", "score"}, best first
         """
-        if not retrieved_context:
-            return ("I couldn't find specific information for your question in our agricultural database. "
-                   "Please try rephrasing your question or ask about topics like crop cultivation, "
-                   "pest management, fertilizers, or farming techniques."), None
-        
+        snapshot = snapshot or self.backend.snapshot
+        n = max(k, self.backend.retrieval_candidates) if keyword_hits else k
+        vector_hits = self.vector_candidates(query_vector, n, subset, snapshot)
+        return self.select_sources(k, vector_hits, keyword_hits, snapshot)
+
+    def select_sources(self, k: int, vector_hits: Optional[List[Tuple[str, float]]] = None,
+                       keyword_hits: Optional[List[Tuple[str, float]]] = None,
+                       snapshot: Optional[IndexSnapshot] = None) -> List[Dict]:
+        """
+        Choose the sources for a question from its scored search results
+
+        Which vector hits are kept depends on their similarities (see adaptive_depth
+        and the RETRIEVAL_* cutoffs); with both rankings, the kept hits are ordered
+        by their fused rank. BM25 scores have no fixed scale, so without vector
+        results only the relative cutoff applies.
+
+        Args:
+            k: Most sources to keep
+            vector_hits: (id, cosine similarity) pairs, best first, or None when there was no vector search
+            keyword_hits: (id, BM25 score) pairs, best first
+            snapshot: Index version the ids belong to (defaults to the live one)
+
+        Returns:
+            Sources as {"id", "content", "score"}; the score is the cosine similarity, or the
+            BM25 score when there were no vector results
+        """
+        backend = self.backend
+        if vector_hits is None:
+            depth = adaptive_depth([score for _, score in keyword_hits or []], k,
+                                   relative_cutoff=backend.retrieval_relative_cutoff)
+            chosen = list(keyword_hits or [])[:depth]
+        else:
+            depth = adaptive_depth([score for _, score in vector_hits], k, backend.retrieval_min_score,
+                                   backend.retrieval_relative_cutoff, backend.retrieval_max_score_gap)
+            if vector_hits and not depth:
+                count("low_relevance_questions", 1)
+            chosen = vector_hits[:depth]
+            if keyword_hits and depth:
+                # Fusion only reorders the hits that passed the cutoffs; keyword-only
+                # matches have no similarity to check, so they are left out
+                similarity = dict(chosen)
+                fused = reciprocal_rank_fusion([[doc_id for doc_id, _ in vector_hits],
+                                                [doc_id for doc_id, _ in keyword_hits]], k=backend.rrf_k)
+                chosen = [(doc_id, similarity[doc_id]) for doc_id in fused if doc_id in similarity]
+        sources = self.sources_for(chosen, snapshot)
+        count("retrieved_sources", len(sources))
+        return sources
+
+    def vector_candidates(self, query_vector: List[float], n: int, subset=None,
+                          snapshot: Optional[IndexSnapshot] = None) -> List[Tuple[str, float]]:
+        """(docstore id, cosine similarity) of the n nearest documents to a query embedding, best first"""
+        return self.vector_candidates_batch([query_vector], n, subset, snapshot)[0]
+
+    def vector_candidates_batch(self, query_vectors: List[List[float]], n: int, subset=None,
+                                snapshot: Optional[IndexSnapshot] = None) -> List[List[Tuple[str, float]]]:
+        """
+        Nearest documents to each of several query embeddings, in one search call
+
+        Args:
+            query_vectors: Query embeddings
+            n: Results per query
+            subset: Part of the index to search, from filter_subset (None searches everything)
+            snapshot: Index version to search (defaults to the live one)
+
+        Returns:
+            One ranked list of (docstore id, cosine similarity) per query, best first
+        """
+        snapshot = snapshot or self.backend.snapshot
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        allowed, selector = subset if subset is not None else (None, None)
+        if allowed is not None:
+            if not len(allowed):
+                return [[] for _ in queries]
+            n = min(n, len(allowed))
+
+        engine = snapshot.exact_engine
+        if engine is not None:
+            distances, positions = engine.search(queries, n, allowed=allowed)
+            doc_ids = engine.doc_ids
+            metric = engine.metric
+        else:
+            index = snapshot.vector_store.index
+            # The ID selector makes FAISS skip every vector outside the partition
+            params = faiss_search_params(index, selector, nprobe=self.nprobe, ef_search=self.ef_search)
+            distances, positions = index.search(queries, n, params=params)
+            doc_ids = snapshot.vector_store.index_to_docstore_id
+            metric = index.metric_type
+
+        scores = similarity_scores(distances, metric)
+        # FAISS pads with -1 when the index has fewer than n vectors
+        ids_at = doc_ids_at(doc_ids, (int(i) for row in positions for i in row if i != -1))
+        return [
+            [(ids_at[int(i)], float(score)) for i, score in zip(row, row_scores) if int(i) in ids_at]
+            for row, row_scores in zip(positions, scores)
+        ]
 
+    def keyword_candidates(self, query: str, k: int, subset=None,
+                           snapshot: Optional[IndexSnapshot] = None) -> List[Tuple[str, float]]:
+        """(docstore id, BM25 score) of the best keyword matches for a query, best first"""
+        snapshot = snapshot or self.backend.snapshot
+        n = max(k, self.backend.retrieval_candidates)
+        allowed = subset[0] if subset is not None else None
+        matches = snapshot.keyword_index.search(query, n, allowed=allowed)
+        ids_at = doc_ids_at(snapshot.vector_store.index_to_docstore_id, (position for position, _ in matches))
+        return [(ids_at[position], float(score)) for position, score in matches if position in ids_at]
+
+    def sources_for(self, hits: List[Tuple[str, float]],
+                    snapshot: Optional[IndexSnapshot] = None) -> List[Dict]:
+        """Look up the stored Q&A text of scored documents by docstore id (one query for the SQLite docstore)"""
+        snapshot = snapshot or self.backend.snapshot
+        engine = snapshot.exact_engine
+        docstore = snapshot.vector_store.docstore
+        doc_ids = [doc_id for doc_id, _ in hits]
+        if engine is not None:
+            contents = {doc_id: engine.content(engine.positions[doc_id]) for doc_id in doc_ids if doc_id in engine.positions}
+        elif isinstance(docstore, SQLiteDocstore):
+            contents = docstore.contents_for(doc_ids)
+        else:
+            documents = {doc_id: docstore.search(doc_id) for doc_id in doc_ids}
+            contents = {doc_id: doc.page_content for doc_id, doc in documents.items() if hasattr(doc, "page_content")}
+        return [
+            {"id": doc_id, "content": contents[doc_id], "score": round(score, 4)}
+            for doc_id, score in hits if doc_id in contents
+        ]
+
+    def search_knowledge_base_batch(self, queries: List[str], k: int = 2, retrieval_mode: Optional[str] = None,
+                                    filters: Optional[List[Tuple[Optional[str], Optional[str]]]] = None) -> List[List[Dict]]:
+        """
+        Search the knowledge base for many queries at once
+
+        All queries are embedded in one call and searched with one FAISS call per
+        distinct filter, giving the same results as search_knowledge_base per query.
+
+        Args:
+            queries: Questions to search for
+            k: Most documents per query
+            retrieval_mode: "hybrid", "vector" or "keyword"; defaults to RETRIEVAL_MODE
+            filters: (region, topic) per query, or None to search everything
+
+        Returns:
+            One list of relevant Q&A pairs ({"id", "content", "score"}) per query
+        """
+        snapshot = self.backend.snapshot
+        if snapshot is None:
+            return [[] for _ in queries]
+        # Batches are where the NumPy engine pays off, so the first one builds it (when enabled)
+        self.backend.exact_engine_for(snapshot)
+
+        mode = self.resolve_retrieval_mode(retrieval_mode, snapshot)
+        filters = filters or [(None, None)] * len(queries)
+        groups: Dict[Tuple, List[int]] = {}
+        for i, query_filter in enumerate(filters):
+            groups.setdefault(tuple(query_filter), []).append(i)
+        subsets = {query_filter: self.filter_subset(*query_filter, snapshot=snapshot) for query_filter in groups}
+
+        keyword_hits = [
+            self.keyword_candidates(query, k, subsets[tuple(query_filter)], snapshot) if mode != "vector" else []
+            for query, query_filter in zip(queries, filters)
+        ]
+        if mode == "keyword":
+            return [self.select_sources(k, keyword_hits=hits, snapshot=snapshot) for hits in keyword_hits]
+
+        try:
+            query_vectors = self.backend.embed_queries(queries)
+        except Exception as e:
+            if not any(keyword_hits):
+                raise
+            print(f"⚠️ Embedding failed, answering from keyword search: {e}")
+            return [self.select_sources(k, keyword_hits=hits, snapshot=snapshot) for hits in keyword_hits]
+
+        n = k if mode == "vector" else max(k, self.backend.retrieval_candidates)
+        vector_hits: List[List[Tuple[str, float]]] = [[] for _ in queries]
+        for query_filter, members in groups.items():
+            ranked = self.vector_candidates_batch([query_vectors[i] for i in members], n, subsets[query_filter], snapshot)
+            for i, hits in zip(members, ranked):
+                vector_hits[i] = hits
+
+        return [
+            self.select_sources(k, hits, keyword_ranking, snapshot)
+            for hits, keyword_ranking in zip(vector_hits, keyword_hits)
+        ]
+
+    @span("prompt")
+    def build_messages(self, user_question: str, retrieved_context: List[Dict],
+                       history: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        Build the chat messages (system prompt, conversation history, question with context)
+
+        Args:
+            user_question: The farmer's question
+            retrieved_context: Relevant Q&A pairs from knowledge base ({"id", "content", "score"})
+            history: Conversation to include (defaults to this session's history)
+
+        Returns:
+            Messages payload for the chat completion
+        """
         context_parts = []
         for i, qa in enumerate(retrieved_context, 1):
             context_parts.append(
                 f"Context {i}:\n"
-                f"{qa}"
+                f"{qa['content']}"
             )
         
         context = "\n\n".join(context_parts)  
@@ -203,77 +1549,390 @@ Answer:"""
         
         # Construct messages payload with history
         messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(self.conversation_history) # Add conversation history
+        if history is None:
+            history = self.memory.messages()
+            count("history_tokens", self.memory.tokens)
+        messages.extend(history) # Add conversation history
         messages.append({"role": "user", "content": human_prompt})
+        return messages
 
-        completion = self.audio_client.chat.completions.create(
-            model = "gpt-4o-audio-preview",
-            modalities=["text", "audio"],
-            audio={
-                "voice": "alloy",
-                "format": "wav"
-            },
-            messages = messages, # Use the new messages list with history
-            temperature = 0.7,
-            max_tokens = 1000,
-            top_p = 1,
-            frequency_penalty=0,
-            presence_penalty=0,
-        )
+    def generate_answer(self, user_question: str, retrieved_context: List[Dict],
+                        history: Optional[List[Dict]] = None):
+        """
+        Generate a grouded answer using retrieved context and conversation history
+
+        Args:
+            user_question: The farmer's question
+            retrieved_context: Relevant Q&A pairs from knowledge base ({"id", "content", "score"})
+            history: Conversation to include (defaults to this session's history)
+
+        Returns:
+            Generated answer based on context
+        """
+        if not retrieved_context:
+            return NO_CONTEXT_ANSWER, None
+
+        messages = self.build_messages(user_question, retrieved_context, history)
+
+        with span("generate"):
+            completion = self.audio_client.chat.completions.create(**audio_completion_params(messages))
+        record_token_usage(completion.usage)
         text_response = completion.choices[0].message.audio.transcript
-        audio_bytes = base64.b64decode(completion.choices[0].message.audio.data)
+        with span("decode"):
+            audio_bytes = base64.b64decode(completion.choices[0].message.audio.data)
+        count("audio_response_bytes", len(audio_bytes))
         return [text_response, audio_bytes]
 
-    def process_question(self, question: str) -> Dict:
+    def generate_answer_stream(self, user_question: str, retrieved_context: List[Dict]) -> Iterator[Dict]:
+        """
+        Stream a grounded answer as the model produces it
+
+        Args:
+            user_question: The farmer's question
+            retrieved_context: Relevant Q&A pairs from knowledge base
+
+        Yields:
+            {"type": "transcript", "text": ...} for transcript deltas and
+            {"type": "audio", "data": ...} for raw 16-bit PCM chunks at STREAM_AUDIO_SAMPLE_RATE
+        """
+        if not retrieved_context:
+            yield {"type": "transcript", "text": NO_CONTEXT_ANSWER}
+            return
+
+        messages = self.build_messages(user_question, retrieved_context)
+
+        # Streaming audio is only available as raw pcm16, not wav
+        stream = self.audio_client.chat.completions.create(
+            **audio_completion_params(messages, audio_format="pcm16"),
+            stream=True
+        )
+        for chunk in stream:
+            record_token_usage(getattr(chunk, "usage", None))
+            if not chunk.choices:
+                continue
+            audio = getattr(chunk.choices[0].delta, "audio", None)
+            if not audio:
+                continue
+            # Audio deltas are untyped extras on the SDK model, so they arrive as plain dicts
+            if not isinstance(audio, dict):
+                audio = audio.model_dump() if hasattr(audio, "model_dump") else vars(audio)
+            if audio.get("transcript"):
+                yield {"type": "transcript", "text": audio["transcript"]}
+            if audio.get("data"):
+                with span("decode"):
+                    data = base64.b64decode(audio["data"])
+                count("audio_response_bytes", len(data))
+                yield {"type": "audio", "data": data}
+
+    def generate_text_answer(self, user_question: str, retrieved_context: List[Dict],
+                             history: Optional[List[Dict]] = None) -> str:
+        """
+        Generate a grounded text-only answer with the chat model (no speech)
+
+        Args:
+            user_question: The farmer's question
+            retrieved_context: Relevant Q&A pairs from knowledge base ({"id", "content", "score"})
+            history: Conversation to include (defaults to this session's history)
+
+        Returns:
+            Generated answer text
+        """
+        if not retrieved_context:
+            return NO_CONTEXT_ANSWER
+
+        messages = self.build_messages(user_question, retrieved_context, history)
+        with span("generate"):
+            message = self.chat_model.invoke(messages)
+        record_token_usage(getattr(message, "usage_metadata", None))
+        return message.content
+
+    def generate_text_answer_stream(self, user_question: str, retrieved_context: List[Dict]) -> Iterator[Dict]:
+        """
+        Stream a grounded text-only answer with the chat model
+
+        Yields:
+            {"type": "transcript", "text": ...} events, like generate_answer_stream
+        """
+        if not retrieved_context:
+            yield {"type": "transcript", "text": NO_CONTEXT_ANSWER}
+            return
+
+        messages = self.build_messages(user_question, retrieved_context)
+        for chunk in self.chat_model.stream(messages):
+            record_token_usage(getattr(chunk, "usage_metadata", None))
+            if chunk.content:
+                yield {"type": "transcript", "text": chunk.content}
+
+    def resolve_response_mode(self, response_mode: Optional[str]) -> str:
+        """Pick the response mode for a question, defaulting to the backend setting"""
+        mode = response_mode or self.backend.response_mode
+        if mode not in RESPONSE_MODES:
+            raise ValueError(f"response_mode must be one of {RESPONSE_MODES}, got {mode!r}")
+        return mode
+
+    @traced("question")
+    def process_question(self, question: str, response_mode: Optional[str] = None,
+                         region: Optional[str] = None, topic: Optional[str] = None) -> Dict:
         """
         Process a complete question through the RAG pipeline
 
         Args:
             question: The farmer's question
+            response_mode: "audio" for transcript + speech, "text" for text only
+                (speech can be fetched later with synthesize_speech); defaults to RESPONSE_MODE
+            region: Only use knowledge base entries for this region
+            topic: Only use knowledge base entries on this topic
         
         Returns:
             Dictionary containing answer, sources, and metadeta
         """
+        mode = self.resolve_response_mode(response_mode)
+        annotate(response_mode=mode)
+        scope = self.filter_scope(region, topic)
+        route = self.route_question(question, scope)
+
+        use_cache = self.should_use_answer_cache(question, route)
+        cached = self.lookup_cached_answer(question, scope) if use_cache else None
 
-        # Step 1: Search knowledge base
-        relevant_context = self.search_knowledge_base(question, k=3)
+        if cached:
+            answer, audio_bytes = cached["answer"], cached["audio_bytes"]
+            relevant_context = cached["sources"]
+            if mode == "audio" and audio_bytes is None:
+                audio_bytes = self.backend.synthesize_speech(answer)
+        elif route == CHIT_CHAT:
+            answer, relevant_context = self.backend.query_router.chit_chat_reply(question), []
+            # Canned replies repeat, so their speech is almost always in the speech cache
+            audio_bytes = self.backend.synthesize_speech(answer) if mode == "audio" else None
+        else:
+            # Step 1: Search knowledge base (follow-ups reuse the previous turn's context)
+            relevant_context = self.retrieve_context(question, route, k=3, region=region, topic=topic)
+            
+            # Step 2: Generate answer
+            if mode == "text":
+                answer, audio_bytes = self.generate_text_answer(question, relevant_context), None
+            else:
+                lit = self.generate_answer(question, relevant_context)
+                if lit:
+                    answer, audio_bytes = lit
+                else: 
+                    print("error generatic response")
+                    return 
+
+            if use_cache:
+                self.store_cached_answer(question, answer, audio_bytes, relevant_context, scope=scope)
+
+        response = self.build_response(question, answer, relevant_context, audio_bytes, cached is not None, route)
         
-        # Step 2: Generate answer
-        lit = self.generate_answer(question, relevant_context)
-        if lit:
-            answer, audio_bytes = lit
-        else: 
-            print("error generatic response")
-            return 
-
-        response = {
+        self.record_turn(question, answer, relevant_context, route, scope)
+
+        return response
+
+    @traced("question_stream")
+    def process_question_stream(self, question: str, response_mode: Optional[str] = None,
+                                region: Optional[str] = None, topic: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Process a question through the RAG pipeline, streaming the answer
+
+        Args:
+            question: The farmer's question
+            response_mode: "audio" or "text", as for process_question
+            region, topic: Knowledge base filters, as for process_question
+
+        Yields:
+            Transcript and audio events as produced by generate_answer_stream, then a final
+            {"type": "response", "response": ...} carrying the same dict as process_question
+            (with the complete answer as WAV bytes in audio mode)
+        """
+        mode = self.resolve_response_mode(response_mode)
+        annotate(response_mode=mode)
+        scope = self.filter_scope(region, topic)
+        route = self.route_question(question, scope)
+        use_cache = self.should_use_answer_cache(question, route)
+        cached = self.lookup_cached_answer(question, scope) if use_cache else None
+
+        if cached:
+            answer, audio_bytes = cached["answer"], cached["audio_bytes"]
+            relevant_context = cached["sources"]
+            yield {"type": "transcript", "text": answer}
+            if mode == "audio" and audio_bytes is None:
+                audio_bytes = self.backend.synthesize_speech(answer)
+        elif route == CHIT_CHAT:
+            answer, relevant_context = self.backend.query_router.chit_chat_reply(question), []
+            yield {"type": "transcript", "text": answer}
+            audio_bytes = self.backend.synthesize_speech(answer) if mode == "audio" else None
+        else:
+            relevant_context = self.retrieve_context(question, route, k=3, region=region, topic=topic)
+
+            if mode == "text":
+                events = self.generate_text_answer_stream(question, relevant_context)
+            else:
+                events = self.generate_answer_stream(question, relevant_context)
+
+            transcript_parts = []
+            pcm_chunks = []
+            # Only the time spent producing events counts as generation, not the caller's rendering
+            for event in timed_iter(events, "generate"):
+                if not transcript_parts and not pcm_chunks:
+                    mark("first_chunk")
+                if event["type"] == "transcript":
+                    transcript_parts.append(event["text"])
+                else:
+                    pcm_chunks.append(event["data"])
+                yield event
+
+            answer = "".join(transcript_parts)
+            audio_bytes = pcm16_to_wav(b"".join(pcm_chunks)) if pcm_chunks else None
+
+            if use_cache:
+                self.store_cached_answer(question, answer, audio_bytes, relevant_context, scope=scope)
+
+        response = self.build_response(question, answer, relevant_context, audio_bytes, cached is not None, route)
+
+        self.record_turn(question, answer, relevant_context, route, scope)
+
+        yield {"type": "response", "response": response}
+
+    def build_response(self, question: str, answer: str, relevant_context: List,
+                       audio_bytes: Optional[bytes], cached: bool, route: str = NEW) -> Dict:
+        """Assemble the response dictionary returned to the UI"""
+        annotate(cached=cached)
+        return {
             "question": question,
             "answer": answer,
             "sources": relevant_context,
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "source_count": len(relevant_context),
-            "audio_bytes": audio_bytes
+            "audio_bytes": audio_bytes,
+            "cached": cached,
+            "route": route
         }
-        
-        # Add to conversation history for context
-        self.conversation_history.append({"role": "user", "content": question})
-        self.conversation_history.append({"role": "assistant", "content": answer})
 
-        # Keep only the last 5 pairs (10 messages)
-        if len(self.conversation_history) > 10:
-            self.conversation_history = self.conversation_history[-10:]
+    def record_turn(self, question: str, answer: str, relevant_context: List, route: str = NEW, scope: str = ""):
+        """Add a completed question/answer pair to the conversation history and session memory"""
+        # Add to conversation history for context; turns over the token budget get summarized
+        self.memory.add_turn(question, answer)
+
+        # Small talk keeps the previous topic; a follow-up stays on it, along with the original question
+        if route == FOLLOW_UP and self.last_turn:
+            self.last_turn = dict(self.last_turn, question=f"{self.last_turn['question']} {question}", answer=answer,
+                                  sources=relevant_context)
+        elif route != CHIT_CHAT:
+            self.last_turn = {"question": question, "answer": answer, "sources": relevant_context, "scope": scope}
 
         # Add to session memory for logging/stats
         self.add_to_session_memory(question, answer, relevant_context)
-
-        return response
     
-    def process_audio_question(self, audio_file) -> Dict:
+    def process_questions(self, batch: Iterable[Union[str, Dict]], response_mode: str = "text", k: int = 3,
+                          retrieval_mode: Optional[str] = None, max_workers: Optional[int] = None,
+                          chunk_size: Optional[int] = None, output_path: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Answer many independent questions, yielding each result as soon as it is ready
+
+        Stateless: every question is answered without conversation history, and the
+        session's history, memory and the answer cache are left untouched. Questions
+        are retrieved chunk by chunk (one embedding call and one FAISS search per
+        chunk and filter) while answers are generated on up to max_workers threads.
+
+        Args:
+            batch: Questions, as strings or dicts with "question" and optional "id", "region", "topic"
+            response_mode: "text" (chat model, default) or "audio" (transcript + speech)
+            k: Knowledge base entries per question
+            retrieval_mode: "hybrid", "vector" or "keyword"; defaults to RETRIEVAL_MODE
+            max_workers: Answers generated in parallel; defaults to BATCH_WORKERS
+            chunk_size: Questions retrieved together; defaults to BATCH_CHUNK_SIZE
+            output_path: JSON Lines file each result is appended to. Questions whose id
+                already has a successful result there are skipped, so re-running an
+                interrupted batch resumes it (failed ones are retried)
+
+        Yields:
+            Result dicts in completion order: id, question, region, topic, answer,
+            sources, audio_bytes, error (None on success) and latency_ms
+        """
+        mode = self.resolve_response_mode(response_mode)
+        max_workers = max(1, max_workers or self.backend.batch_workers)
+        chunk_size = max(1, chunk_size or self.backend.batch_chunk_size)
+        completed = read_completed_ids(output_path) if output_path else set()
+        if completed:
+            print(f"Resuming batch: {len(completed)} questions already answered in {output_path}")
+
+        items = (
+            item for item in (batch_item(position, entry) for position, entry in enumerate(batch))
+            if item["id"] not in completed
+        )
+        output = open_batch_output(output_path) if output_path else None
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch")
+        pending = set()
+        try:
+            while True:
+                chunk = list(itertools.islice(items, chunk_size))
+                # Invalid entries (no question) are reported right away, without retrieval
+                for item in chunk:
+                    if item["error"]:
+                        result = dict(item, answer=None, sources=[], audio_bytes=None, latency_ms=0.0)
+                        write_batch_result(output, result)
+                        yield result
+                valid = [item for item in chunk if not item["error"]]
+                if valid:
+                    started = time.perf_counter()
+                    try:
+                        contexts = self.search_knowledge_base_batch(
+                            [item["question"] for item in valid], k=k, retrieval_mode=retrieval_mode,
+                            filters=[(item["region"], item["topic"]) for item in valid]
+                        )
+                    except Exception as e:
+                        contexts = [e] * len(valid)
+                    retrieval_ms = (time.perf_counter() - started) * 1000 / len(valid)
+                    for item, context in zip(valid, contexts):
+                        pending.add(executor.submit(self.answer_batch_item, item, context, mode, retrieval_ms))
+
+                # Keep a bounded window of answers in flight; refill it from the next chunk
+                while pending and (not chunk or len(pending) >= max_workers * 2):
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        write_batch_result(output, result)
+                        yield result
+                if not chunk and not pending:
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if output is not None:
+                output.close()
+
+    @traced("batch_question")
+    def answer_batch_item(self, item: Dict, relevant_context, mode: str, retrieval_ms: float = 0.0) -> Dict:
+        """Generate the answer for one batch question, turning failures into an error result"""
+        # The question's share of its chunk's batched embedding and search
+        current_trace().add_stage("retrieve", retrieval_ms)
+        annotate(response_mode=mode)
+        started = time.perf_counter()
+        result = dict(item, answer=None, sources=[], audio_bytes=None, error=None)
+        try:
+            if isinstance(relevant_context, Exception):
+                raise relevant_context
+            result["sources"] = relevant_context
+            # An empty history keeps every answer independent of the session and of each other
+            if mode == "text":
+                result["answer"] = self.generate_text_answer(item["question"], relevant_context, history=[])
+            else:
+                result["answer"], result["audio_bytes"] = self.generate_answer(item["question"], relevant_context, history=[])
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["latency_ms"] = round(retrieval_ms + (time.perf_counter() - started) * 1000, 1)
+        return result
+
+    @traced("audio_question")
+    def process_audio_question(self, audio_file, response_mode: Optional[str] = None,
+                               region: Optional[str] = None, topic: Optional[str] = None) -> Dict:
         """
         Process an audio question through the complete pipeline
         
         Args:
-            audio_file: Audio file containing the question
+            audio_file: Audio containing the question (path, bytes, memoryview or file-like)
+            response_mode: "audio" or "text", as for process_question
+            region, topic: Knowledge base filters, as for process_question
             
         Returns:
             Dictionary containing transcription, answer, audio response, and sources
@@ -289,9 +1948,169 @@ Answer:"""
                 "sources": []
             }
         # Step 2: Process the question
-        response = self.process_question(question)
+        response = self.process_question(question, response_mode=response_mode, region=region, topic=topic)
         return response
     
+    @traced("transcription")
+    async def speech_to_text_async(self, audio_file, filename: str = "audio.wav") -> str:
+        """Async version of speech_to_text, using the pooled async Groq client"""
+        try:
+            client = self.backend.async_clients().groq
+            if client is None:
+                raise ValueError("GROQ_API_KEY is not set")
+            # Re-encoding is CPU work, so keep it off the event loop
+            upload = await asyncio.to_thread(self.prepare_audio_upload, audio_file, filename)
+            if isinstance(upload[1], bytes):
+                count("audio_upload_bytes", len(upload[1]))
+            with span("stt"):
+                transcription = await client.audio.transcriptions.create(
+                    file=upload,
+                    model="whisper-large-v3-turbo",
+                    response_format="text"
+                )
+            return str(transcription) if transcription else ""
+        except Exception as e:
+            print(f"❌ Error in speech-to-text: {e}")
+            return ""
+
+    async def search_knowledge_base_async(self, query: str, k: int = 2, retrieval_mode: Optional[str] = None,
+                                          region: Optional[str] = None, topic: Optional[str] = None) -> List[Dict]:
+        """Async version of search_knowledge_base"""
+        snapshot = self.backend.snapshot
+        if snapshot is None:
+            return []
+
+        try:
+            mode = self.resolve_retrieval_mode(retrieval_mode, snapshot)
+            # The FAISS and BM25 lookups are CPU-bound and short, so they run inline on the loop
+            with span("search"):
+                subset = self.filter_subset(region, topic, snapshot)
+                keyword_hits = self.keyword_candidates(query, k, subset, snapshot) if mode != "vector" else []
+                if mode == "keyword":
+                    return self.select_sources(k, keyword_hits=keyword_hits, snapshot=snapshot)
+
+            try:
+                query_vector = await self.backend.embed_query_async(query)
+            except Exception as e:
+                if not keyword_hits:
+                    raise
+                print(f"⚠️ Embedding failed, answering from keyword search: {e}")
+                return self.select_sources(k, keyword_hits=keyword_hits, snapshot=snapshot)
+            with span("search"):
+                return self.search_by_vector(query_vector, k=k, keyword_hits=keyword_hits, subset=subset, snapshot=snapshot)
+        except Exception as e:
+            print(f"Error searching knowledge base: {e}")
+            return []
+
+    async def generate_answer_async(self, user_question: str, retrieved_context: List[Dict]):
+        """Async version of generate_answer"""
+        if not retrieved_context:
+            return NO_CONTEXT_ANSWER, None
+
+        messages = self.build_messages(user_question, retrieved_context)
+        with span("generate"):
+            completion = await self.backend.async_clients().audio.chat.completions.create(
+                **audio_completion_params(messages)
+            )
+        record_token_usage(completion.usage)
+        text_response = completion.choices[0].message.audio.transcript
+        with span("decode"):
+            audio_bytes = base64.b64decode(completion.choices[0].message.audio.data)
+        count("audio_response_bytes", len(audio_bytes))
+        return [text_response, audio_bytes]
+
+    async def generate_text_answer_async(self, user_question: str, retrieved_context: List[Dict]) -> str:
+        """Async version of generate_text_answer"""
+        if not retrieved_context:
+            return NO_CONTEXT_ANSWER
+
+        messages = self.build_messages(user_question, retrieved_context)
+        with span("generate"):
+            completion = await self.backend.async_clients().chat.chat.completions.create(
+                model=self.backend.chat_deployment,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=600
+            )
+        record_token_usage(completion.usage)
+        return completion.choices[0].message.content
+
+    @traced("question")
+    async def process_question_async(self, question: str, response_mode: Optional[str] = None,
+                                     region: Optional[str] = None, topic: Optional[str] = None) -> Dict:
+        """
+        Async version of process_question
+
+        Every remote call goes through the backend's pooled async clients, so one
+        event loop can serve many sessions concurrently without a thread per request.
+
+        Args:
+            question: The farmer's question
+            response_mode: "audio" or "text", as for process_question
+            region, topic: Knowledge base filters, as for process_question
+
+        Returns:
+            Dictionary containing answer, sources, and metadeta
+        """
+        mode = self.resolve_response_mode(response_mode)
+        annotate(response_mode=mode)
+        scope = self.filter_scope(region, topic)
+        route = self.route_question(question, scope)
+        use_cache = self.should_use_answer_cache(question, route)
+
+        cached = None
+        query_vector = None
+        if use_cache:
+            try:
+                query_vector = await self.backend.embed_query_async(question)
+                cached = self.lookup_cached_answer(question, scope, query_vector=query_vector)
+            except Exception as e:
+                print(f"Error looking up answer cache: {e}")
+
+        if cached:
+            answer, audio_bytes = cached["answer"], cached["audio_bytes"]
+            relevant_context = cached["sources"]
+            if mode == "audio" and audio_bytes is None:
+                audio_bytes = await self.backend.synthesize_speech_async(answer)
+        elif route == CHIT_CHAT:
+            answer, relevant_context = self.backend.query_router.chit_chat_reply(question), []
+            audio_bytes = await self.backend.synthesize_speech_async(answer) if mode == "audio" else None
+        else:
+            if route == FOLLOW_UP:
+                relevant_context = self.retrieve_context(question, route)
+            else:
+                relevant_context = await self.search_knowledge_base_async(question, k=3, region=region, topic=topic)
+
+            if mode == "text":
+                answer, audio_bytes = await self.generate_text_answer_async(question, relevant_context), None
+            else:
+                answer, audio_bytes = await self.generate_answer_async(question, relevant_context)
+
+            if use_cache:
+                self.store_cached_answer(question, answer, audio_bytes, relevant_context,
+                                         query_vector=query_vector, scope=scope)
+
+        response = self.build_response(question, answer, relevant_context, audio_bytes, cached is not None, route)
+
+        self.record_turn(question, answer, relevant_context, route, scope)
+
+        return response
+
+    @traced("audio_question")
+    async def process_audio_question_async(self, audio_file, response_mode: Optional[str] = None,
+                                           region: Optional[str] = None, topic: Optional[str] = None) -> Dict:
+        """Async version of process_audio_question"""
+        question = await self.speech_to_text_async(audio_file)
+        if not question:
+            return {
+                "error": "Could not transcribe audio. Please try again.",
+                "transcription": "",
+                "answer": "",
+                "audio_response": b"",
+                "sources": []
+            }
+        return await self.process_question_async(question, response_mode=response_mode, region=region, topic=topic)
+
     def add_to_session_memory(self, question: str, answer: str, sources: List[Dict]):
         """Add interaction to session memory for logging and stats"""
         self.session_memory.append({
@@ -313,7 +2132,8 @@ Answer:"""
     def clear_session_memory(self):
         """Clear session memory and conversation history"""
         self.session_memory = []
-        self.conversation_history = []
+        self.memory.clear()
+        self.last_turn = None
     
     def get_statistics(self) -> Dict:
         """Get usage statistics"""
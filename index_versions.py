@@ -0,0 +1,102 @@
+# index_versions.py
+# Versioned vector database directories, published by atomically rewriting a CURRENT pointer
+
+import os
+import shutil
+import tempfile
+import time
+from typing import List, Optional
+
+# Layout: <root>/versions/<version>/... plus <root>/CURRENT naming the live version.
+# Version directories are never modified once published, so a running process can
+# keep searching (and memory-mapping) an old one while a new one is built.
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+
+def current_version(root: str) -> Optional[str]:
+    """Name of the published version, or None for an unversioned (older) database"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_path(root: str, version: Optional[str]) -> str:
+    """Directory holding a version's files (the root itself for an unversioned database)"""
+    if version is None:
+        return root
+    return os.path.join(root, VERSIONS_DIR, version)
+
+
+def current_path(root: str) -> str:
+    """Directory holding the files of the published version"""
+    return version_path(root, current_version(root))
+
+
+def list_versions(root: str) -> List[str]:
+    """Version names under root, oldest first"""
+    versions_root = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(versions_root):
+        return []
+    return sorted(
+        name for name in os.listdir(versions_root)
+        if not name.startswith(".") and os.path.isdir(os.path.join(versions_root, name))
+    )
+
+
+def new_version(root: str) -> str:
+    """
+    Create an empty, unpublished version directory
+
+    Names start with a timestamp so they sort by age; nothing loads the
+    directory until publish_version points CURRENT at it.
+
+    Returns:
+        The new version name
+    """
+    versions_root = os.path.join(root, VERSIONS_DIR)
+    os.makedirs(versions_root, exist_ok=True)
+    path = tempfile.mkdtemp(dir=versions_root, prefix=time.strftime("%Y%m%d-%H%M%S-"))
+    os.chmod(path, 0o755)
+    return os.path.basename(path)
+
+
+def publish_version(root: str, version: str):
+    """Make a version the live one by atomically replacing the CURRENT pointer"""
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix=f".{CURRENT_FILE}-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(version + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def discard_version(root: str, version: str):
+    """Delete an unpublished (e.g. half-written) version"""
+    shutil.rmtree(version_path(root, version), ignore_errors=True)
+
+
+def prune_versions(root: str, keep: int = 3) -> List[str]:
+    """
+    Delete all but the newest `keep` versions, never the published one
+
+    Processes that still have an old version open keep working on POSIX systems,
+    since deleted files stay readable until closed, but keeping a few recent
+    versions gives running apps time to switch over first.
+
+    Returns:
+        Names of the deleted versions
+    """
+    live = current_version(root)
+    versions = [version for version in list_versions(root) if version != live]
+    stale = versions[:max(len(versions) - max(keep - 1, 0), 0)]
+    for version in stale:
+        shutil.rmtree(version_path(root, version), ignore_errors=True)
+    return stale
@@ -0,0 +1,194 @@
+# keyword_index.py
+# BM25 inverted index over the documents' search_text, used next to FAISS for exact-term matches
+
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from array_store import load_arrays, save_arrays
+
+# Saved in the vector database directory next to index.faiss
+KEYWORD_INDEX_DIR = "bm25"
+
+# Latin words and numbers, plus Devanagari words (whose vowel signs \w does not match)
+TOKEN_PATTERN = re.compile(r"[\w\u0900-\u097f]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its my
+of on or should so than that the their them then there these they this to was what
+when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase search terms, dropping common English stopwords"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """
+    Merge several ranked id lists into one with reciprocal rank fusion
+
+    Args:
+        rankings: Ranked lists of document ids, best first
+        k: Damping constant; larger values flatten the weight of top ranks
+
+    Returns:
+        Document ids ordered by fused score
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed set of documents, addressed by FAISS position.
+
+    Postings are kept as flat numpy arrays (grouped by term, with an offset per
+    term), so a query only touches the postings of its own terms. Everything a
+    query needs except the vocabulary is precomputed and memory-mapped on load.
+    """
+
+    def __init__(self, terms: Sequence[str], offsets: np.ndarray, postings: np.ndarray,
+                 frequencies: np.ndarray, idf: np.ndarray, length_norm: np.ndarray,
+                 k1: float = 1.5, b: float = 0.75, digest: Optional[str] = None):
+        """
+        Args:
+            terms: Vocabulary, by term id
+            offsets: Start of each term's postings (length len(terms) + 1)
+            postings: Document positions, grouped by term
+            frequencies: Term frequency of each posting
+            idf: Inverse document frequency of each term
+            length_norm: Per-document part of the BM25 denominator
+            k1: Term frequency saturation
+            b: Document length normalization
+            digest: Fingerprint of the document order the positions refer to
+        """
+        self.vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.idf = idf
+        self.length_norm = length_norm
+        self.k1 = k1
+        self.b = b
+        self.digest = digest
+
+    def __len__(self) -> int:
+        return len(self.length_norm)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.5, b: float = 0.75,
+              digest: Optional[str] = None) -> "BM25Index":
+        """
+        Build the index from document texts
+
+        Args:
+            texts: Searchable text of each document, in FAISS position order
+            digest: Fingerprint of that order (see metadata_index.id_order_digest)
+        """
+        vocabulary: Dict[str, int] = {}
+        term_ids, positions, frequencies, doc_lengths = [], [], [], []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                positions.append(position)
+                frequencies.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+
+        doc_count = len(doc_lengths)
+        doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        document_frequency = np.diff(offsets).astype(np.float32)
+        idf = np.log1p((doc_count - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average_length = float(doc_lengths.mean()) if doc_count else 0.0
+        if average_length:
+            length_norm = (k1 * (1 - b + b * doc_lengths / average_length)).astype(np.float32)
+        else:
+            length_norm = np.full(doc_count, k1, dtype=np.float32)
+
+        return cls(
+            list(vocabulary),
+            offsets,
+            np.asarray(positions, dtype=np.int32)[order],
+            np.asarray(frequencies, dtype=np.float32)[order],
+            idf,
+            length_norm,
+            k1=k1,
+            b=b,
+            digest=digest
+        )
+
+    def save(self, path: str):
+        """Write the index to a new directory of .npy files"""
+        save_arrays(
+            path,
+            {
+                "terms": np.array(list(self.vocabulary), dtype=str),
+                "offsets": self.offsets,
+                "postings": self.postings,
+                "frequencies": self.frequencies,
+                "idf": self.idf,
+                "length_norm": self.length_norm
+            },
+            {"k1": self.k1, "b": self.b, "digest": self.digest}
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Read an index written by save, memory-mapping the postings"""
+        arrays, meta = load_arrays(path)
+        return cls(
+            arrays["terms"].tolist(),
+            arrays["offsets"],
+            arrays["postings"],
+            arrays["frequencies"],
+            arrays["idf"],
+            arrays["length_norm"],
+            k1=meta["k1"],
+            b=meta["b"],
+            digest=meta.get("digest")
+        )
+
+    def search(self, query: str, k: int = 10, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Rank documents for a query
+
+        Args:
+            query: Free-text query
+            k: Number of results
+            allowed: Document positions to restrict the results to, or None for all
+
+        Returns:
+            (document position, BM25 score) pairs, best first; documents sharing no term are left out
+        """
+        term_ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        if not term_ids or k <= 0:
+            return []
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            positions = self.postings[start:end]
+            tf = self.frequencies[start:end]
+            # Positions are unique within a term's postings, so fancy-index += is safe
+            scores[positions] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.length_norm[positions])
+
+        if allowed is None:
+            matched = np.flatnonzero(scores)
+        else:
+            matched = allowed[scores[allowed] > 0]
+        if len(matched) > k:
+            matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(position), float(scores[position])) for position in matched]
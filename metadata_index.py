@@ -0,0 +1,201 @@
+# metadata_index.py
+# Region and topic partitions of the vector index, used to restrict a search to a subset
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from array_store import load_arrays, save_arrays
+
+# Saved in the vector database directory next to index.faiss
+PARTITIONS_DIR = "partitions"
+PARTITION_FIELDS = ("region", "topic")
+
+
+def normalize_value(value) -> str:
+    """Normalize a metadata value so filters are case and spacing insensitive"""
+    return re.sub(r"\s+", " ", str(value)).strip().lower()
+
+
+def partition_keys(field: str, value) -> List[str]:
+    """
+    Partition keys a document joins for one metadata field
+
+    Topics look like "Irrigation / Cotton", so besides the full topic a document
+    is also filed under each part ("irrigation", "cotton").
+    """
+    key = normalize_value(value)
+    if not key:
+        return []
+    keys = [key]
+    if field == "topic":
+        keys.extend(part for part in (p.strip() for p in key.split("/")) if part and part != key)
+    return keys
+
+
+def id_order_digest(doc_ids: Sequence[str]) -> str:
+    """Fingerprint of the document order, to detect side indexes saved for another FAISS index"""
+    return hashlib.sha256("\n".join(doc_ids).encode("utf-8")).hexdigest()
+
+
+class MetadataPartitions:
+    """
+    Index positions of the documents in each region and topic.
+
+    Each partition is a sorted array of FAISS positions, stored back to back per
+    field with an offset per value (like the BM25 postings) and memory-mapped on
+    load. Filters resolve to a position subset and a FAISS ID selector, which
+    are cached since the same few regions are asked for again and again.
+    """
+
+    def __init__(self, fields: Dict[str, Tuple[List[str], List[str], np.ndarray, np.ndarray]],
+                 size: int, digest: Optional[str], max_cached_filters: int = 64):
+        """
+        Args:
+            fields: Per field: (partition keys, display labels, offsets, positions)
+            size: Number of documents in the index
+            digest: id_order_digest of the indexed documents
+            max_cached_filters: Number of resolved filters to keep
+        """
+        self.size = size
+        self.digest = digest
+        self.max_cached_filters = max_cached_filters
+        self._fields = {}
+        self._labels = {}
+        for field, (keys, labels, offsets, positions) in fields.items():
+            self._fields[field] = (
+                {key: i for i, key in enumerate(keys)},
+                offsets,
+                positions
+            )
+            self._labels[field] = labels
+        self._selectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    @classmethod
+    def build(cls, metadatas: Iterable[Dict], digest: Optional[str] = None) -> "MetadataPartitions":
+        """
+        Group document positions by region and topic
+
+        Args:
+            metadatas: Metadata of each document, in FAISS position order
+            digest: Fingerprint of that order (see id_order_digest)
+        """
+        members: Dict[str, Dict[str, List[int]]] = {field: {} for field in PARTITION_FIELDS}
+        labels: Dict[str, Dict[str, str]] = {field: {} for field in PARTITION_FIELDS}
+        size = 0
+        for position, metadata in enumerate(metadatas):
+            size += 1
+            for field in PARTITION_FIELDS:
+                value = metadata.get(field)
+                if value is None:
+                    continue
+                keys = partition_keys(field, value)
+                for key in keys:
+                    members[field].setdefault(key, []).append(position)
+                if keys:
+                    labels[field].setdefault(keys[0], str(value).strip())
+
+        fields = {}
+        for field in PARTITION_FIELDS:
+            keys = sorted(members[field])
+            offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+            np.cumsum([len(members[field][key]) for key in keys], out=offsets[1:])
+            positions = np.fromiter(
+                (position for key in keys for position in members[field][key]),
+                dtype=np.int64,
+                count=int(offsets[-1])
+            )
+            fields[field] = (keys, sorted(labels[field].values()), offsets, positions)
+        return cls(fields, size, digest)
+
+    def save(self, path: str):
+        """Write the partitions to a new directory of .npy files"""
+        arrays = {}
+        for field, (key_ids, offsets, positions) in self._fields.items():
+            arrays[f"{field}_keys"] = np.array(list(key_ids), dtype=str)
+            arrays[f"{field}_labels"] = np.array(self._labels[field], dtype=str)
+            arrays[f"{field}_offsets"] = offsets
+            arrays[f"{field}_positions"] = positions
+        save_arrays(path, arrays, {"size": self.size, "digest": self.digest})
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataPartitions":
+        """Read partitions written by save, memory-mapping the position arrays"""
+        arrays, meta = load_arrays(path)
+        fields = {
+            field: (
+                arrays[f"{field}_keys"].tolist(),
+                arrays[f"{field}_labels"].tolist(),
+                arrays[f"{field}_offsets"],
+                arrays[f"{field}_positions"]
+            )
+            for field in PARTITION_FIELDS
+        }
+        return cls(fields, meta["size"], meta.get("digest"))
+
+    def labels(self, field: str) -> List[str]:
+        """Distinct values of a field as written in the data (e.g. every region)"""
+        return list(self._labels.get(field, []))
+
+    def positions(self, field: str, value) -> np.ndarray:
+        """Sorted index positions of the documents matching one field value"""
+        key_ids, offsets, positions = self._fields[field]
+        key = normalize_value(value)
+        if key in key_ids:
+            i = key_ids[key]
+            return positions[offsets[i]:offsets[i + 1]]
+        # "Irrigation / Cotton" also matches when its parts are filed separately
+        parts = partition_keys(field, value)[1:]
+        if not parts or any(part not in key_ids for part in parts):
+            return np.empty(0, dtype=np.int64)
+        subset = None
+        for part in parts:
+            i = key_ids[part]
+            part_positions = positions[offsets[i]:offsets[i + 1]]
+            subset = part_positions if subset is None else np.intersect1d(subset, part_positions, assume_unique=True)
+        return subset
+
+    def select(self, region: Optional[str] = None,
+               topic: Optional[str] = None) -> Optional[Tuple[np.ndarray, faiss.IDSelector]]:
+        """
+        Resolve region/topic filters to the matching subset of the index
+
+        Args:
+            region: Region to restrict to, or None
+            topic: Topic (or part of one, e.g. "Irrigation") to restrict to, or None
+
+        Returns:
+            (sorted positions, FAISS ID selector over them), or None when no filter is given
+        """
+        if not region and not topic:
+            return None
+        cache_key = (normalize_value(region) if region else None, normalize_value(topic) if topic else None)
+        with self._lock:
+            cached = self._selectors.get(cache_key)
+            if cached is not None:
+                self._selectors.move_to_end(cache_key)
+                return cached
+
+        subset = None
+        for field, value in (("region", region), ("topic", topic)):
+            if not value:
+                continue
+            field_positions = self.positions(field, value)
+            subset = field_positions if subset is None else np.intersect1d(subset, field_positions, assume_unique=True)
+        subset = np.ascontiguousarray(subset, dtype=np.int64)
+        selected = (subset, faiss.IDSelectorBatch(subset))
+
+        with self._lock:
+            self._selectors[cache_key] = selected
+            while len(self._selectors) > self.max_cached_filters:
+                self._selectors.popitem(last=False)
+        return selected
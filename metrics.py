@@ -0,0 +1,493 @@
+# metrics.py
+# Per-request stage timing, in-process latency histograms and their Prometheus / JSON log export
+
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Histogram bucket upper bounds in seconds, from cache hits up to slow audio completions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Most recent observations kept per series for the p50/p95 shown in the UI
+QUANTILE_WINDOW = 1024
+
+# Stages recorded by the assistant, in pipeline order (for display)
+PIPELINE_STAGES = ("upload_encode", "stt", "embed", "search", "retrieve", "prompt", "generate",
+                   "first_chunk", "decode", "tts", "summarize")
+
+# Prefix of every exported metric name
+NAMESPACE = "farm_bot"
+
+METRIC_HELP = {
+    "request_duration_seconds": ("histogram", "End-to-end duration of an assistant request"),
+    "stage_duration_seconds": ("histogram", "Time spent in one pipeline stage of a request"),
+    "requests_total": ("counter", "Assistant requests by operation and outcome"),
+    "prompt_tokens_total": ("counter", "Prompt tokens sent to the chat and audio models"),
+    "completion_tokens_total": ("counter", "Completion tokens generated by the chat and audio models"),
+    "audio_input_bytes_total": ("counter", "Bytes of recorded audio received for transcription"),
+    "audio_upload_bytes_total": ("counter", "Bytes of audio uploaded for transcription after re-encoding"),
+    "audio_response_bytes_total": ("counter", "Bytes of decoded answer audio"),
+    "history_tokens_total": ("counter", "Conversation history tokens sent with questions"),
+    "routed_questions_total": ("counter", "Questions by route (new, follow_up, chit_chat)"),
+    "route_saved_seconds_total": ("counter", "Estimated latency saved by skipping stages, by route"),
+    "embedding_requests_total": ("counter", "Query embeddings requested through the embedding batcher"),
+    "embedding_batches_total": ("counter", "Batched embedding calls sent"),
+    "embedding_batched_requests_total": ("counter", "Query embeddings served by batched calls"),
+    "embedding_texts_sent_total": ("counter", "Distinct texts sent in batched embedding calls"),
+    "embedding_batch_errors_total": ("counter", "Batched embedding calls that failed"),
+    "embedding_queue_wait_seconds_total": ("counter", "Time query embeddings waited for their batch to be sent"),
+    "embedding_batch_seconds_total": ("counter", "Time spent in batched embedding calls"),
+    "retrieved_sources_total": ("counter", "Knowledge base documents kept after the score cutoffs"),
+    "low_relevance_questions_total": ("counter", "Searches whose best match scored below RETRIEVAL_MIN_SCORE"),
+}
+
+# Trace of the request running in this thread / task (None outside a request)
+_current_trace: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("farm_bot_trace", default=None)
+
+
+class Trace:
+    """
+    Timings and counters of one request.
+
+    Stages with the same name add up (e.g. two embedding calls). Stages are
+    timed independently, so a streamed answer's "decode" time is also part of
+    its "generate" time.
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.attributes: Dict = {}
+        # Stages can be recorded from worker threads (asyncio.to_thread copies the context)
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, ms: float):
+        """Add time (ms) to a stage"""
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def count(self, name: str, amount: int):
+        """Add to a counter, e.g. prompt_tokens or audio_upload_bytes"""
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the request started"""
+        return (time.perf_counter() - self.started) * 1000
+
+    def summary(self) -> Dict:
+        """JSON-serializable timings: operation, total_ms, stages_ms, counts and attributes"""
+        with self._lock:
+            return {
+                "operation": self.operation,
+                "total_ms": round(self.elapsed_ms(), 1),
+                "stages_ms": {stage: round(ms, 1) for stage, ms in self.stages.items()},
+                "counts": dict(self.counts),
+                **self.attributes
+            }
+
+
+class Histogram:
+    """Cumulative bucket counts for Prometheus plus a window of recent values for quantiles"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, window: int = QUANTILE_WINDOW):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        """Nearest-rank quantile of the recent window (0.0 when empty)"""
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_float(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    Process-wide histograms and counters fed by finished request traces.
+
+    Thread-safe; shared by every backend and session of the process, like the
+    default registry of a Prometheus client library.
+    """
+
+    def __init__(self, namespace: str = NAMESPACE):
+        """
+        Args:
+            namespace: Prefix of the exported metric names
+        """
+        self.namespace = namespace
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        # Objects with collect_metrics() -> {name: value}, read at export time; held weakly
+        self._collectors = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.json_log: Optional[logging.Logger] = None
+
+    def observe(self, name: str, value: float, **labels):
+        """Add an observation to a histogram series"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Increase a counter series"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def register_collector(self, collector):
+        """
+        Export the live values of a long-lived object (e.g. the embedding batcher's counters)
+
+        Args:
+            collector: Object with collect_metrics() -> {metric name: value}; values of the
+                same name from several collectors are added up
+        """
+        with self._lock:
+            self._collectors.add(collector)
+
+    def collected(self) -> Dict[str, float]:
+        """Current values of the registered collectors, summed by name"""
+        with self._lock:
+            collectors = list(self._collectors)
+        values: Dict[str, float] = {}
+        for collector in collectors:
+            for name, value in collector.collect_metrics().items():
+                values[name] = values.get(name, 0) + value
+        return values
+
+    def record(self, trace: Trace, outcome: str = "ok"):
+        """Fold a finished request into the histograms and counters, and log it as JSON"""
+        summary = trace.summary()
+        self.observe("request_duration_seconds", summary["total_ms"] / 1000, operation=trace.operation)
+        for stage, ms in summary["stages_ms"].items():
+            self.observe("stage_duration_seconds", ms / 1000, stage=stage)
+        self.inc("requests_total", operation=trace.operation, outcome=outcome)
+        for name, amount in summary["counts"].items():
+            self.inc(f"{name}_total", amount)
+
+        if self.json_log is not None:
+            record = {"event": "request", "timestamp": round(trace.timestamp, 3), "outcome": outcome, **summary}
+            self.json_log.info(json.dumps(record, ensure_ascii=False))
+
+    def percentiles(self, name: str, label: str, quantiles: Tuple[float, ...] = (0.5, 0.95)) -> Dict[str, Dict]:
+        """
+        Recent quantiles of a histogram, per value of one label
+
+        Args:
+            name: Histogram name, e.g. "stage_duration_seconds"
+            label: Label to group by, e.g. "stage"
+            quantiles: Quantiles to compute
+
+        Returns:
+            {label value: {"p50_ms": ..., "p95_ms": ..., "count": ...}}
+        """
+        with self._lock:
+            series = [
+                (dict(labels).get(label, ""), histogram) for (hist_name, labels), histogram in self._histograms.items()
+                if hist_name == name
+            ]
+            result = {}
+            for value, histogram in series:
+                stats = {f"p{round(q * 100)}_ms": round(histogram.quantile(q) * 1000, 1) for q in quantiles}
+                stats["count"] = histogram.count
+                result[value] = stats
+            return result
+
+    def stage_percentiles(self) -> Dict[str, Dict]:
+        """Recent p50/p95 (ms) and observation count of every pipeline stage, in pipeline order"""
+        stages = self.percentiles("stage_duration_seconds", "stage")
+        order = {stage: i for i, stage in enumerate(PIPELINE_STAGES)}
+        return dict(sorted(stages.items(), key=lambda item: (order.get(item[0], len(order)), item[0])))
+
+    def request_percentiles(self) -> Dict[str, Dict]:
+        """Recent p50/p95 (ms) and observation count of every request operation"""
+        return self.percentiles("request_duration_seconds", "operation")
+
+    def to_prometheus(self) -> str:
+        """All series in the Prometheus text exposition format (version 0.0.4)"""
+        lines: List[str] = []
+        collected = self.collected()
+        with self._lock:
+            names = sorted({name for name, _ in self._histograms} | {name for name, _ in self._counters} | set(collected))
+            for name in names:
+                full_name = f"{self.namespace}_{name}"
+                default_kind = "counter" if name.endswith("_total") else "gauge" if name in collected else "histogram"
+                kind, help_text = METRIC_HELP.get(name, (default_kind, name))
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                if name in collected:
+                    lines.append(f"{full_name} {_format_float(collected[name])}")
+                for (series_name, labels), value in sorted(self._counters.items()):
+                    if series_name == name:
+                        lines.append(f"{full_name}{_format_labels(labels)} {_format_float(value)}")
+                for (series_name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if series_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets + (float("inf"),), histogram.bucket_counts):
+                        cumulative += bucket_count
+                        bucket_labels = _format_labels(labels, (("le", _format_float(bound)),))
+                        lines.append(f"{full_name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_float(histogram.sum)}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Drop every series (e.g. between benchmark runs)"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+# Default registry every trace reports to
+REGISTRY = MetricsRegistry()
+
+
+def current_trace() -> Optional[Trace]:
+    """Trace of the request running in this context, if any"""
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(operation: str, registry: Optional[MetricsRegistry] = None) -> Iterator[Trace]:
+    """
+    Time a request; stages recorded inside it (with span/count) belong to it
+
+    Nested calls join the outer request instead of starting their own, so a
+    voice question's transcription and answer end up in one trace. Only the
+    outermost trace is recorded in the registry.
+    """
+    active = _current_trace.get()
+    if active is not None:
+        yield active
+        return
+
+    request_trace = Trace(operation)
+    token = _current_trace.set(request_trace)
+    outcome = "ok"
+    try:
+        yield request_trace
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        (registry or REGISTRY).record(request_trace, outcome)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a pipeline stage of the current request (does nothing outside a request)"""
+    active = _current_trace.get()
+    if active is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.add_stage(stage, (time.perf_counter() - started) * 1000)
+
+
+def count(name: str, amount: int):
+    """Add to a counter of the current request (does nothing outside a request)"""
+    active = _current_trace.get()
+    if active is not None and amount:
+        active.count(name, int(amount))
+
+
+def annotate(**attributes):
+    """Attach attributes (e.g. cached=True) to the current request's summary"""
+    active = _current_trace.get()
+    if active is not None:
+        active.attributes.update(attributes)
+
+
+def mark(stage: str):
+    """Record the time since the current request started as a stage (e.g. time to first chunk)"""
+    active = _current_trace.get()
+    if active is not None:
+        active.add_stage(stage, active.elapsed_ms())
+
+
+def timed_iter(iterable: Iterable, stage: str) -> Iterator:
+    """Iterate, adding only the time spent producing items (not consuming them) to a stage"""
+    iterator = iter(iterable)
+    while True:
+        with span(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def _attach(result, request_trace: Trace):
+    if isinstance(result, dict):
+        result["metrics"] = request_trace.summary()
+    return result
+
+
+def traced(operation: str) -> Callable:
+    """
+    Decorator running a function (plain, async or generator) as a traced request
+
+    Dict results get the request summary under "metrics"; for generators, so
+    does the response dict of a {"type": "response", "response": ...} event.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with trace(operation) as request_trace:
+                    result = await func(*args, **kwargs)
+                return _attach(result, request_trace)
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                # The trace is only active while the generator runs, not while the caller
+                # handles its events, so it never leaks into the caller's context
+                active = _current_trace.get()
+                request_trace = active or Trace(operation)
+                generator = func(*args, **kwargs)
+                outcome = "ok"
+                try:
+                    while True:
+                        token = _current_trace.set(request_trace)
+                        try:
+                            event = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            _current_trace.reset(token)
+                        if isinstance(event, dict) and event.get("type") == "response":
+                            _attach(event.get("response"), request_trace)
+                        yield event
+                except GeneratorExit:
+                    outcome = "cancelled"
+                    raise
+                except BaseException:
+                    outcome = "error"
+                    raise
+                finally:
+                    generator.close()
+                    if active is None:
+                        REGISTRY.record(request_trace, outcome)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace(operation) as request_trace:
+                result = func(*args, **kwargs)
+            return _attach(result, request_trace)
+        return wrapper
+    return decorator
+
+
+def configure_json_log(destination: str, registry: Optional[MetricsRegistry] = None) -> logging.Logger:
+    """
+    Log one JSON line per finished request
+
+    Args:
+        destination: File to append to, or "-" / "stdout" for standard output
+        registry: Registry whose requests are logged (defaults to REGISTRY)
+
+    Returns:
+        The "farm_bot.metrics" logger (add handlers to it to ship the lines elsewhere)
+    """
+    registry = registry or REGISTRY
+    logger = logging.getLogger("farm_bot.metrics")
+    if registry.json_log is None:
+        if destination in ("-", "stdout"):
+            handler = logging.StreamHandler(sys.stdout)
+        else:
+            handler = logging.FileHandler(destination, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        registry.json_log = logger
+    return logger
+
+
+_servers: Dict[int, ThreadingHTTPServer] = {}
+_servers_lock = threading.Lock()
+
+
+def start_http_server(port: int, address: str = "0.0.0.0",
+                      registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """
+    Serve the registry at http://address:port/metrics for Prometheus to scrape
+
+    Starting the same port twice returns the running server, so every backend
+    of a process can call this.
+    """
+    registry = registry or REGISTRY
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _servers_lock:
+        if port not in _servers:
+            server = ThreadingHTTPServer((address, port), MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            _servers[port] = server
+        return _servers[port]
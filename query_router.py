@@ -0,0 +1,150 @@
+# query_router.py
+# Fast local routing of questions: new topic, follow-up on the previous answer, or small talk
+
+import re
+from typing import Iterable, Optional, Set, Tuple
+
+# Routes
+NEW = "new"                # search the knowledge base
+FOLLOW_UP = "follow_up"    # answer from the previous turn's context, no new search
+CHIT_CHAT = "chit_chat"    # greetings, thanks, acknowledgements: no search, no model call
+ROUTES = (NEW, FOLLOW_UP, CHIT_CHAT)
+
+# Pipeline stages (see metrics.PIPELINE_STAGES) each route skips compared with a new question
+SKIPPED_STAGES = {
+    NEW: (),
+    FOLLOW_UP: ("embed", "search"),
+    CHIT_CHAT: ("embed", "search", "prompt", "generate"),
+}
+
+# Referential wording that marks a question as a follow-up to the previous answer
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|it's|this|that|these|those|they|them|their|same|again|above|previous|more)\b"
+    r"|^(what|how) about\b|^(and|also|so|then)\b|\b(explain|elaborate|repeat|else)\b",
+    re.IGNORECASE
+)
+
+# Small talk, by kind, matched against the whole (normalized) message
+CHIT_CHAT_PHRASES = {
+    "thanks": r"thanks?(?: you)?(?: (?:so|very) much| a lot)?|thx|ty|dhanyavad|shukriya",
+    "greeting": r"hi+|hello|hey|namaste|namaskar|good (?:morning|afternoon|evening)",
+    "farewell": r"bye|goodbye|see you|good night",
+    "ack": r"ok(?:ay)?|fine|got it|great|nice|good|cool|understood|alright|sure|perfect",
+}
+_CHIT_CHAT_ADDRESS = r"(?: (?:sir|madam|there|again|friend|bot|agroai))?"
+_CHIT_CHAT_PATTERN = re.compile(
+    r"^(?:(?:" + "|".join(CHIT_CHAT_PHRASES.values()) + r")" + _CHIT_CHAT_ADDRESS + r" ?)+$"
+)
+_CHIT_CHAT_KINDS = [(kind, re.compile(r"\b(?:" + pattern + r")\b")) for kind, pattern in CHIT_CHAT_PHRASES.items()]
+
+CHIT_CHAT_REPLIES = {
+    "thanks": "You're welcome! Feel free to ask me anything else about your crops.",
+    "greeting": "Namaste! I'm AgroAI. Ask me about crops, pests, fertilizers, weather or government schemes.",
+    "farewell": "Goodbye, and all the best with your farming!",
+    "ack": "Glad that helps. Is there anything else you'd like to know about your farm?",
+}
+
+# A word in any script (\w alone splits Hindi words at vowel signs, which are combining marks; dandas excluded)
+WORD_PATTERN = re.compile(r"[\w\u0900-\u0963\u0966-\u0dff]+")
+
+# New words a follow-up may bring in: they ask about the previous subject rather than name another
+FOLLOW_UP_ATTRIBUTES = {
+    "cost", "costs", "price", "prices", "rate", "rates", "expense", "budget", "subsidy", "dose", "doses",
+    "dosage", "quantity", "amount", "time", "timing", "duration", "days", "weeks", "interval", "frequency",
+    "often", "stage", "acre", "hectare", "litre", "liter", "apply", "application", "spray", "mix", "method",
+    "procedure", "process", "steps", "step", "side", "effect", "effects", "safe", "safety", "precautions",
+    "benefit", "benefits", "advantage", "advantages", "alternative", "alternatives", "detail", "details",
+    "reason", "available", "buy", "work", "works", "effective", "useful",
+}
+
+# Words that carry no topic of their own
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "do", "does", "did", "can", "could", "should", "would",
+    "will", "i", "me", "my", "we", "our", "you", "your", "what", "which", "who", "when", "where", "why", "how",
+    "of", "for", "to", "in", "on", "at", "by", "with", "from", "about", "and", "or", "but", "if", "so", "then",
+    "also", "it", "its", "it's", "this", "that", "these", "those", "they", "them", "their", "same", "again",
+    "above", "previous", "more", "else", "please", "tell", "explain", "elaborate", "repeat", "give", "any",
+    "some", "much", "many", "there", "here", "than", "other", "one", "use", "get", "need", "know", "say",
+}
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase words only (any script), single-spaced; emoji and punctuation dropped"""
+    return " ".join(WORD_PATTERN.findall(text.lower()))
+
+
+def content_words(text: str) -> Set[str]:
+    """Topic-bearing words of a text"""
+    return {word for word in WORD_PATTERN.findall(text.lower()) if len(word) > 2 and word not in STOPWORDS}
+
+
+def label_terms(labels: Iterable[str]) -> Set[str]:
+    """Topic words of knowledge base labels (e.g. irrigation and cotton from Irrigation / Cotton)"""
+    terms = set()
+    for label in labels:
+        terms |= content_words(label)
+    return terms
+
+
+class QueryRouter:
+    """
+    Rule-based question router; no model or network call, microseconds per question.
+
+    Small talk is recognized when the whole message is made of greetings,
+    thanks or acknowledgements. A question is a follow-up when there is a
+    previous turn, it uses referential wording ("it", "that", "what about",
+    "explain ... again") and every topic word the previous question and answer
+    did not already contain is an attribute of that subject (FOLLOW_UP_ATTRIBUTES,
+    at most max_new_terms of them). Any other new word, e.g. a crop ("and for
+    mango?"), needs a new search.
+    """
+
+    def __init__(self, max_new_terms: int = 2):
+        """
+        Args:
+            max_new_terms: Most attribute words a follow-up may introduce (e.g. "cost" in "what about its cost?")
+        """
+        self.max_new_terms = max_new_terms
+
+    def route(self, question: str, previous_question: Optional[str] = None,
+              previous_answer: Optional[str] = None, subject_terms: Optional[Set[str]] = None) -> Tuple[str, str]:
+        """
+        Classify a question
+
+        Args:
+            question: The farmer's message
+            previous_question: Last question that was answered from the knowledge base, if any
+            previous_answer: Answer to previous_question
+            subject_terms: Words that name a new subject (see label_terms)
+
+        Returns:
+            (route, reason) with route one of ROUTES
+        """
+        normalized = normalize_message(question)
+        # Only whole-message greetings and thanks are small talk; nothing recognizable goes to the search
+        if normalized and _CHIT_CHAT_PATTERN.match(normalized):
+            return CHIT_CHAT, "small talk"
+        if not previous_question:
+            return NEW, "no previous topic"
+        if not FOLLOW_UP_PATTERN.search(question):
+            return NEW, "no reference to the previous answer"
+
+        new_terms = content_words(question) - content_words(f"{previous_question} {previous_answer or ''}")
+        new_subjects = new_terms & (subject_terms or set())
+        if new_subjects:
+            return NEW, f"new subject: {', '.join(sorted(new_subjects))}"
+        unknown_terms = new_terms - FOLLOW_UP_ATTRIBUTES
+        if unknown_terms:
+            return NEW, f"new topic words: {', '.join(sorted(unknown_terms))}"
+        if len(new_terms) > self.max_new_terms:
+            return NEW, f"{len(new_terms)} new topic words"
+        return FOLLOW_UP, "refers to the previous answer"
+
+    @staticmethod
+    def chit_chat_reply(question: str) -> str:
+        """Canned reply to small talk"""
+        normalized = normalize_message(question)
+        for kind, pattern in _CHIT_CHAT_KINDS:
+            if pattern.search(normalized):
+                return CHIT_CHAT_REPLIES[kind]
+        return CHIT_CHAT_REPLIES["ack"]
@@ -0,0 +1,155 @@
+# sqlite_docstore.py
+# Read-only, lazily queried SQLite docstore that replaces the pickled LangChain docstore
+
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+
+# Saved in the vector database directory next to index.faiss
+DOCSTORE_FILE = "docstore.sqlite"
+
+# Values bound per IN (...) query; older SQLite builds allow at most 999 parameters
+MAX_QUERY_PARAMETERS = 900
+
+
+class SQLiteDocstore(Docstore):
+    """
+    Documents of a vector database, stored one row per FAISS position.
+
+    Nothing is loaded up front: each lookup is a primary-key query, so opening
+    the store costs the same for 30 documents or a million, and the pages read
+    are shared with other processes through the OS page cache. Connections are
+    per thread and read-only.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite file written by SQLiteDocstore.write
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Docstore not found at {path}")
+        self.path = path
+        self._local = threading.local()
+        meta = dict(self._connection().execute("SELECT key, value FROM meta").fetchall())
+        self.count = int(meta["count"])
+        self.digest = meta.get("digest")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def write(path: str, documents: Iterable[Tuple[str, Document]], digest: Optional[str] = None):
+        """
+        Write documents to a new SQLite docstore
+
+        Args:
+            path: File to create (must not exist yet)
+            documents: (docstore id, document) pairs in FAISS position order
+            digest: Fingerprint of the id order (see metadata_index.id_order_digest)
+        """
+        connection = sqlite3.connect(path)
+        try:
+            connection.execute(
+                "CREATE TABLE documents (position INTEGER PRIMARY KEY, doc_id TEXT NOT NULL UNIQUE, "
+                "page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            rows = (
+                (position, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                for position, (doc_id, doc) in enumerate(documents)
+            )
+            with connection:
+                connection.executemany("INSERT INTO documents VALUES (?, ?, ?, ?)", rows)
+                count = connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+                connection.executemany(
+                    "INSERT INTO meta VALUES (?, ?)",
+                    [("count", str(count)), ("digest", digest)]
+                )
+        finally:
+            connection.close()
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Look up a document by docstore id (LangChain Docstore interface)"""
+        row = self._connection().execute(
+            "SELECT doc_id, page_content, metadata FROM documents WHERE doc_id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=row[0], page_content=row[1], metadata=json.loads(row[2]))
+
+    def doc_id_at(self, position: int) -> str:
+        """Docstore id of the document at a FAISS position"""
+        row = self._connection().execute(
+            "SELECT doc_id FROM documents WHERE position = ?", (position,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def _select_in(self, sql: str, values: List) -> List[Tuple]:
+        """Rows of a query with one IN (?, ...) placeholder group, in as few queries as the parameter limit allows"""
+        rows = []
+        for start in range(0, len(values), MAX_QUERY_PARAMETERS):
+            chunk = values[start:start + MAX_QUERY_PARAMETERS]
+            placeholders = ", ".join("?" * len(chunk))
+            rows.extend(self._connection().execute(sql.format(placeholders), chunk).fetchall())
+        return rows
+
+    def doc_ids_at(self, positions: Iterable[int]) -> Dict[int, str]:
+        """Docstore ids of several FAISS positions in one query (positions not in the store are left out)"""
+        positions = list(dict.fromkeys(int(position) for position in positions))
+        return dict(self._select_in("SELECT position, doc_id FROM documents WHERE position IN ({})", positions))
+
+    def contents_for(self, doc_ids: Iterable[str]) -> Dict[str, str]:
+        """Page content of several documents by docstore id in one query (unknown ids are left out)"""
+        doc_ids = list(dict.fromkeys(doc_ids))
+        return dict(self._select_in("SELECT doc_id, page_content FROM documents WHERE doc_id IN ({})", doc_ids))
+
+    def iter_documents(self) -> Iterator[Tuple[str, Document]]:
+        """All (docstore id, document) pairs in position order"""
+        rows = self._connection().execute(
+            "SELECT doc_id, page_content, metadata FROM documents ORDER BY position"
+        )
+        for doc_id, page_content, metadata in rows:
+            yield doc_id, Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+
+    def iter_contents(self) -> Iterator[Tuple[str, str]]:
+        """All (docstore id, page content) pairs in position order, without decoding metadata"""
+        yield from self._connection().execute("SELECT doc_id, page_content FROM documents ORDER BY position")
+
+    def position_map(self) -> "PositionMap":
+        """Lazy FAISS position -> docstore id mapping, usable as index_to_docstore_id"""
+        return PositionMap(self)
+
+
+class PositionMap(Mapping):
+    """index_to_docstore_id backed by the SQLite docstore instead of an in-memory dict"""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position: int) -> str:
+        if not 0 <= position < self.docstore.count:
+            raise KeyError(position)
+        return self.docstore.doc_id_at(int(position))
+
+    def get_many(self, positions: Iterable[int]) -> Dict[int, str]:
+        """Docstore ids of several positions in one query"""
+        return self.docstore.doc_ids_at(positions)
+
+    def __len__(self) -> int:
+        return self.docstore.count
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.docstore.count))
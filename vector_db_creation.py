@@ -1,61 +1,588 @@
 """
 this script creates a vector database using openai embedding, faiss and Langchain
+
+Rebuilds are incremental: a manifest stores a content hash per record id next to the
+saved index, together with the embedding of every record. Only added or changed
+records are sent to the embedding API, deleted ones are dropped, and the index is
+rewritten from the stored vectors, giving the same result as a full rebuild.
+A BM25 keyword index over each record's search_text and the region/topic
+partitions used by filtered searches are saved alongside it.
+
+Nothing is pickled: documents go to a SQLite docstore and the side indexes
+are plain .npy arrays, so the app can memory-map the whole database.
+
+Each build is written to a new directory under <output>/versions/ and published
+by atomically rewriting <output>/CURRENT, so running apps can switch to it
+without a restart (see index_versions.py). Old versions are pruned.
+
+Input is streamed (a JSON list or JSON Lines) and embedded in batches by a small
+worker pool that backs off on rate limits. Every finished batch is checkpointed
+under the output directory, so an interrupted build picks up where it stopped.
+
+The FAISS index type comes from a factory string (--index-factory or
+FAISS_INDEX_FACTORY), e.g. "Flat" (exact, the default), "HNSW32",
+"IVF1024,PQ32" or "IVF1024,SQ8". Index types that need training are trained
+on the corpus vectors.
+
+Usage:
+    python vector_db_creation.py [--data data.json|data.jsonl] [--output faiss_index] [--full]
+                                 [--batch-size 256] [--concurrency 4] [--max-retries 6] [--restart]
+                                 [--index-factory Flat] [--keep-versions 3]
 """
+import argparse
+import hashlib
 import json
 import os
+import random
+import re
+import shutil
 import sys
-from typing import List, Dict
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+import openai
 from dotenv import load_dotenv
 
 # LangChain imports
 from langchain_openai import AzureOpenAIEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.docstore.document import Document
+
+from index_versions import current_path, discard_version, new_version, prune_versions, publish_version, version_path
+from keyword_index import KEYWORD_INDEX_DIR, BM25Index
+from metadata_index import PARTITIONS_DIR, MetadataPartitions, id_order_digest
+from sqlite_docstore import DOCSTORE_FILE, SQLiteDocstore
 # Load environment variables
 load_dotenv()
 
-embeddings = AzureOpenAIEmbeddings(
+# Files kept next to the FAISS index for incremental rebuilds
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+MANIFEST_VERSION = 1
+
+INDEX_FILE = "index.faiss"
+# Unversioned files written directly in the output directory by earlier versions,
+# removed once a versioned copy is published
+LEGACY_FILES = ("index.faiss", "index.pkl", "docstore.sqlite", "embeddings.npy", "manifest.json",
+                "bm25", "partitions", "bm25.npz", "partitions.npz")
+
+# Finished embedding batches of an interrupted build, cleared after a successful save
+CHECKPOINT_DIR = ".checkpoint"
+CHECKPOINT_INFO = "info.json"
+
+# Errors worth retrying; anything else (bad key, bad request) fails the build right away
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def get_embeddings(max_retries: int = 2) -> AzureOpenAIEmbeddings:
+    """
+    Embeddings model used for indexing (queries must use the same deployment)
+
+    Args:
+        max_retries: Retries done by the OpenAI client itself (the ingestion
+            pipeline turns these off and backs off on its own)
+    """
+    return AzureOpenAIEmbeddings(
                 azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
                 openai_api_version="2024-12-01-preview",
-                azure_endpoint="https://azureopenaigenai2.openai.azure.com/",
+                azure_endpoint=os.getenv("AZURE_ENDPOINT_VB", "https://azureopenaigenai2.openai.azure.com/"),
                 openai_api_key=os.getenv("AZURE_OPENAI_API_KEY_VB"),
-                chunk_size=1000
+                chunk_size=1000,
+                max_retries=max_retries,
+                # Token-length check with tiktoken, whose encoding files are downloaded on first use
+                check_embedding_ctx_length=os.getenv("EMBEDDING_CHECK_CTX_LENGTH", "true").lower() not in ("0", "false", "no")
             )
-with open("data.json", 'r', encoding='utf-8') as file:
-                data = json.load(file)
-def create_documtents(json_data: List[Dict]) -> List[Document]:
-    """Converts json data to langchain documents"""
-    documents = []
 
-    for item in json_data:
-        doc_text = f"""
+
+def load_data(path: str) -> List[Dict]:
+    """Load the knowledge base records"""
+    return list(iter_records(path))
+
+
+def iter_records(path: str) -> Iterator[Dict]:
+    """
+    Stream knowledge base records without loading the whole file
+
+    Files ending in .jsonl / .ndjson are read as one record per line, anything
+    else as a JSON list of records.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line_number, line in enumerate(file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{path}:{line_number}: invalid JSON record ({e})") from e
+        else:
+            yield from iter_json_list(file)
+
+
+def iter_json_list(file: IO[str], chunk_size: int = 1 << 16) -> Iterator[Dict]:
+    """Yield the items of a top-level JSON list one at a time, reading the file in chunks"""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON list of records (use a .jsonl file for one record per line)")
+    pos = 1
+
+    while True:
+        pos = _SEPARATORS.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            if pos == len(buffer):
+                raise json.JSONDecodeError("Incomplete record", buffer, pos)
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise ValueError("Truncated or invalid JSON list of records")
+            # Keep only the unparsed tail so the buffer stays about one chunk long
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+        pos = end
+
+
+def create_document(item: Dict) -> Document:
+    """Converts one json record to a langchain document"""
+    doc_text = f"""
         Full Context: This advisory is about {item['topic']} in {item['region']}. The question asked is "{item['question']}", and the recommended answer is "{item['answer']}".
 """
-        
-        doc = Document(
-            page_content = doc_text,
-            metadata = {  # adding metadeta so that i can use them later for retrieving based on the filter or using for keyword search
-                "id": item["id"],
-                "region": item["region"],
-                "topic": item["topic"],
-                "search_text": f"{item['question']} {item['answer']} {item['region']} {item['topic']}",
-            }
-        )
 
-        documents.append(doc) 
+    return Document(
+        page_content = doc_text,
+        metadata = {  # adding metadeta so that i can use them later for retrieving based on the filter or using for keyword search
+            "id": item["id"],
+            "region": item["region"],
+            "topic": item["topic"],
+            "search_text": f"{item['question']} {item['answer']} {item['region']} {item['topic']}",
+        }
+    )
+
+
+def create_documtents(json_data: Iterable[Dict]) -> List[Document]:
+    """Converts json data to langchain documents"""
+    documents = [create_document(item) for item in json_data]
     print(f"Created {len(documents)} documents for vector indexing")
     return documents
 
 
-def create_vector_store(documents: List[Document]) -> FAISS:
-    """Create FAISS vector store from documents"""
+def document_hash(doc: Document) -> str:
+    """Content hash of everything that ends up in the index for a document"""
+    payload = json.dumps(
+        {"page_content": doc.page_content, "metadata": doc.metadata},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_manifest(index_path: str, deployment: Optional[str]) -> Dict[str, Tuple[str, np.ndarray]]:
+    """
+    Load the hash and stored embedding of every record in an existing index
+
+    Falls back to reading the vectors out of a saved flat index that predates the
+    manifest. Returns an empty mapping when nothing reusable exists or when the
+    index was built with another embedding deployment.
+
+    Returns:
+        Mapping of record id (as str) to (content hash, embedding)
+    """
+    manifest_path = os.path.join(index_path, MANIFEST_FILE)
+    embeddings_path = os.path.join(index_path, EMBEDDINGS_FILE)
+
+    if os.path.exists(manifest_path) and os.path.exists(embeddings_path):
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("embedding_deployment") != deployment:
+            print("Manifest is from another format or embedding deployment, re-embedding everything")
+            return {}
+        # Memory-mapped so unchanged vectors are only read when the index is written
+        vectors = np.load(embeddings_path, mmap_mode="r")
+        return {
+            record["id"]: (record["hash"], vectors[row])
+            for row, record in enumerate(manifest["records"])
+        }
+
+    if os.path.exists(os.path.join(index_path, INDEX_FILE)):
+        return bootstrap_manifest(index_path)
+
+    return {}
 
+
+def bootstrap_manifest(index_path: str) -> Dict[str, Tuple[str, np.ndarray]]:
+    """Recover hashes and vectors from an index saved before manifests existed"""
     try:
-        vector_store = FAISS.from_documents(documents, embeddings)
-        print("vectore store created successfully")
-        return vector_store
+        if os.path.exists(os.path.join(index_path, DOCSTORE_FILE)):
+            index = faiss.read_index(os.path.join(index_path, INDEX_FILE))
+            stored = SQLiteDocstore(os.path.join(index_path, DOCSTORE_FILE)).iter_documents()
+        else:
+            # Embeddings are not needed to read stored vectors, only to embed new queries
+            vector_store = FAISS.load_local(index_path, None, allow_dangerous_deserialization=True)
+            index = vector_store.index
+            stored = (
+                (vector_store.index_to_docstore_id[i], vector_store.docstore.search(vector_store.index_to_docstore_id[i]))
+                for i in range(index.ntotal)
+            )
+        vectors = index.reconstruct_n(0, index.ntotal)
+        stored = list(stored)
+    except Exception as e:
+        print(f"Could not reuse vectors from existing index ({e}), re-embedding everything")
+        return {}
+
+    previous = {}
+    for position, (_, doc) in enumerate(stored):
+        if isinstance(doc, Document) and "id" in doc.metadata:
+            previous[str(doc.metadata["id"])] = (document_hash(doc), vectors[position])
+    print(f"Recovered {len(previous)} vectors from existing index")
+    return previous
+
+
+def open_checkpoint(index_path: str, deployment: Optional[str], restart: bool = False) -> Tuple[str, Dict[str, np.ndarray]]:
+    """
+    Prepare the checkpoint directory of a build and load batches finished by an earlier run
+
+    Returns:
+        (checkpoint directory, mapping of content hash to embedding)
+    """
+    checkpoint_dir = os.path.join(index_path, CHECKPOINT_DIR)
+    info_path = os.path.join(checkpoint_dir, CHECKPOINT_INFO)
+
+    if os.path.isdir(checkpoint_dir) and not restart:
+        try:
+            with open(info_path, 'r', encoding='utf-8') as file:
+                restart = json.load(file).get("embedding_deployment") != deployment
+        except (OSError, ValueError):
+            restart = True
+    if restart and os.path.isdir(checkpoint_dir):
+        print("Discarding checkpointed batches of a previous build")
+        shutil.rmtree(checkpoint_dir)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(info_path, 'w', encoding='utf-8') as file:
+        json.dump({"embedding_deployment": deployment}, file)
+
+    checkpointed = {}
+    for name in sorted(os.listdir(checkpoint_dir)):
+        if not name.endswith(".npz"):
+            continue
+        with np.load(os.path.join(checkpoint_dir, name)) as batch:
+            checkpointed.update(zip(batch["hashes"].tolist(), batch["vectors"]))
+    if checkpointed:
+        print(f"Resuming with {len(checkpointed)} checkpointed embeddings")
+    return checkpoint_dir, checkpointed
+
+
+def save_checkpoint(checkpoint_dir: str, hashes: List[str], vectors: np.ndarray):
+    """Persist one embedded batch, keyed by the content hashes it covers"""
+    name = "batch-" + hashlib.sha256("".join(hashes).encode("utf-8")).hexdigest()[:24] + ".npz"
+    fd, tmp_path = tempfile.mkstemp(dir=checkpoint_dir, suffix=".tmp")
+    with os.fdopen(fd, 'wb') as file:
+        np.savez(file, hashes=np.array(hashes), vectors=vectors)
+    os.replace(tmp_path, os.path.join(checkpoint_dir, name))
+
+
+def retry_delay(error: Exception, attempt: int, max_delay: float = 60.0) -> float:
+    """Seconds to wait before retrying, honouring Retry-After when the API sends one"""
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return min(float(response.headers.get("retry-after")), max_delay)
+        except (TypeError, ValueError):
+            pass
+    # Exponential backoff with jitter so parallel workers don't retry in lockstep
+    return min(max_delay, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def embed_with_backoff(embeddings: AzureOpenAIEmbeddings, texts: List[str], max_retries: int) -> np.ndarray:
+    """Embed a batch of texts, retrying rate limits and transient API errors"""
+    for attempt in range(max_retries + 1):
+        try:
+            return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = retry_delay(e, attempt)
+            print(f"{type(e).__name__} on a batch of {len(texts)}, retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+
+class EmbeddingPipeline:
+    """
+    Streams documents through batched, concurrent embedding
+
+    Records whose content hash matches the previous manifest or an earlier
+    checkpoint reuse their stored vector. The rest are grouped into batches and
+    embedded by a bounded worker pool; each finished batch is checkpointed by
+    the worker before its result is collected.
+    """
+
+    def __init__(self, embeddings: AzureOpenAIEmbeddings, previous: Dict[str, Tuple[str, np.ndarray]],
+                 checkpoint_dir: str, checkpointed: Dict[str, np.ndarray],
+                 batch_size: int = 256, concurrency: int = 4, max_retries: int = 6):
+        """
+        Args:
+            embeddings: Embeddings model used for indexing
+            previous: Record id -> (content hash, vector) from the last build
+            checkpoint_dir: Directory where finished batches are saved
+            checkpointed: Content hash -> vector from an interrupted build
+            batch_size: Records per embedding request
+            concurrency: Embedding requests in flight at once
+            max_retries: Retries per batch on rate limits and transient errors
+        """
+        self.embeddings = embeddings
+        self.previous = previous
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpointed = checkpointed
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+
+        self.documents = []
+        self.hashes = []
+        self.rows = []  # vector of each document, filled in as batches finish
+        self.counts = {"added": 0, "changed": 0, "unchanged": 0, "resumed": 0}
+        self.queued = 0
+        self.embedded = 0
+        self.started = None
+
+    def _embed_batch(self, texts: List[str], hashes: List[str]) -> np.ndarray:
+        """Worker task: embed one batch and checkpoint it"""
+        vectors = embed_with_backoff(self.embeddings, texts, self.max_retries)
+        save_checkpoint(self.checkpoint_dir, hashes, vectors)
+        return vectors
+
+    def _submit(self, executor: ThreadPoolExecutor, inflight: Dict[Future, List[int]], batch: List[int]):
+        texts = [self.documents[i].page_content for i in batch]
+        hashes = [self.hashes[i] for i in batch]
+        inflight[executor.submit(self._embed_batch, texts, hashes)] = batch
+        self.queued += len(batch)
+
+    def _collect(self, inflight: Dict[Future, List[int]], done: Iterable[Future]):
+        for future in done:
+            batch = inflight.pop(future)
+            for i, vector in zip(batch, future.result()):
+                self.rows[i] = vector
+            self.embedded += len(batch)
+            elapsed = time.perf_counter() - self.started
+            print(f"Embedded {self.embedded}/{self.queued} queued records "
+                  f"({self.embedded / elapsed:.1f} records/sec)")
+
+    def run(self, documents: Iterable[Document]) -> Tuple[List[Document], np.ndarray, List[str]]:
+        """
+        Get a vector for every document, embedding only added or changed ones
+
+        Returns:
+            (documents, matrix of vectors in document order, content hashes in document order)
+        """
+        self.started = time.perf_counter()
+        seen = set()
+        batch = []
+        inflight = {}
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            for doc in documents:
+                record_id = str(doc.metadata["id"])
+                if record_id in seen:
+                    raise ValueError(f"Record ids in the data file must be unique (duplicate id {record_id})")
+                seen.add(record_id)
+
+                content_hash = document_hash(doc)
+                row = len(self.documents)
+                self.documents.append(doc)
+                self.hashes.append(content_hash)
+                self.rows.append(None)
+
+                known = self.previous.get(record_id)
+                if known is not None and known[0] == content_hash:
+                    self.rows[row] = known[1]
+                    self.counts["unchanged"] += 1
+                    continue
+
+                self.counts["changed" if known is not None else "added"] += 1
+                if content_hash in self.checkpointed:
+                    self.rows[row] = self.checkpointed[content_hash]
+                    self.counts["resumed"] += 1
+                    continue
+
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    self._submit(executor, inflight, batch)
+                    batch = []
+                    # Bound the work in flight so a huge input doesn't queue every request up front
+                    if len(inflight) >= 2 * self.concurrency:
+                        done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                        self._collect(inflight, done)
+
+            if batch:
+                self._submit(executor, inflight, batch)
+            while inflight:
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                self._collect(inflight, done)
+        except BaseException:
+            # Batches already running still finish and checkpoint themselves
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+        if not self.documents:
+            raise ValueError("No records found in the data file")
+
+        deleted = len(set(self.previous) - seen)
+        elapsed = time.perf_counter() - self.started
+        print(f"Records: {len(self.documents)} total, {self.counts['added']} added, "
+              f"{self.counts['changed']} changed, {deleted} deleted, {self.counts['unchanged']} unchanged"
+              + (f", {self.counts['resumed']} from checkpoint" if self.counts["resumed"] else ""))
+        print(f"Processed {len(self.documents)} records in {elapsed:.1f}s "
+              f"({len(self.documents) / elapsed:.1f} records/sec, {self.embedded} embedded)")
+
+        vectors = np.stack(self.rows).astype(np.float32, copy=False)
+        return self.documents, vectors, self.hashes
+
+
+def build_index(vectors: np.ndarray, index_factory: str = "Flat") -> faiss.Index:
+    """
+    Build a FAISS index of the given type and add the vectors to it
+
+    Args:
+        vectors: Embedding matrix (float32, one row per document)
+        index_factory: FAISS index factory string, e.g. "Flat", "HNSW32", "IVF1024,PQ32"
+
+    Returns:
+        The populated index
+    """
+    dimension = vectors.shape[1]
+    if index_factory == "Flat":
+        # Same index FAISS.from_embeddings creates
+        index = faiss.IndexFlatL2(dimension)
+    else:
+        index = faiss.index_factory(dimension, index_factory, faiss.METRIC_L2)
+
+    if not index.is_trained:
+        print(f"Training {index_factory} index on {len(vectors)} vectors")
+        started = time.perf_counter()
+        try:
+            index.train(vectors)
+        except RuntimeError as e:
+            raise ValueError(f"Could not train a {index_factory} index on {len(vectors)} vectors "
+                             f"(use fewer IVF lists / PQ centroids for a small corpus): {e}") from e
+        print(f"Trained in {time.perf_counter() - started:.1f}s")
+
+    index.add(vectors)
+    return index
+
+
+def save_index(index: faiss.Index, vectors: np.ndarray, documents: List[Document],
+               hashes: List[str], deployment: Optional[str], index_path: str, keep_versions: int = 3) -> str:
+    """
+    Save the index with its docstore, keyword index, partitions and manifest as a new version
+
+    The version is only published (CURRENT rewritten) once every file is written,
+    so apps watching the directory never see a partial build.
+
+    Returns:
+        The published version name
+    """
+    os.makedirs(index_path, exist_ok=True)
+    doc_ids = [str(doc.metadata["id"]) for doc in documents]
+    digest = id_order_digest(doc_ids)
+    version = new_version(index_path)
+    target = version_path(index_path, version)
+    try:
+        faiss.write_index(index, os.path.join(target, INDEX_FILE))
+        # Record ids double as docstore ids so rebuilds are deterministic
+        SQLiteDocstore.write(os.path.join(target, DOCSTORE_FILE), zip(doc_ids, documents), digest=digest)
+        BM25Index.build((doc.metadata["search_text"] for doc in documents), digest=digest).save(
+            os.path.join(target, KEYWORD_INDEX_DIR)
+        )
+        MetadataPartitions.build((doc.metadata for doc in documents), digest=digest).save(
+            os.path.join(target, PARTITIONS_DIR)
+        )
+        np.save(os.path.join(target, EMBEDDINGS_FILE), vectors)
+        with open(os.path.join(target, MANIFEST_FILE), 'w', encoding='utf-8') as file:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "embedding_deployment": deployment,
+                "records": [
+                    {"id": doc_id, "hash": content_hash}
+                    for doc_id, content_hash in zip(doc_ids, hashes)
+                ]
+            }, file, indent=1)
+    except BaseException:
+        discard_version(index_path, version)
+        raise
+
+    publish_version(index_path, version)
+
+    for name in LEGACY_FILES:
+        legacy_path = os.path.join(index_path, name)
+        if os.path.isdir(legacy_path):
+            shutil.rmtree(legacy_path, ignore_errors=True)
+        elif os.path.exists(legacy_path):
+            os.remove(legacy_path)
+    for stale in prune_versions(index_path, keep=keep_versions):
+        print(f"Removed old index version {stale}")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the FAISS knowledge base index")
+    parser.add_argument("--data", default="data.json", help="knowledge base records (JSON list, or .jsonl with one record per line)")
+    parser.add_argument("--output", default="faiss_index", help="directory of the saved index")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and re-embed every record")
+    parser.add_argument("--batch-size", type=int, default=256, help="records per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="embedding requests in flight at once")
+    parser.add_argument("--max-retries", type=int, default=6, help="retries per batch on rate limits and transient errors")
+    parser.add_argument("--restart", action="store_true", help="discard checkpointed batches of an interrupted build")
+    parser.add_argument("--index-factory", default=os.getenv("FAISS_INDEX_FACTORY", "Flat"),
+                        help='FAISS index type, e.g. "Flat", "HNSW32", "IVF1024,PQ32", "IVF1024,SQ8"')
+    parser.add_argument("--keep-versions", type=int, default=3,
+                        help="index versions to keep on disk, including the new one")
+    args = parser.parse_args()
+
+    deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+    # Retries are handled per batch by the pipeline
+    embeddings = get_embeddings(max_retries=0)
+
+    previous = {} if args.full else load_manifest(current_path(args.output), deployment)
+    checkpoint_dir, checkpointed = open_checkpoint(args.output, deployment, restart=args.restart)
+
+    pipeline = EmbeddingPipeline(
+        embeddings, previous, checkpoint_dir, checkpointed,
+        batch_size=args.batch_size, concurrency=args.concurrency, max_retries=args.max_retries
+    )
+    documents, vectors, hashes = pipeline.run(create_document(item) for item in iter_records(args.data))
+
+    try:
+        # Built directly rather than through FAISS.from_embeddings, which needs every
+        # vector as a Python list of floats and only makes flat indexes
+        index = build_index(vectors, args.index_factory)
+        print(f"vectore store created successfully ({args.index_factory}, {index.ntotal} vectors)")
     except Exception as e:
         print(f"error creating vector store {e}")
-documents = create_documtents(data)
-v_db = create_vector_store(documents)
-v_db.save_local("faiss_index")
\ No newline at end of file
+        raise
+    version = save_index(index, vectors, documents, hashes, deployment, args.output, keep_versions=args.keep_versions)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    print(f"Saved index with {len(documents)} records to {args.output} (version {version})")
+
+
+if __name__ == "__main__":
+    sys.exit(main())